@@ -52,6 +52,7 @@ from cbc2CalibrateChannelTrims import CalibrateChannelTrims
 
 from pythonlib.I2cChip import I2cRegister
 from pythonlib.I2cChip import I2cChip
+from pythonlib.I2cChip import registerFileCache
 
 class GlibControlService:
 	"""
@@ -82,6 +83,11 @@ class GlibControlService:
 
 	def __init__(self):
 		self.boardAddress = "192.168.0.175"
+		# Keep parsed I2C files on disk so that restarting this service doesn't have to parse
+		# them all again. Make the directory unique to the user to avoid permission problems.
+		try: usernameSuffix="_"+os.environ['USER']
+		except KeyError: usernameSuffix=""
+		registerFileCache.sidecarDirectory="/tmp/cbcTestStandTempFiles"+usernameSuffix+"/i2cCache"
 		self.program = SimpleGlibProgram( os.path.join( INSTALLATION_PATH, "runcontrol", "GlibSuper.xml" ) )
 		
 		# Need to specify the environment variables required to run XDAQ. To get them use the system
@@ -93,7 +99,7 @@ class GlibControlService:
 
 		# Need to provide the full executable path because this might not be in the path for different users
 		# When the analyser is spawned it takes on the environment of this script, so I'll modify that directly
-		self.analysisControl = AnalyserControl( "127.0.0.1", "50000", True, environmentVariables )
+		self.analysisControl = AnalyserControl( "127.0.0.1", "50000", True, environmentVariables, self.program.chipRegistry )
 		self.analysisControl.reset()
 		
 		# Directory where the user can save their I2C files
@@ -111,9 +117,9 @@ class GlibControlService:
 		"""
 		try:
 			results = []
-			for context in self.program.contexts :
-				for application in context.applications :
-					results.append( [application.className,application.getState()] )
+			states = self.program.queryAllStates()
+			for application in self.program.allApplications() :
+				results.append( [application.className,states[application]] )
 			return results
 		except Exception as error:
 			return "Exception: "+str(error)
@@ -0,0 +1,138 @@
+"""
+@brief Micro-benchmarks for the I2C register representation.
+
+Times a full trim sweep over all the channels of the four CBCs, i.e. what
+GlibSupervisorApplication.setAllChannelTrims and the trim calibration do every
+loop. No XDAQ process or board is needed, only the files in runcontrol/i2c.
+
+Run from the runcontrol directory with
+@code
+	python benchmarkI2cChip.py
+@endcode
+"""
+import os, inspect, timeit, tempfile, shutil
+
+from pythonlib.I2cChip import I2cChip, I2cFileWriter, registerFileCache
+
+I2C_DIRECTORY=os.path.join( os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))), "i2c" )
+CHIP_NAMES=["FE0CBC0","FE0CBC1","FE1CBC0","FE1CBC1"]
+
+def loadChips() :
+	chips={}
+	for name in CHIP_NAMES :
+		chips[name]=I2cChip( os.path.join(I2C_DIRECTORY,name+".txt") )
+	return chips
+
+def trimSweep( chips ) :
+	"""
+	Sets then reads back the trim of every channel on every chip.
+	"""
+	for chip in chips.values() :
+		for channel in range(0,254) :
+			chip.setChannelTrim( channel, 0x80 )
+		for channel in range(0,254) :
+			chip.getChannelTrim( channel )
+
+def bulkTrimSweep( chips ) :
+	"""
+	The same sweep using the bulk trim methods.
+	"""
+	trims=[0x80]*254
+	for chip in chips.values() :
+		chip.setChannelTrims( trims )
+		chip.getChannelTrims()
+
+def linearScanTrimSweep( chips ) :
+	"""
+	The same sweep done the way it was before the lookup tables were added, by searching the
+	register list for each of the possible channel names. Kept as a reference.
+	"""
+	for chip in chips.values() :
+		for channel in range(0,254) :
+			for name in [ "Channel%d"%(channel+1), "Channel%02d"%(channel+1), "Channel%03d"%(channel+1) ] :
+				for register in chip.registers :
+					if register.name==name : break
+			register.value=0x80
+		for channel in range(0,254) :
+			for name in [ "Channel%d"%(channel+1), "Channel%02d"%(channel+1), "Channel%03d"%(channel+1) ] :
+				for register in chip.registers :
+					if register.name==name : break
+			register.value
+
+def thresholdScanWrites( chips, directory, onlyDirty ) :
+	"""
+	The file writing that sendI2c does for each step of a 50 threshold s-curve scan, either
+	writing every register or only the ones that changed.
+	"""
+	for threshold in range(100,150) :
+		for name in chips :
+			chip=chips[name]
+			chip.setValues( {"VCth":threshold} )
+			if onlyDirty :
+				dirtyRegisterNames=chip.dirtyRegisterNames()
+				if len(dirtyRegisterNames)==0 : continue
+				chip.writeToFilename( os.path.join(directory,name+".txt"), dirtyRegisterNames )
+				chip.markSent( dirtyRegisterNames )
+			else :
+				chip.writeToFilename( os.path.join(directory,name+".txt") )
+
+def writerScanWrites( chips, writer, onlyDirty ) :
+	"""
+	The same scan done with an I2cFileWriter, which is what sendI2c uses.
+	"""
+	for threshold in range(100,150) :
+		for name in chips :
+			chip=chips[name]
+			chip.setValues( {"VCth":threshold} )
+			if onlyDirty :
+				dirtyRegisterNames=chip.dirtyRegisterNames()
+				if len(dirtyRegisterNames)==0 : continue
+				writer.write( name, chip, dirtyRegisterNames )
+				chip.markSent( dirtyRegisterNames )
+			else :
+				writer.write( name, chip )
+
+def coldLoad() :
+	registerFileCache.clear()
+	loadChips()
+
+def report( description, function, repeats ) :
+	bestTime=min( timeit.repeat( function, number=1, repeat=repeats ) )
+	print description.ljust(50)+("%10.3f ms"%(bestTime*1000.0))
+
+if __name__ == '__main__':
+	print "Loading the I2C files for "+str(len(CHIP_NAMES))+" chips (best of repeats)"
+	report( "Parsing the files", coldLoad, 20 )
+	report( "From the parsed file cache", loadChips, 20 )
+	sidecarDirectory=tempfile.mkdtemp()
+	try :
+		registerFileCache.sidecarDirectory=sidecarDirectory
+		coldLoad()
+		report( "From the binary sidecar files", coldLoad, 20 )
+	finally :
+		registerFileCache.sidecarDirectory=None
+		shutil.rmtree( sidecarDirectory )
+
+	filename=os.path.join(I2C_DIRECTORY,CHIP_NAMES[0]+".txt")
+	report( "16 chips sharing one register schema", lambda : [I2cChip(filename) for index in range(0,16)], 20 )
+
+	chips=loadChips()
+	schemas=set( [id(chip.bank.schema) for chip in chips.values()] )
+	print "Each chip holds "+str(len(chips.values()[0].bank.values))+" bytes of values, "+str(len(schemas))+" schema(s) shared between "+str(len(chips))+" chips"
+	print ""
+	numberOfChannels=sum( [len(chip.getChannelTrims()) for chip in chips.values()] )
+	print "Trim sweep over "+str(numberOfChannels)+" channels on "+str(len(chips))+" chips (best of repeats)"
+	report( "Indexed lookup", lambda : trimSweep(chips), 50 )
+	report( "Bulk getChannelTrims/setChannelTrims", lambda : bulkTrimSweep(chips), 50 )
+	report( "Linear scan (reference)", lambda : linearScanTrimSweep(chips), 5 )
+
+	directory=tempfile.mkdtemp()
+	try :
+		print "\nI2C file writing for a 50 threshold scan on "+str(len(chips))+" chips"
+		report( "All registers every step", lambda : thresholdScanWrites(chips,directory,False), 5 )
+		report( "Only dirty registers", lambda : thresholdScanWrites(chips,directory,True), 5 )
+		writer=I2cFileWriter( directory )
+		report( "All registers every step, I2cFileWriter", lambda : writerScanWrites(chips,writer,False), 5 )
+		report( "Only dirty registers, I2cFileWriter", lambda : writerScanWrites(chips,writer,True), 5 )
+	finally :
+		shutil.rmtree( directory )
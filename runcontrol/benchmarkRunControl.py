@@ -0,0 +1,70 @@
+"""
+@brief Times the run control (starting processes, state transitions and s-curve runs) against
+pythonlib/XDAQSimulator instead of a real GLIB.
+
+The simulator is started in this process on the normal xdaq daemon port, so nothing else can be
+using port 9999 or the ports in GlibSuper.xml. The C++ analyser isn't needed either; a stand-in that
+only checks how many events were written is used instead. At the end XDAQTools.statistics is
+printed and saved as JSON, to show where the time went.
+
+Run from the runcontrol directory with
+@code
+	python benchmarkRunControl.py [latency in seconds, default 0]
+@endcode
+"""
+import sys, os, time
+
+from pythonlib import XDAQTools
+from pythonlib.XDAQSimulator import XDAQSimulator, EVENT_SIZE
+from pythonlib.SimpleGlibProgram import SimpleGlibProgram
+from cbc2SCurveRun import SCurveRun
+from environmentVariables_default import getEnvironmentVariables
+
+class AnalysisStandIn(object) :
+	"""
+	Takes the place of AnalyserControl. Only counts the events in each file.
+	"""
+	def __init__( self ) :
+		self.eventsAnalysed=0
+	def reset( self ) :
+		self.eventsAnalysed=0
+	def setThreshold( self, threshold ) :
+		pass
+	def analyseFile( self, filename ) :
+		self.eventsAnalysed+=os.path.getsize( filename )/EVENT_SIZE
+
+def timeIt( description, function ) :
+	startTime=time.time()
+	function()
+	print description.ljust(50)+("%10.3f s"%(time.time()-startTime))
+
+if __name__ == '__main__':
+	latency=0.0
+	if len(sys.argv)>1 : latency=float(sys.argv[1])
+	simulator=XDAQSimulator( latency=latency, triggerRate=1000 )
+	simulator.start()
+	try :
+		daqProgram=SimpleGlibProgram( "GlibSuper.xml" )
+		daqProgram.setEnvironmentVariables( getEnvironmentVariables() )
+		analysis=AnalysisStandIn()
+		thresholds=range(100,103)
+
+		print "Latency per request "+str(latency)+" s"
+		timeIt( "startRun (processes restarted)", daqProgram.startRun )
+		timeIt( "configure", daqProgram.configure )
+		timeIt( "halt", daqProgram.halt )
+		timeIt( "finishRun (processes killed)", daqProgram.finishRun )
+
+		timeIt( "SCurveRun of "+str(len(thresholds))+" thresholds", lambda : SCurveRun( None, daqProgram, analysis, thresholds ).run() )
+		def twoRunsInASession() :
+			with daqProgram.session() :
+				for loop in range(0,2) : SCurveRun( None, daqProgram, analysis, thresholds ).run()
+		timeIt( "Two SCurveRuns in one session", twoRunsInASession )
+		print str(analysis.eventsAnalysed)+" events analysed in total"
+
+		print "\nWhere the time went, slowest in total first"
+		print XDAQTools.statistics.summary()
+		XDAQTools.statistics.dump( "/tmp/benchmarkRunControl-statistics.json" )
+		print "Saved to /tmp/benchmarkRunControl-statistics.json"
+	finally :
+		simulator.stop()
@@ -0,0 +1,83 @@
+"""
+@brief Micro-benchmarks for building SOAP messages and reading values out of the responses.
+
+No XDAQ process is needed. The responses are written out here in the same form that the
+XDAQ executive and the jobcontrol application send back (namespaces, nesting and the
+size of a ParameterQuery from a GlibSupervisor with its usual number of parameters), so
+the timings should be representative of the real thing.
+
+Run from the runcontrol directory with
+@code
+	python benchmarkXDAQTools.py
+@endcode
+"""
+import timeit
+import xml.etree.ElementTree as ElementTree
+
+from pythonlib import XDAQTools
+from pythonlib.XDAQTools import ETElementExtension, extract, extractAll, soapEnvelope, soapCommandMessage
+
+def parameterQueryResponse( numberOfParameters=60 ) :
+	"""
+	A ParameterQuery response like the one from an application, with the descriptor first and
+	then all the exported parameters, of which stateName is one of the later ones.
+	"""
+	response='<?xml version="1.0" encoding="UTF-8"?>\n'
+	response+='<soap-env:Envelope soap-env:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/" xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+	response+='<soap-env:Header/><soap-env:Body><xdaq:ParameterQueryResponse xmlns:xdaq="urn:xdaq-soap:3.0">'
+	response+='<p:properties xmlns:p="urn:xdaq-application:GlibSupervisor" xsi:type="soapenc:Struct">'
+	response+='<p:descriptor xsi:type="soapenc:Struct"><p:properties xsi:type="soapenc:Struct">'
+	for name, value in [("class","GlibSupervisor"),("context","http://127.0.0.1:94804"),("icon",""),("id","30"),("instance","0"),("network","local"),("pid","18372"),("service",""),("uuid","5b3c0f32-0a1e-11e3-b1ab-0030488a8d4e")] :
+		response+='<p:'+name+' xsi:type="xsd:string">'+value+'</p:'+name+'>'
+	response+='</p:properties></p:descriptor>'
+	for index in range(0,numberOfParameters) :
+		response+='<p:parameter%d xsi:type="xsd:unsignedInt">%d</p:parameter%d>'%(index,index*17,index)
+		if index==numberOfParameters*3/4 : response+='<p:stateName xsi:type="xsd:string">Configured</p:stateName>'
+	response+='</p:properties></xdaq:ParameterQueryResponse></soap-env:Body></soap-env:Envelope>'
+	return response
+
+def getJobStatusResponse() :
+	return '<?xml version="1.0" encoding="UTF-8"?>\n<soap-env:Envelope soap-env:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/" xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soap-env:Header/><soap-env:Body><xdaq:getJobStatusResponse xmlns:xdaq="urn:xdaq-soap:3.0"><xdaq:jid>12</xdaq:jid><xdaq:pid>18372</xdaq:pid><xdaq:status>0</xdaq:status><xdaq:user>xtaldaq</xdaq:user><xdaq:execPath>/opt/xdaq/bin/xdaq.exe</xdaq:execPath></xdaq:getJobStatusResponse></soap-env:Body></soap-env:Envelope>'
+
+def stateWithElementTree( response ) :
+	"""
+	How Application.getState used to read the state, kept as a reference.
+	"""
+	result=ElementTree.fromstring( response )
+	result.__class__=ETElementExtension
+	return result.getchildnamed("Body").getchildnamed("ParameterQueryResponse").getchildnamed("properties").getchildnamed("stateName").text
+
+def pidWithElementTree( response ) :
+	result=ElementTree.fromstring( response )
+	result.__class__=ETElementExtension
+	return result.getchildnamed("Body").getchildnamed("ParameterQueryResponse").getchildnamed("properties").getchildnamed("descriptor").getchildnamed("properties").getchildnamed("pid").text
+
+def jobStatusWithElementTree( response ) :
+	result=ElementTree.fromstring( response )
+	result.__class__=ETElementExtension
+	return ( result.getchildnamed("Body").getchildnamed("getJobStatusResponse").getchildnamed("status").text, result.getchildnamed("Body").getchildnamed("getJobStatusResponse").getchildnamed("pid").text )
+
+def report( description, function, number ) :
+	bestTime=min( timeit.repeat( function, number=number, repeat=5 ) )
+	print description.ljust(50)+("%10.2f us"%(bestTime*1e6/number))
+
+if __name__ == '__main__':
+	print "Building a ParameterQuery message (best of repeats, per message)"
+	report( "Parse and re-serialise (reference)", lambda : ElementTree.tostring( ElementTree.XML( soapEnvelope('<xdaq:ParameterQuery xmlns:xdaq="urn:xdaq-soap:3.0"/>') ) ), 2000 )
+	report( "soapCommandMessage", lambda : soapCommandMessage("ParameterQuery"), 20000 )
+	report( "soapCommandMessage with an attribute", lambda : soapCommandMessage("getJobStatus",jid="12"), 20000 )
+
+	parameterQuery=parameterQueryResponse()
+	jobStatus=getJobStatusResponse()
+	assert extract( parameterQuery, "Body/ParameterQueryResponse/properties/stateName" )==stateWithElementTree( parameterQuery )
+	assert extract( parameterQuery, "Body/ParameterQueryResponse/properties/descriptor/properties/pid" )==pidWithElementTree( parameterQuery )
+	assert tuple( extractAll( jobStatus, ["Body/getJobStatusResponse/status","Body/getJobStatusResponse/pid"] ) )==jobStatusWithElementTree( jobStatus )
+
+	print "\nReading values from a "+str(len(parameterQuery))+" byte ParameterQuery response"
+	report( "stateName, ElementTree (reference)", lambda : stateWithElementTree(parameterQuery), 500 )
+	report( "stateName, extract", lambda : extract(parameterQuery,"Body/ParameterQueryResponse/properties/stateName"), 500 )
+	report( "descriptor pid, ElementTree (reference)", lambda : pidWithElementTree(parameterQuery), 500 )
+	report( "descriptor pid, extract", lambda : extract(parameterQuery,"Body/ParameterQueryResponse/properties/descriptor/properties/pid"), 500 )
+	print "\nReading status and pid from a "+str(len(jobStatus))+" byte getJobStatus response"
+	report( "ElementTree (reference)", lambda : jobStatusWithElementTree(jobStatus), 2000 )
+	report( "extractAll", lambda : extractAll(jobStatus,["Body/getJobStatusResponse/status","Body/getJobStatusResponse/pid"]), 2000 )
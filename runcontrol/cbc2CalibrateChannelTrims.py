@@ -8,6 +8,7 @@ import threading
 
 from pythonlib.SimpleGlibProgram import SimpleGlibProgram
 from pythonlib.AnalyserControl import AnalyserControl
+from pythonlib.I2cSnapshotStore import I2cSnapshotStore
 from cbc2SCurveRun import SCurveRun
 
 
@@ -60,6 +61,10 @@ class CalibrateChannelTrims(threading.Thread):
 		self.interimOutputFilename=interimOutputFilename
 		self.maxLoops=maxLoops
 		self.quit=False
+		# The I2C values from each loop are kept in a snapshot store, which only stores the
+		# registers that changed rather than a full set of files for every loop.
+		if self.interimOutputFilename!=None : self.i2cSnapshots=I2cSnapshotStore( self.interimOutputFilename+"-i2cSnapshots" )
+		else : self.i2cSnapshots=None
 		
 		# Before making asking which CBCs are connected I have to initialise
 		# the CBC information in the control program. This isn't in the __init__
@@ -88,11 +93,18 @@ class CalibrateChannelTrims(threading.Thread):
 		of their s-curves sits on mitPointTarget.
 		
 		If interimOutputFilename is not 'None' then the files from each loop willbe saved to
-		files and directories starting with that name.
+		files and directories starting with that name. The trims from loop N are saved in an
+		I2cSnapshotStore in "<interimOutputFilename>-i2cSnapshots" as the snapshot "loopN".
 		
 		@author Mark Grimes (mark.grimes@bristol.ac.uk)
 		@date 24/Jan/2014
 		"""
+		# Keep the XDAQ processes running between the runs of each loop rather than restarting
+		# them every time.
+		with self.daqProgram.session() :
+			self._calibrate()
+
+	def _calibrate( self ) :
 		# I perform linear fits of the previous results to estimate what the trim to be.
 		# For this to work I'll start off taking one run with very low trims and one with
 		# high trims so that I have enough data points for the fit.
@@ -140,7 +152,7 @@ class CalibrateChannelTrims(threading.Thread):
 			self.setNewTrims()
 			if self.interimOutputFilename!=None : self.analysisControl.saveHistograms( self.interimOutputFilename+"-loop"+str(self.loop)+".root" )
 			# Might as well save the trims as I go in case something goes wrong
-			if self.interimOutputFilename!=None : self.daqProgram.supervisor.saveI2c( self.interimOutputFilename+"-loop"+str(self.loop) )
+			if self.i2cSnapshots!=None : self.daqProgram.supervisor.saveI2cSnapshot( self.i2cSnapshots, "loop"+str(self.loop) )
 			# Decide whether to drop out or not
 			if len(self.targets)==0 : scurvesAlign=True
 			elif self.loop>self.maxLoops :
@@ -287,7 +299,7 @@ if __name__ == '__main__':
 	daqProgram = SimpleGlibProgram( "GlibSuper.xml" )
 	environmentVariables=getEnvironmentVariables()
 	daqProgram.setEnvironmentVariables( environmentVariables )
-	analysisControl = AnalyserControl( "127.0.0.1", "50000", True, environmentVariables )
+	analysisControl = AnalyserControl( "127.0.0.1", "50000", True, environmentVariables, daqProgram.chipRegistry )
 	
 	cbc2CalibrateChannelTrims=CalibrateChannelTrims( PrintStatus(), daqProgram, analysisControl, range(100,150), 127, "/tmp/calibrateChannelTrims" )
 	# I have no interest in running this in a separate thread (that's mostly for gui
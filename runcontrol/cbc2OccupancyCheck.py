@@ -1,4 +1,3 @@
-import time
 import threading
 
 class OccupancyCheck(threading.Thread) :
@@ -41,30 +40,30 @@ class OccupancyCheck(threading.Thread) :
 	def run( self ) :
 		try :
 			self.analysisControl.reset() # Clear any data that was there before hand
-			self.daqProgram.startAllProcesses( forceRestart=True ) # forceRestart will kill the XDAQ processes first if they're running
-			self.daqProgram.waitUntilAllProcessesStarted();
-			self.daqProgram.initialise()
+			self.daqProgram.startRun() # Restarts the XDAQ processes unless in a session
 			self.daqProgram.setOutputFilename( self.temporaryOutputFilename )
 			
 			self.daqProgram.configure()
 			
-			self.daqProgram.play()
-			stateAndEventNumber=self.daqProgram.streamer.acquisitionStateAndEvent()
-			while (not self.quit) and stateAndEventNumber[0]=="Running":
-				if self.statusCallback!=None : self.statusCallback.currentStatus( float(stateAndEventNumber[1])/float(100), "Taking event "+str(stateAndEventNumber[1]) )
-				time.sleep(2)
-				stateAndEventNumber=self.daqProgram.streamer.acquisitionStateAndEvent()
+			# Watch the output file to see how far through the run is
+			monitor=self.daqProgram.streamer.progressMonitor()
+			try :
+				self.daqProgram.play()
+				while (not self.quit) and not self.daqProgram.streamer.waitForAcquisition( monitor, 2.0 ) :
+					progress=monitor.progress()
+					if self.statusCallback!=None : self.statusCallback.currentStatus( progress['fractionComplete'], "Taking event "+str(progress['eventsWritten']) )
+			finally :
+				monitor.close()
 			
 			self.daqProgram.pause()
 			if not self.quit : self.analysisControl.analyseFile( self.temporaryOutputFilename )
 			
-			self.daqProgram.killAllProcesses()
-			self.daqProgram.waitUntilAllProcessesKilled();
+			self.daqProgram.finishRun()
 			# If the user wants to be update tell them we've finished.
 			if self.statusCallback!=None : self.statusCallback.finished()
 		except :
 			# If anything ever goes wrong, shut down the XDAQ processes before propagating the exception
-			self.daqProgram.killAllProcesses()
+			self.daqProgram.abortRun()
 			raise
 
 if __name__ == '__main__':
@@ -83,7 +82,7 @@ if __name__ == '__main__':
 	# as the xtaldaq user
 	daqProgram.contexts[0].forcedEnvironmentVariables["USER"]="xtaldaq"
 	daqProgram.contexts[0].forcedEnvironmentVariables["SCRATCH"]="/tmp"
-	analysisControl = AnalyserControl( "127.0.0.1", "50000" )
+	analysisControl = AnalyserControl( "127.0.0.1", "50000", chipRegistry=daqProgram.chipRegistry )
 	
 	occupancyCheckRun=OccupancyCheck( PrintStatus(), daqProgram, analysisControl )
 	# I have no interest in running this in a separate thread (that's mostly for gui
@@ -24,7 +24,6 @@ is available to the gui if importing this script.
 @date 06/Jan/2014
 """
 
-import time
 import threading
 
 class SCurveRun(threading.Thread) :
@@ -71,9 +70,7 @@ class SCurveRun(threading.Thread) :
 
 	def run( self ) :
 		try :
-			self.daqProgram.startAllProcesses( forceRestart=True ) # forceRestart will kill the XDAQ processes first if they're running
-			self.daqProgram.waitUntilAllProcessesStarted();
-			self.daqProgram.initialise()
+			self.daqProgram.startRun() # Restarts the XDAQ processes unless in a session
 			
 			# Keep a record of what the initial threshold values are and return to those afterwards
 			previousThresholds=self.daqProgram.supervisor.I2CRegisterValues( chipNames=None, registerNames=['VCth'] )
@@ -91,29 +88,32 @@ class SCurveRun(threading.Thread) :
 				self.daqProgram.setAndSendI2c( { "VCth" : threshold } )
 				self.analysisControl.setThreshold( threshold )
 			
-				self.daqProgram.play()
-				while (not self.quit) and self.daqProgram.streamer.acquisitionState()=="Running":
-					time.sleep(2)
+				# Watch the output file so that I know as soon as all the events have been taken
+				monitor=self.daqProgram.streamer.progressMonitor()
+				try :
+					self.daqProgram.play()
+					while (not self.quit) and not self.daqProgram.streamer.waitForAcquisition( monitor, 2.0 ) :
+						pass
+				finally :
+					monitor.close()
 				
 				self.daqProgram.pause()
 				if self.quit : break
 				self.analysisControl.analyseFile( self.temporaryOutputFilename )
 			
-			# Now return the thresholds to what they were previously
-			for cbcName in previousThresholds.keys() :
-				# Set the threshold back for this chip (this is held in memory and not yet sent to the board)
-				self.daqProgram.supervisor.setI2c( previousThresholds[cbcName], [cbcName] )
-			# Send all of the I2C parameters to the board
-			self.daqProgram.supervisor.sendI2c()
+			# Now return the thresholds to what they were previously. Doing this in a transaction
+			# means all the chips are sent to the board together when the block finishes.
+			with self.daqProgram.i2cTransaction() :
+				for cbcName in previousThresholds.keys() :
+					self.daqProgram.setAndSendI2c( previousThresholds[cbcName], [cbcName] )
 
-			self.daqProgram.killAllProcesses()
-			self.daqProgram.waitUntilAllProcessesKilled();
+			self.daqProgram.finishRun()
 			
 			# If the user wants to be update tell them we've finished.
 			if self.statusCallback!=None : self.statusCallback.finished()
 		except :
 			# If anything ever goes wrong, shut down the XDAQ processes before propagating the exception
-			self.daqProgram.killAllProcesses()
+			self.daqProgram.abortRun()
 			raise
 
 
@@ -134,7 +134,7 @@ if __name__ == '__main__':
 	# as the xtaldaq user
 	daqProgram.contexts[0].forcedEnvironmentVariables["USER"]="xtaldaq"
 	daqProgram.contexts[0].forcedEnvironmentVariables["SCRATCH"]="/tmp"
-	analysisControl = AnalyserControl( "127.0.0.1", "50000" )
+	analysisControl = AnalyserControl( "127.0.0.1", "50000", chipRegistry=daqProgram.chipRegistry )
 	analysisControl.reset() # I might be connecting to an already running controller
 	
 	cbc2SCurveRun=SCurveRun( PrintStatus(), daqProgram, analysisControl, range(100,150) )
@@ -1,18 +1,25 @@
 import httplib, urllib, json, time
+from ChipRegistry import ChipRegistry
 
 class AnalyserControl :
 	"""
 	Class to interact with the C++ analysis program. This tells the program what to do by sending it
 	HTTP requests.
 	"""
-	def __init__ ( self, host, port, startServerIfNotRunning=True, environmentVariables=None ):
+	def __init__ ( self, host, port, startServerIfNotRunning=True, environmentVariables=None, chipRegistry=None ):
 		"""
 		Connects to the instance running on the given host and port. If the instance is not running
 		and startServerIfNotRunning is True, the server executable will be spawned on that port.
 		If environmentVariables is not None, then that dictionary will be used as the environment
 		variables to spawn the executable. If it's None then the current environment is used. If
 		the server is already running then supplying environmentVariables has no effect.
+		
+		chipRegistry is used to convert the analyser's CBC names into the names the run control
+		uses, so it should be the registry of the SimpleGlibProgram taking the data. By default a new
+		one is made with the standard layout of chips on each board.
 		"""
+		if chipRegistry==None : chipRegistry=ChipRegistry()
+		self.chipRegistry=chipRegistry
 		self.connection=httplib.HTTPConnection( host+":"+str(port) )
 		# Make sure the connection is closed, because all the other methods assume
 		# it's in that state. Presumably the connection will have failed at that
@@ -90,11 +97,7 @@ class AnalyserControl :
 		# the python code.
 		result={}
 		for cbcName in analysisResult.keys() :
-			if cbcName=='CBC 00' : pythonCbcName='FE0CBC0'
-			elif cbcName=='CBC 01' : pythonCbcName='FE0CBC1'
-			elif cbcName=='CBC 02' : pythonCbcName='FE1CBC0'
-			elif cbcName=='CBC 03' : pythonCbcName='FE1CBC1'
-			else : pythonCbcName=cbcName
+			pythonCbcName=self.chipRegistry.nameForAnalyserName( cbcName )
 			# The C++ code doesn't know if a CBC is connected or not, since unconnected CBCs
 			# show up in the DAQ dumps as all on channels. I need to check whether these are
 			# actually connected.
@@ -118,11 +121,7 @@ class AnalyserControl :
 		# the python code.
 		result={}
 		for cbcName in analysisResult.keys() :
-			if cbcName=='CBC 00' : pythonCbcName='FE0CBC0'
-			elif cbcName=='CBC 01' : pythonCbcName='FE0CBC1'
-			elif cbcName=='CBC 02' : pythonCbcName='FE1CBC0'
-			elif cbcName=='CBC 03' : pythonCbcName='FE1CBC1'
-			else : pythonCbcName=cbcName
+			pythonCbcName=self.chipRegistry.nameForAnalyserName( cbcName )
 			# The C++ code doesn't know if a CBC is connected or not, since unconnected CBCs
 			# show up in the DAQ dumps as all on channels. I need to check whether these are
 			# actually connected.
@@ -0,0 +1,587 @@
+"""
+Non-blocking versions of the XDAQTools classes, so that lots of XDAQ applications can be talked to
+at the same time from one thread.
+
+Everything here is a coroutine written as a generator (this has to run on python 2, so asyncio isn't
+available). Coroutines are run by an EventLoop, which uses select() to wait on all the sockets at
+once. Within a coroutine
+@code
+	state=yield application.getState()     # call another coroutine and get its result
+	yield Sleep( 0.1 )                       # wait without blocking anything else
+	results=yield gather( a.getState(), b.getState() )   # run several at the same time
+	raise Return( state )                    # return a value (generators can't "return x" in python 2)
+@endcode
+and from normal code
+@code
+	program=AsyncProgram( XDAQTools.Program("GlibSuper.xml") )
+	states=EventLoop().run( program.queryAllStates() )
+@endcode
+
+AsyncApplication, AsyncContext and AsyncProgram wrap an existing Application, Context or Program, so
+anything set up by those (e.g. job IDs found by reattaching) is shared with the blocking versions.
+
+@author Mark Grimes (mark.grimes@bristol.ac.uk)
+"""
+
+import socket, select, errno, os, sys, time, heapq, types, urllib
+from collections import deque
+import XDAQTools
+
+class Return(Exception) :
+	"""
+	Raised by a coroutine to return a value, since generators can't return a value in python 2.
+	"""
+	def __init__( self, value=None ) :
+		Exception.__init__( self )
+		self.value=value
+
+class Sleep(object) :
+	"""
+	Yield this from a coroutine to wait for the given number of seconds.
+	"""
+	def __init__( self, seconds ) :
+		self.seconds=seconds
+		self.active=True
+
+class Readable(object) :
+	"""
+	Yield this from a coroutine to wait until the socket can be read from. If it can't within
+	"timeout" seconds (None waits forever) socket.timeout is raised.
+	"""
+	def __init__( self, sock, timeout=None ) :
+		self.sock=sock
+		self.timeout=timeout
+		self.active=True
+
+class Writable(Readable) :
+	"""
+	Yield this from a coroutine to wait until the socket can be written to. See Readable.
+	"""
+	pass
+
+class Spawn(object) :
+	"""
+	Yield this from a coroutine to start another coroutine running alongside it. Gives the Task, which
+	can be yielded later to wait for the result.
+	"""
+	def __init__( self, coroutine ) :
+		self.coroutine=coroutine
+
+class Task(object) :
+	"""
+	A coroutine being run by an EventLoop. Yielding a Task from a coroutine waits until it has finished
+	and gives its result (or raises its exception).
+	"""
+	def __init__( self, loop, coroutine ) :
+		self.loop=loop
+		self.done=False
+		self._stack=[coroutine]
+		self._result=None
+		self._error=None
+		self._waitingTasks=[]
+
+	def result( self ) :
+		if not self.done : raise Exception( "The task hasn't finished yet" )
+		if self._error!=None : raise self._error[0], self._error[1], self._error[2]
+		return self._result
+
+	def _finish( self, result, error ) :
+		self.done=True
+		self._result=result
+		self._error=error
+		for task in self._waitingTasks : self.loop._schedule( task, result, error )
+		self._waitingTasks=[]
+
+	def _step( self, value=None, error=None ) :
+		"""
+		Runs the coroutine until it has to wait for something.
+		"""
+		while True :
+			coroutine=self._stack[-1]
+			try :
+				if error!=None : operation=coroutine.throw( error[0], error[1], error[2] )
+				else : operation=coroutine.send( value )
+			except Return as returned :
+				self._stack.pop()
+				value, error = returned.value, None
+				if len(self._stack)==0 : return self._finish( value, None )
+				continue
+			except StopIteration :
+				self._stack.pop()
+				value, error = None, None
+				if len(self._stack)==0 : return self._finish( None, None )
+				continue
+			except Exception :
+				self._stack.pop()
+				value, error = None, sys.exc_info()
+				if len(self._stack)==0 : return self._finish( None, error )
+				continue
+
+			value, error = None, None
+			if isinstance( operation, types.GeneratorType ) :
+				self._stack.append( operation )
+			elif isinstance( operation, Task ) :
+				if operation.done : value, error = operation._result, operation._error
+				else :
+					operation._waitingTasks.append( self )
+					return
+			elif isinstance( operation, Spawn ) :
+				value=self.loop.spawn( operation.coroutine )
+			elif isinstance( operation, (Sleep,Readable) ) :
+				self.loop._wait( self, operation )
+				return
+			else :
+				try :
+					raise TypeError( "A coroutine yielded "+repr(operation)+" which the EventLoop doesn't know what to do with" )
+				except TypeError :
+					error=sys.exc_info()
+
+class EventLoop(object) :
+	"""
+	Runs coroutines until they finish, waiting on all of their sockets and sleeps at the same time.
+	"""
+	def __init__( self ) :
+		self._ready=deque()
+		self._readers={} # file descriptor to (task, operation)
+		self._writers={}
+		self._timers=[]  # heap of (time, sequence number, task, operation)
+		self._sequenceNumber=0
+
+	def spawn( self, coroutine ) :
+		"""
+		Starts the coroutine running and returns the Task. It doesn't actually run until the loop does.
+		"""
+		task=Task( self, coroutine )
+		self._schedule( task )
+		return task
+
+	def run( self, coroutine ) :
+		"""
+		Runs the coroutine, and anything else that has been spawned, until it has finished. Returns
+		its result or raises its exception.
+		"""
+		task=self.spawn( coroutine )
+		while not task.done :
+			if len(self._ready)!=0 : self._runReady()
+			else : self._waitForEvents()
+		return task.result()
+
+	def _schedule( self, task, value=None, error=None ) :
+		self._ready.append( (task,value,error) )
+
+	def _wait( self, task, operation ) :
+		if isinstance( operation, Sleep ) :
+			self._addTimer( time.time()+operation.seconds, task, operation )
+			return
+		if isinstance( operation, Writable ) : waiting=self._writers
+		else : waiting=self._readers
+		fileDescriptor=operation.sock.fileno()
+		if fileDescriptor in waiting : raise Exception( "Two coroutines are waiting on the same socket" )
+		waiting[fileDescriptor]=(task,operation)
+		if operation.timeout!=None : self._addTimer( time.time()+operation.timeout, task, operation )
+
+	def _addTimer( self, when, task, operation ) :
+		self._sequenceNumber+=1
+		heapq.heappush( self._timers, (when,self._sequenceNumber,task,operation) )
+
+	def _fire( self, task, operation, error=None ) :
+		# Each operation can only finish once, whichever of its socket or timeout comes first
+		if not operation.active : return
+		operation.active=False
+		if isinstance( operation, Readable ) :
+			if isinstance( operation, Writable ) : waiting=self._writers
+			else : waiting=self._readers
+			fileDescriptor=operation.sock.fileno()
+			if waiting.get( fileDescriptor, (None,None) )[1] is operation : del waiting[fileDescriptor]
+		self._schedule( task, None, error )
+
+	def _runReady( self ) :
+		while len(self._ready)!=0 :
+			task, value, error = self._ready.popleft()
+			task._step( value, error )
+
+	def _waitForEvents( self ) :
+		# Throw away timeouts for anything that has already happened
+		while len(self._timers)!=0 and not self._timers[0][3].active : heapq.heappop( self._timers )
+		timeout=None
+		if len(self._timers)!=0 : timeout=max( 0.0, self._timers[0][0]-time.time() )
+		if len(self._readers)==0 and len(self._writers)==0 :
+			if timeout==None : raise Exception( "EventLoop has nothing to wait for, but the coroutine hasn't finished" )
+			time.sleep( timeout )
+		else :
+			try :
+				readable, writable, exceptional = select.select( self._readers.keys(), self._writers.keys(), [], timeout )
+			except select.error as error :
+				if error.args[0]!=errno.EINTR : raise
+				readable, writable = [], []
+			for fileDescriptor in readable :
+				if fileDescriptor in self._readers : self._fire( *self._readers[fileDescriptor] )
+			for fileDescriptor in writable :
+				if fileDescriptor in self._writers : self._fire( *self._writers[fileDescriptor] )
+
+		now=time.time()
+		while len(self._timers)!=0 and self._timers[0][0]<=now :
+			when, sequenceNumber, task, operation = heapq.heappop( self._timers )
+			if isinstance( operation, Sleep ) : self._fire( task, operation )
+			else :
+				try :
+					raise socket.timeout( "timed out" )
+				except socket.timeout :
+					self._fire( task, operation, sys.exc_info() )
+
+def gather( *coroutines ) :
+	"""
+	Coroutine that runs all the coroutines at the same time and returns a list of their results. If any
+	of them raise an exception the first one is raised once they've all finished.
+	"""
+	tasks=[]
+	for coroutine in coroutines :
+		task=yield Spawn( coroutine )
+		tasks.append( task )
+	results=[]
+	firstError=None
+	for task in tasks :
+		try :
+			result=yield task
+		except Exception :
+			result=None
+			if firstError==None : firstError=sys.exc_info()
+		results.append( result )
+	if firstError!=None : raise firstError[0], firstError[1], firstError[2]
+	raise Return( results )
+
+class HTTPResponse(object) :
+	"""
+	The response to httpRequest. Has the same members as the httplib responses that the rest of the
+	code uses, i.e. status, reason, getheader() and the body in fullMessage.
+	"""
+	def __init__( self, status, reason, headers, fullMessage ) :
+		self.status=status
+		self.reason=reason
+		self.headers=headers
+		self.fullMessage=fullMessage
+
+	def getheader( self, name, default=None ) :
+		return self.headers.get( name.lower(), default )
+
+def _parseResponse( data, connectionClosed ) :
+	"""
+	Returns an HTTPResponse if data has the whole response, or None if more is needed.
+	"""
+	headerEnd=data.find( "\r\n\r\n" )
+	if headerEnd==-1 :
+		if connectionClosed : raise Exception( "The connection closed before the http headers were received" )
+		return None
+	lines=data[0:headerEnd].split( "\r\n" )
+	statusLine=lines[0].split( " ", 2 )
+	if len(statusLine)<2 : raise Exception( "Badly formed http status line '"+lines[0]+"'" )
+	status=int( statusLine[1] )
+	if len(statusLine)==3 : reason=statusLine[2]
+	else : reason=""
+	headers={}
+	for line in lines[1:] :
+		name, separator, value = line.partition( ":" )
+		headers[name.strip().lower()]=value.strip()
+	body=data[headerEnd+4:]
+
+	if headers.get( "transfer-encoding", "" ).lower()=="chunked" :
+		chunks=[]
+		position=0
+		while True :
+			lineEnd=body.find( "\r\n", position )
+			if lineEnd==-1 : break
+			chunkSize=int( body[position:lineEnd].split(";")[0], 16 )
+			if chunkSize==0 : return HTTPResponse( status, reason, headers, "".join(chunks) )
+			if len(body)<lineEnd+2+chunkSize+2 : break
+			chunks.append( body[lineEnd+2:lineEnd+2+chunkSize] )
+			position=lineEnd+2+chunkSize+2
+		if connectionClosed : raise Exception( "The connection closed part way through a chunked http response" )
+		return None
+	if "content-length" in headers :
+		length=int( headers["content-length"] )
+		if len(body)>=length : return HTTPResponse( status, reason, headers, body[0:length] )
+		if connectionClosed : raise Exception( "The connection closed part way through the http response" )
+		return None
+	# No length given, so the body is everything until the connection closes
+	if connectionClosed : return HTTPResponse( status, reason, headers, body )
+	return None
+
+def httpRequest( host, port, method, url, body="", headers={}, timeout=30.0, label=None ) :
+	"""
+	Coroutine that sends an http request and returns an HTTPResponse. Raises socket.timeout if nothing
+	happens for "timeout" seconds at any stage. If label is given the request is recorded in
+	XDAQTools.statistics with label as the (target, command).
+	"""
+	startTime=time.time()
+	sock=socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+	sock.setblocking( 0 )
+	try :
+		result=sock.connect_ex( (host,int(port)) )
+		if result not in (0,errno.EINPROGRESS,errno.EWOULDBLOCK) : raise socket.error( result, os.strerror(result) )
+		if result!=0 :
+			yield Writable( sock, timeout )
+			result=sock.getsockopt( socket.SOL_SOCKET, socket.SO_ERROR )
+			if result!=0 : raise socket.error( result, os.strerror(result) )
+
+		request=method+" "+url+" HTTP/1.1\r\nHost: "+host+":"+str(port)+"\r\nConnection: close\r\nContent-Length: "+str(len(body))+"\r\n"
+		for name in headers : request+=name+": "+str(headers[name])+"\r\n"
+		request+="\r\n"+body
+		while len(request)!=0 :
+			yield Writable( sock, timeout )
+			sent=sock.send( request )
+			request=request[sent:]
+
+		received=[]
+		while True :
+			yield Readable( sock, timeout )
+			data=sock.recv( 65536 )
+			if len(data)!=0 : received.append( data )
+			response=_parseResponse( "".join(received), len(data)==0 )
+			if response!=None :
+				if label!=None : XDAQTools.statistics.record( label[0], label[1], time.time()-startTime, len(body), len(response.fullMessage), 0, response.status!=200 )
+				raise Return( response )
+	except Return :
+		raise
+	except Exception :
+		if label!=None : XDAQTools.statistics.record( label[0], label[1], time.time()-startTime, len(body), 0, 0, True )
+		raise
+	finally :
+		sock.close()
+
+def sendSoapEnvelope( host, port, message, className=None, instance=None, lid=10, timeout=30.0 ) :
+	"""
+	Coroutine version of XDAQTools.sendSoapEnvelope.
+	"""
+	if port==None : port=XDAQTools.jobControlPort
+	response=yield httpRequest( host, port, "POST", "/cgi-bin/query", message, XDAQTools.soapHeaders(className,instance,lid), timeout, XDAQTools.soapStatisticsLabel(host,port,message,className,instance,lid) )
+	if response.status!=200 : raise Exception( "Unable to send soap message because: "+str(response.status)+" - "+response.reason )
+	raise Return( response.fullMessage )
+
+def _waitFor( function, isReady, timeout, errorMessage, initialInterval=0.005, maximumInterval=0.2 ) :
+	"""
+	Coroutine that calls the coroutine function() until isReady( result ) is True and returns the result,
+	backing off between calls the same way as XDAQTools.StateWatcher. Raises an exception with
+	errorMessage if it takes longer than "timeout" seconds.
+	"""
+	timeoutEndTime=time.time()+timeout
+	interval=initialInterval
+	previousResult=None
+	while True :
+		result=yield function()
+		if isReady( result ) : raise Return( result )
+		if timeoutEndTime<time.time() : raise Exception( errorMessage )
+		if result!=previousResult : interval=initialInterval
+		else : interval=min( interval*2, maximumInterval )
+		previousResult=result
+		yield Sleep( min(interval,max(timeoutEndTime-time.time(),0.0)) )
+
+class AsyncApplication(object) :
+	"""
+	Coroutine version of XDAQTools.Application, wrapping an existing one. If the application has a
+	"stateFromStatusPage" method (e.g. GlibStreamerApplication) its state is worked out from its main
+	page instead of a ParameterQuery, the same as its getState does.
+	"""
+	def __init__( self, application ) :
+		self.application=application
+		self.host=application.host
+		self.port=application.port
+		self.className=application.className
+		self.instance=application.instance
+		self.id=application.id
+
+	def __repr__( self ) :
+		return "<Async"+repr(self.application)[1:]
+
+	def httpRequest( self, requestType, resource, parameters={}, timeout=30.0 ) :
+		headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
+		return httpRequest( self.host, self.port, requestType, urllib.quote(resource), urllib.urlencode(parameters), headers, timeout, XDAQTools.httpStatisticsLabel(self,requestType,resource) )
+
+	def sendCommand( self, command, timeout=30.0 ) :
+		# The same as GlibStreamerApplication.sendCommand, anything cached from before is out of date
+		if hasattr( self.application, "forgetStatusSnapshot" ) : self.application.forgetStatusSnapshot()
+		return sendSoapEnvelope( self.host, self.port, XDAQTools.soapCommandMessage(command), self.className, self.instance, timeout=timeout )
+
+	def getState( self, timeout=5.0 ) :
+		try :
+			if hasattr( self.application, "stateFromStatusPage" ) :
+				response=yield self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id), timeout=timeout )
+				message=response.fullMessage
+			else :
+				message=yield self.sendCommand( "ParameterQuery", timeout )
+		except Exception :
+			raise Return( "<uncontactable>" )
+		if hasattr( self.application, "stateFromStatusPage" ) : raise Return( self.application.stateFromStatusPage(message) )
+		try :
+			state=XDAQTools.extract( message, "Body/ParameterQueryResponse/properties/stateName" )
+		except Exception :
+			raise Return( "<uncontactable>" )
+		if state==None : raise Return( "<unknown>" )
+		raise Return( state )
+
+	def isReady( self, timeout=5.0 ) :
+		try :
+			response=yield self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id), timeout=timeout )
+		except Exception :
+			raise Return( False )
+		raise Return( response.status==200 )
+
+	def waitForState( self, state, timeout=5.0 ) :
+		result=yield _waitFor( self.getState, lambda applicationState : applicationState==state, timeout, "Application "+repr(self.application)+" did not reach state "+state+" within "+str(timeout)+" seconds." )
+		raise Return( result )
+
+class AsyncContext(object) :
+	"""
+	Coroutine version of XDAQTools.Context, wrapping an existing one. The job ID is kept in the wrapped
+	Context so that both agree on it.
+	"""
+	def __init__( self, context ) :
+		self.context=context
+		self.host=context.host
+		self.port=context.port
+		self.applications=[AsyncApplication(application) for application in context.applications]
+
+	def __repr__( self ) :
+		return "<Async"+repr(self.context)[1:]
+
+	def queryStates( self ) :
+		states=yield gather( *[application.getState() for application in self.applications] )
+		raise Return( dict( zip(self.applications,states) ) )
+
+	def startProcess( self, ignoreIfCurrentlyRunning=False, forceRestart=False, forceStart=False ) :
+		"""
+		See XDAQTools.Context.startProcess.
+		"""
+		context=self.context
+		if context.jobid != -1 :
+			if ignoreIfCurrentlyRunning : return
+			elif forceRestart :
+				yield self.killProcess()
+				yield self.waitUntilProcessKilled()
+			elif not forceStart : raise Exception("Context "+str(context)+" appears to already be running. Try again with either forceRestart or forceStart set to True.")
+
+		context.jobid=-1
+		XDAQTools.forgetActiveJobIDs( context.host )
+		message=XDAQTools.soapStartCommandMessage( context.port, context.configFilename, context.forcedEnvironmentVariables )
+		response=yield sendSoapEnvelope( context.host, None, message )
+		try :
+			jobid=XDAQTools.extract( response, "Body/jidResponse/jid" )
+		except Exception :
+			jobid=None
+		if jobid==None : raise Exception( "Couldn't start process. Response was: "+response )
+		context.jobid=jobid
+
+	def killProcess( self ) :
+		"""
+		See XDAQTools.Context.killProcess.
+		"""
+		context=self.context
+		if context.jobid==-1 : raise Return( False )
+		response=yield sendSoapEnvelope( context.host, None, XDAQTools.soapCommandMessage("killExec",user="xtaldaq",jid=context.jobid) )
+		try :
+			reply=XDAQTools.extract( response, "Body/getStateResponse/reply" )
+		except Exception :
+			raise Exception( "Couldn't kill process. Response was: "+response )
+		if reply=='killed by JID' :
+			context.jobid=-1
+			XDAQTools.forgetActiveJobIDs( context.host )
+			XDAQTools.connectionPool.close( context.host, context.port )
+			raise Return( True )
+		raise Return( False )
+
+	def waitUntilProcessStarted( self, timeout=30.0 ) :
+		yield _waitFor( self.queryStates, lambda states : "<uncontactable>" not in states.values(), timeout, "Context "+repr(self.context)+" did not start all applications within "+str(timeout)+" seconds." )
+
+	def waitUntilProcessKilled( self, timeout=10.0 ) :
+		yield _waitFor( self.queryStates, lambda states : len([state for state in states.values() if state!="<uncontactable>"])==0, timeout, "Context "+repr(self.context)+" did not kill all applications within "+str(timeout)+" seconds." )
+
+class AsyncProgram(object) :
+	"""
+	Coroutine version of XDAQTools.Program, wrapping an existing one (or a subclass such as
+	SimpleGlibProgram).
+	"""
+	def __init__( self, program ) :
+		self.program=program
+		self.contexts=[AsyncContext(context) for context in program.contexts]
+		self._asyncApplications={}
+		for context in self.contexts :
+			for application in context.applications : self._asyncApplications[application.application]=application
+
+	def asyncApplication( self, application ) :
+		"""
+		Returns the AsyncApplication for the given XDAQTools.Application.
+		"""
+		return self._asyncApplications[application]
+
+	def allApplications( self ) :
+		applications=[]
+		for context in self.contexts : applications.extend( context.applications )
+		return applications
+
+	def queryAllStates( self, applications=None ) :
+		"""
+		Coroutine that returns a dictionary of AsyncApplication to state, asking them all at once.
+		"""
+		if applications==None : applications=self.allApplications()
+		states=yield gather( *[application.getState() for application in applications] )
+		raise Return( dict( zip(applications,states) ) )
+
+	def _contextStages( self ) :
+		asyncContexts={}
+		for context in self.contexts : asyncContexts[context.context]=context
+		return [[asyncContexts[context] for context in stage] for stage in self.program.contextStages()]
+
+	def startAllProcesses( self, ignoreIfCurrentlyRunning=False, forceRestart=False, forceStart=False, timeout=30.0 ) :
+		"""
+		See XDAQTools.Program.startAllProcesses.
+		"""
+		stages=self._contextStages()
+		timings={}
+		def start( context ) :
+			startTime=time.time()
+			yield context.startProcess( ignoreIfCurrentlyRunning, forceRestart, forceStart )
+			if len(stages)>1 : yield context.waitUntilProcessStarted( timeout )
+			timings[context.context]=time.time()-startTime
+		for stage in stages :
+			yield gather( *[start(context) for context in stage] )
+		raise Return( timings )
+
+	def killAllProcesses( self, timeout=10.0 ) :
+		"""
+		See XDAQTools.Program.killAllProcesses.
+		"""
+		stages=self._contextStages()
+		stages.reverse()
+		timings={}
+		def kill( context ) :
+			startTime=time.time()
+			killed=yield context.killProcess()
+			if killed and len(stages)>1 : yield context.waitUntilProcessKilled( timeout )
+			timings[context.context]=time.time()-startTime
+		for stage in stages :
+			yield gather( *[kill(context) for context in stage] )
+		raise Return( timings )
+
+	def waitUntilAllProcessesStarted( self, timeout=30.0 ) :
+		startTime=time.time()
+		yield _waitFor( self.queryAllStates, lambda states : "<uncontactable>" not in states.values(), timeout, "Not all applications started within "+str(timeout)+" seconds." )
+		# Same check as XDAQTools.Program.waitUntilAllProcessesStarted that they answer properly
+		def allReady() :
+			ready=yield gather( *[application.isReady() for application in self.allApplications()] )
+			raise Return( False not in ready )
+		yield _waitFor( allReady, lambda ready : ready, max(timeout-(time.time()-startTime),0.0), "Not all applications were ready within "+str(timeout)+" seconds." )
+
+	def waitUntilAllProcessesKilled( self, timeout=10.0 ) :
+		yield _waitFor( self.queryAllStates, lambda states : len([state for state in states.values() if state!="<uncontactable>"])==0, timeout, "Not all applications were killed within "+str(timeout)+" seconds." )
+
+	def sendAllCommand( self, command ) :
+		yield gather( *[application.sendCommand(command) for application in self.allApplications()] )
+
+	def findAllMatchingApplications( self, className, instance=None ) :
+		return [self.asyncApplication(application) for application in self.program.findAllMatchingApplications( className, instance )]
+
+	def waitAllMatchingApplicationsForState( self, state, timeout, className, instance=None ) :
+		"""
+		See XDAQTools.Program.waitAllMatchingApplicationsForState, except that this raises an exception
+		if any of them don't reach the state.
+		"""
+		yield gather( *[application.waitForState( state, timeout ) for application in self.findAllMatchingApplications( className, instance )] )
@@ -0,0 +1,144 @@
+import re, threading
+
+class ChipRegistry(object) :
+	"""
+	Keeps track of the CBCs connected to every board, indexed by (board, FE, CBC).
+
+	"board" is the instance number of the GlibSupervisor that controls the board. "FE" is the front
+	end number the GlibSupervisor uses in its I2C filenames; note that for some reason it calls FMC 1
+	"FE1" and FMC 2 "FE0". Each chip also has a name. On board 0 this is the same as the I2C filename,
+	e.g. "FE0CBC1", so that everything written before there were multiple boards still works. Chips
+	on other boards are prefixed with the board, e.g. "GLIB1_FE0CBC1".
+
+	The C++ analyser numbers the CBCs consecutively as 'CBC 00', 'CBC 01' etcetera, which is
+	translated with nameForAnalyserName.
+
+	Each SimpleGlibProgram has its own registry for the boards it controls, so one program
+	rediscovering its chips doesn't change what another sees. Give the program's registry to the
+	AnalyserControl for that program so that they agree on the names.
+
+	All the methods can be called from different threads.
+	"""
+	def __init__( self, fesPerBoard=2, cbcsPerFe=2 ) :
+		self.fesPerBoard=fesPerBoard
+		self.cbcsPerFe=cbcsPerFe
+		self._chips={}          # (board,fe,cbc) to chip
+		self._keysByName={}     # name to (board,fe,cbc)
+		self._keysByBoard={}    # board to list of (board,fe,cbc), kept sorted
+		self._lock=threading.Lock()
+
+	@staticmethod
+	def localName( fe, cbc ) :
+		"""
+		The name the GlibSupervisor uses for the chip, which is also the I2C filename without ".txt".
+		"""
+		return "FE%dCBC%d"%(fe,cbc)
+
+	@staticmethod
+	def chipName( board, fe, cbc ) :
+		if board==0 : return ChipRegistry.localName( fe, cbc )
+		return "GLIB%d_"%board+ChipRegistry.localName( fe, cbc )
+
+	def addChip( self, board, fe, cbc, chip ) :
+		"""
+		Adds the chip, replacing any that was already registered at that position. Returns the name.
+		"""
+		key=(board,fe,cbc)
+		name=ChipRegistry.chipName( board, fe, cbc )
+		self._lock.acquire()
+		try :
+			if key not in self._chips :
+				self._keysByBoard.setdefault( board, [] ).append( key )
+				self._keysByBoard[board].sort()
+			self._chips[key]=chip
+			self._keysByName[name]=key
+		finally :
+			self._lock.release()
+		return name
+
+	def removeBoard( self, board ) :
+		"""
+		Forgets all the chips on the board, e.g. before rediscovering which ones are connected.
+		"""
+		self._lock.acquire()
+		try :
+			for key in self._keysByBoard.pop( board, [] ) :
+				del self._chips[key]
+				del self._keysByName[ChipRegistry.chipName(*key)]
+		finally :
+			self._lock.release()
+
+	def boards( self ) :
+		self._lock.acquire()
+		try :
+			return sorted( self._keysByBoard.keys() )
+		finally :
+			self._lock.release()
+
+	def chip( self, board, fe, cbc ) :
+		self._lock.acquire()
+		try :
+			return self._chips[(board,fe,cbc)]
+		finally :
+			self._lock.release()
+
+	def chipNamed( self, name ) :
+		self._lock.acquire()
+		try :
+			return self._chips[self._keysByName[name]]
+		finally :
+			self._lock.release()
+
+	def keyForName( self, name ) :
+		self._lock.acquire()
+		try :
+			return self._keysByName[name]
+		finally :
+			self._lock.release()
+
+	def keys( self, board=None, fe=None, cbc=None ) :
+		"""
+		Returns the (board,fe,cbc) of all the registered chips, optionally limited to a board, FE or
+		CBC number.
+		"""
+		self._lock.acquire()
+		try :
+			if board!=None : keys=list( self._keysByBoard.get(board,[]) )
+			else :
+				keys=[]
+				for boardNumber in sorted( self._keysByBoard.keys() ) : keys.extend( self._keysByBoard[boardNumber] )
+		finally :
+			self._lock.release()
+		if fe!=None : keys=[key for key in keys if key[1]==fe]
+		if cbc!=None : keys=[key for key in keys if key[2]==cbc]
+		return keys
+
+	def names( self, board=None, fe=None, cbc=None ) :
+		return [ChipRegistry.chipName(*key) for key in self.keys(board,fe,cbc)]
+
+	def chipsByLocalName( self, board ) :
+		"""
+		Returns a dictionary of the chips on the board, keyed by the name the GlibSupervisor uses.
+		"""
+		result={}
+		self._lock.acquire()
+		try :
+			for key in self._keysByBoard.get( board, [] ) :
+				result[ChipRegistry.localName(key[1],key[2])]=self._chips[key]
+		finally :
+			self._lock.release()
+		return result
+
+	def nameForAnalyserName( self, analyserName ) :
+		"""
+		Converts the name the C++ analyser uses (e.g. 'CBC 02') to the chip name (e.g. 'FE1CBC0').
+		Anything that isn't in the analyser format is returned unchanged.
+		"""
+		match=re.match( r"CBC (\d+)$", analyserName )
+		if match==None : return analyserName
+		index=int( match.group(1) )
+		cbcsPerBoard=self.fesPerBoard*self.cbcsPerFe
+		board=index//cbcsPerBoard
+		fe=(index%cbcsPerBoard)//self.cbcsPerFe
+		cbc=index%self.cbcsPerFe
+		return ChipRegistry.chipName( board, fe, cbc )
@@ -0,0 +1,154 @@
+import os, time, select, struct
+
+# inotify is used if it's available, i.e. on linux. Otherwise the file is polled with os.stat.
+try :
+	import ctypes, ctypes.util
+	_libc=ctypes.CDLL( ctypes.util.find_library("c") or "libc.so.6", use_errno=True )
+	_libc.inotify_init
+	_libc.inotify_add_watch
+except (ImportError, OSError, AttributeError) :
+	_libc=None
+
+# From sys/inotify.h
+_IN_MODIFY=0x00000002
+_IN_CLOSE_WRITE=0x00000008
+_IN_MOVED_FROM=0x00000040
+_IN_MOVED_TO=0x00000080
+_IN_CREATE=0x00000100
+_IN_DELETE=0x00000200
+# Any of these for the file means it's a different file afterwards
+_IN_REPLACED=_IN_MOVED_FROM|_IN_MOVED_TO|_IN_CREATE|_IN_DELETE
+_IN_EVENT_HEADER=struct.Struct( "iIII" )
+
+## The size of each event in the dump file, the same as RawDataFileReader reads
+EVENT_SIZE=168
+
+class DumpFileMonitor(object) :
+	"""
+	Follows how many events have been written to the file the GlibStreamer dumps data to, by watching
+	the file grow. Every event is a fixed EVENT_SIZE bytes so this doesn't need to ask the streamer
+	anything.
+
+	Create the monitor before the acquisition starts. Anything already in the file then is ignored, in
+	case the streamer appends. If the file gets shorter, or is deleted or replaced, it's assumed the
+	streamer has started it again and everything in it is counted.
+	@code
+		monitor=DumpFileMonitor( "/tmp/run.dat", expectedEvents=100 )
+		... start the acquisition ...
+		while not monitor.waitForEvents( timeout=2.0 ) : print monitor.progress()
+		monitor.close()
+	@endcode
+	On linux inotify is used to wake up as soon as the file changes, otherwise the size is checked
+	every pollInterval seconds.
+	"""
+	## How often, in seconds, the file size is checked when inotify isn't available
+	pollInterval=0.01
+
+	def __init__( self, filename, expectedEvents=None, eventSize=EVENT_SIZE, useInotify=True ) :
+		self.filename=filename
+		self.expectedEvents=expectedEvents
+		self.eventSize=eventSize
+		self._baseline, self._inode = self._fileSizeAndInode()
+		self._previousSize=self._baseline
+		self._fileReplaced=False # Set when inotify says the file has been replaced
+		self._eventsWritten=0
+		self._rate=None
+		self._previousSample=None # (time,eventsWritten) when the number of events last changed
+		self._inotifyFile=None
+		if useInotify and _libc!=None : self._startInotify()
+
+	def close( self ) :
+		if self._inotifyFile!=None :
+			os.close( self._inotifyFile )
+			self._inotifyFile=None
+
+	def progress( self ) :
+		"""
+		Returns a dictionary with the number of 'eventsWritten' so far, the 'rate' in events per second
+		between the last two times the file grew (or None), 'expectedEvents', and 'fractionComplete'
+		(None if expectedEvents wasn't given).
+		"""
+		self._update()
+		if self.expectedEvents : fractionComplete=min( 1.0, float(self._eventsWritten)/self.expectedEvents )
+		else : fractionComplete=None
+		return { 'eventsWritten':self._eventsWritten, 'rate':self._rate, 'expectedEvents':self.expectedEvents, 'fractionComplete':fractionComplete }
+
+	def waitForEvents( self, numberOfEvents=None, timeout=None ) :
+		"""
+		Blocks until at least numberOfEvents (by default expectedEvents) have been written, or timeout
+		seconds have passed. Returns True if the events have been written, False on a timeout.
+		"""
+		if numberOfEvents==None : numberOfEvents=self.expectedEvents
+		if numberOfEvents==None : raise Exception( "DumpFileMonitor.waitForEvents needs to know how many events to wait for" )
+		if timeout!=None : endTime=time.time()+timeout
+		while True :
+			self._update()
+			if self._eventsWritten>=numberOfEvents : return True
+			if timeout==None : waitTime=1.0
+			else :
+				waitTime=endTime-time.time()
+				if waitTime<=0 : return False
+			self._waitForChange( waitTime )
+
+	def _fileSizeAndInode( self ) :
+		try :
+			status=os.stat( self.filename )
+		except OSError :
+			return (0,None)
+		return (status.st_size,status.st_ino)
+
+	def _update( self ) :
+		size, inode = self._fileSizeAndInode()
+		if self._fileReplaced or inode!=self._inode or size<self._previousSize :
+			# The streamer has started the file again. It will already be writing to it, so look again
+			# now the baseline has been reset so that nothing written since the check above is missed.
+			self._fileReplaced=False
+			self._baseline=0
+			size, inode = self._fileSizeAndInode()
+			self._inode=inode
+		self._previousSize=size
+		eventsWritten=(size-self._baseline)/self.eventSize
+		if eventsWritten!=self._eventsWritten :
+			now=time.time()
+			if self._previousSample!=None and eventsWritten>self._previousSample[1] and now>self._previousSample[0] :
+				self._rate=(eventsWritten-self._previousSample[1])/(now-self._previousSample[0])
+			self._previousSample=(now,eventsWritten)
+			self._eventsWritten=eventsWritten
+
+	def _startInotify( self ) :
+		fileDescriptor=_libc.inotify_init()
+		if fileDescriptor<0 : return
+		# Watch the directory rather than the file, since the file might not exist yet or might be replaced
+		directory=os.path.dirname( os.path.abspath(self.filename) )
+		if _libc.inotify_add_watch( fileDescriptor, directory, _IN_MODIFY|_IN_CLOSE_WRITE|_IN_REPLACED )<0 :
+			os.close( fileDescriptor )
+			return
+		self._inotifyFile=fileDescriptor
+
+	def _waitForChange( self, maximumTime ) :
+		"""
+		Returns when the file might have changed, or after at most maximumTime seconds.
+		"""
+		if self._inotifyFile==None :
+			time.sleep( min(maximumTime,self.pollInterval) )
+			return
+		basename=os.path.basename( self.filename )
+		endTime=time.time()+maximumTime
+		while True :
+			waitTime=endTime-time.time()
+			if waitTime<=0 : return
+			if len( select.select([self._inotifyFile],[],[],waitTime)[0] )==0 : return
+			# Other files in the directory also wake this up, so check the names. Go through all the
+			# events read so that a replacement isn't missed behind a modification.
+			data=os.read( self._inotifyFile, 65536 )
+			position=0
+			changed=False
+			while position+_IN_EVENT_HEADER.size<=len(data) :
+				watch, mask, cookie, nameLength = _IN_EVENT_HEADER.unpack_from( data, position )
+				position+=_IN_EVENT_HEADER.size
+				name=data[position:position+nameLength].rstrip("\0")
+				position+=nameLength
+				if name!=basename : continue
+				changed=True
+				if mask&_IN_REPLACED : self._fileReplaced=True
+			if changed : return
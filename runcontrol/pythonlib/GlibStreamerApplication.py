@@ -1,6 +1,11 @@
-import XDAQTools, re
+import XDAQTools, re, time, threading
+from DumpFileMonitor import DumpFileMonitor
 
 class GlibStreamerApplication( XDAQTools.Application ) :
+	## How long, in seconds, a statusSnapshot is reused for
+	snapshotCacheTime=0.05
+	_eventNumberExpression=re.compile( r'(?<=Acquisition number: )\d+' )
+
 	def __init__( self, host=None, port=None, className=None, instance=None ) :
 		# Because there's a chance I might reassign the class of a base Application instance to this
 		# class, I'll check and see if the base has been initialised before calling the super class
@@ -18,108 +23,220 @@ class GlibStreamerApplication( XDAQTools.Application ) :
 		self.headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
 		self.saveParametersResource = "/urn:xdaq-application:lid="+str(self.id)+"/validParam"
 		self.forceStartResource = "/urn:xdaq-application:lid="+str(self.id)+"/forceStartXgi"
+		self._snapshot=None
+		self._snapshotLock=threading.Lock()
+		self._parametersDirty=True # Nothing has been sent yet
 
+	@XDAQTools.timedOperation( "getState" )
 	def getState(self) :
 		"""
 		Override of base XDAQTools.Application because GlibStreamer doesn't report it's state
 		in the answer to a "ParameterQuery". This is a massive hack because it's the only way
-		I know to get the state.
+		I know to get the state. See statusSnapshot.
 		"""
-		try:
-			# The streamer doesn't have any soap commands to query to the state of the acquisition. The
-			# only external way I can find to see if data is being recorded is to check the html status
-			# page. There's not a specific status display, but depending on the information shown the
-			# status can be inferred.
+		return self.statusSnapshot()['state']
+
+	def statusSnapshot( self, maximumAge=None ) :
+		"""
+		Returns everything that can be found out from the streamer's main page as a dictionary with the keys
+		@code
+			'state'            - the state of the streamer, e.g. "Enabled"
+			'acquisitionState' - "Running" if data is being taken, otherwise "Stopped" (see acquisitionState)
+			'eventNumber'      - the number of the current event if data is being taken, otherwise None
+			'rate'             - events per second since the previous snapshot while taking data, otherwise None
+			'time'             - when the page was fetched, from time.time()
+		@endcode
+		The states are "<uncontactable>" if the page couldn't be fetched, or "<unknown>" if it couldn't
+		be understood.
+		
+		The streamer doesn't have any soap commands to query to the state of the acquisition. The
+		only external way I can find to see if data is being recorded is to check the html status
+		page. There's not a specific status display, but depending on the information shown the
+		status can be inferred. This is likely to break with any change to the GlibStreamer.
+		
+		The page is only fetched if the last snapshot is older than maximumAge seconds (by default
+		snapshotCacheTime), so that polling getState, acquisitionState and acquisitionStateAndEvent
+		one after the other only fetches it once. Sending a command always makes the next call fetch it.
+		"""
+		if maximumAge==None : maximumAge=self.snapshotCacheTime
+		self._snapshotLock.acquire()
+		try :
+			snapshot=self._snapshot
+		finally :
+			self._snapshotLock.release()
+		if snapshot!=None and time.time()-snapshot['time']<=maximumAge : return snapshot
+
+		fetchTime=time.time()
+		try :
 			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
 		except :
-			self.connection.close() # Just in case something left it open and this method is being polled
-			return "<uncontactable>"		
+			# Not kept, so that anything waiting for the process to start sees it as soon as possible
+			return { 'state':"<uncontactable>", 'acquisitionState':"<uncontactable>", 'eventNumber':None, 'rate':None, 'time':fetchTime }
+		snapshot=self._parseStatusPage( response.fullMessage )
+		snapshot['time']=fetchTime
+		snapshot['rate']=None
+		self._snapshotLock.acquire()
+		try :
+			previous=self._snapshot
+			if previous!=None and previous['eventNumber']!=None and snapshot['eventNumber']!=None and snapshot['eventNumber']>=previous['eventNumber'] and fetchTime>previous['time'] :
+				snapshot['rate']=(snapshot['eventNumber']-previous['eventNumber'])/(fetchTime-previous['time'])
+			self._snapshot=snapshot
+		finally :
+			self._snapshotLock.release()
+		return snapshot
+
+	def stateFromStatusPage( self, page ) :
+		"""
+		Works out the state from the html of the streamer's main page, or returns "<unknown>" if it can't.
+		"""
+		return self._parseStatusPage( page )['state']
+
+	def _parseStatusPage( self, page ) :
+		# The only way I've figured out how to get this information is by using some hard coded
+		# knowledge about where it's stored, and what the webpage shows in different states.
+		result={ 'state':"<unknown>", 'acquisitionState':"<unknown>", 'eventNumber':None }
+		lines=page.splitlines()
 		try:
-			# The only way I've figured out how to get this information is by using some
-			# hard coded knowledge about where it's stored
-			streamerState=response.fullMessage.splitlines()[19].split('>')[1].split('<')[0]
-			return streamerState
-		except: return "<unknown>"
+			result['state']=lines[19].split('>')[1].split('<')[0]
+		except: pass
+		if len(lines)>34 :
+			streamerStateLine=lines[34]
+			if streamerStateLine[0:45]=="<table><tr><td><form action='saveHtmlValues'>":
+				# The table to modify parameters is showing which means data is not being taken
+				result['acquisitionState']="Stopped"
+			elif streamerStateLine[0:33]=='<form action="pauseAcquisition" >':
+				result['acquisitionState']="Running"
+				match=GlibStreamerApplication._eventNumberExpression.search( page )
+				if match!=None : result['eventNumber']=int( match.group(0) )
+		return result
+
+	def forgetStatusSnapshot( self ) :
+		"""
+		Makes the next statusSnapshot fetch the page, e.g. because a command has been sent.
+		"""
+		self._snapshotLock.acquire()
+		try :
+			self._snapshot=None
+		finally :
+			self._snapshotLock.release()
+
+	def sendCommand( self, command ) :
+		# Anything from before the command is out of date
+		self.forgetStatusSnapshot()
+		return super(GlibStreamerApplication,self).sendCommand( command )
 
 	def setConfigureParameters( self, numberOfEvents=None ) :
 		"""
-		Sets the parameters ready for configuration. Note that these aren't sent to the board until
-		the "Configure" state transition.
+		Sets the parameters ready for configuration and sends them to the streamer straight away. Note
+		that these aren't sent to the board until the "Configure" state transition. See
+		stageConfigureParameters to change them without sending anything yet.
 		"""
-		if numberOfEvents!=None : self.parameters['nbAcq']=numberOfEvents
-		response=self.httpRequest( "POST", self.saveParametersResource, self.parameters, False )
-		if response.status!= 200 : raise Exception( "GlibStreamer.configure got the response "+str(response.status)+" - "+response.reason )
+		self.stageConfigureParameters( numberOfEvents )
+		self.commitParameters( force=True )
 
 	def setOutputFilename( self, filename ) :
 		"""
-		This sets the filename of the DAQ output dump. Note that this change doesn't take effect
-		until the next "Configure" state change (I think).
+		This sets the filename of the DAQ output dump, and sends it to the streamer straight away. Note
+		that this change doesn't take effect until the next "Configure" state change (I think).
 		"""
-		self.parameters['destination']=filename
-		response=self.httpRequest( "POST", self.saveParametersResource, self.parameters, False )
-		if response.status!= 200 : raise Exception( "GlibStreamer.setOutputFilename got the response "+str(response.status)+" - "+response.reason )
+		self.stageOutputFilename( filename )
+		self.commitParameters( force=True )
 
 	def setNumberOfEvents( self, numberOfEvents ) :
 		"""
-		The number of events that will be taken. Note that this change doesn't take effect
-		until the next "Configure" state change (I think).
+		The number of events that will be taken, sent to the streamer straight away. Note that this
+		change doesn't take effect until the next "Configure" state change (I think).
 		"""
-		self.parameters['nbAcq']=numberOfEvents
-		response=self.httpRequest( "POST", self.saveParametersResource, self.parameters, False )
-		if response.status!= 200 : raise Exception( "GlibStreamer.setNumberOfEvents got the response "+str(response.status)+" - "+response.reason )
-		
+		self.stageNumberOfEvents( numberOfEvents )
+		self.commitParameters( force=True )
+
+	# The stage methods are the same as the set methods, but only record the change. Nothing is sent
+	# until commitParameters(), which posts everything that has changed in one go (or nothing if
+	# nothing has). SimpleGlibProgram uses these so that a run only makes one post.
+
+	def stageConfigureParameters( self, numberOfEvents=None ) :
+		if numberOfEvents!=None : self.setParameter( 'nbAcq', numberOfEvents )
+
+	def stageOutputFilename( self, filename ) :
+		self.setParameter( 'destination', filename )
+
+	def stageNumberOfEvents( self, numberOfEvents ) :
+		self.setParameter( 'nbAcq', numberOfEvents )
+
+	def setParameter( self, name, value ) :
+		"""
+		Changes one of the parameters in the form posted to the streamer. Nothing is sent until
+		commitParameters().
+		"""
+		if name not in self.parameters or self.parameters[name]!=value :
+			self.parameters[name]=value
+			self._parametersDirty=True
+
+	def commitParameters( self, force=False ) :
+		"""
+		Sends the parameters to the streamer if any have changed since they were last sent, or always if
+		force is True. The streamer takes the whole form at once so they all go in one post. Returns True
+		if anything was sent.
+		"""
+		parameters=self.parametersToCommit( force )
+		if parameters==None : return False
+		response=self.httpRequest( "POST", self.saveParametersResource, parameters )
+		if response.status!= 200 : raise Exception( "GlibStreamer.commitParameters got the response "+str(response.status)+" - "+response.reason )
+		self.markParametersCommitted()
+		return True
+
+	def parametersToCommit( self, force=False ) :
+		"""
+		Returns a copy of the parameters that commitParameters would post, or None if nothing would be
+		sent. For anything (e.g. AsyncSimpleGlibProgram) that does the post itself, which should call
+		markParametersCommitted afterwards.
+		"""
+		if not (self._parametersDirty or force) : return None
+		return dict( self.parameters )
+
+	def markParametersCommitted( self ) :
+		self._parametersDirty=False
+
+	def markParametersUnsent( self ) :
+		"""
+		Makes the next commitParameters() send everything, e.g. because the process has been restarted.
+		"""
+		self._parametersDirty=True
+
+	@XDAQTools.timedOperation( "acquisitionState" )
 	def acquisitionState(self):
 		"""
 		Reports whether data is being taken or not. Note that this is different to the state the
 		GlibStreamer is in - it will still report "Running" after all events have been taken until
-		the next state change.
-		
-		The streamer doesn't have any soap commands to query to the state of the acquisition. The
-		only external way I can find to see if data is being recorded is to check the html status
-		page. There's not a specific status display, but depending on the information shown the
-		status can be inferred. This is likely to break with any change to the GlibStreamer.
+		the next state change. See statusSnapshot.
 		"""
-		try:
-			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
-		except:
-			return "<uncontactable>"		
-		try:			
-			# The only way I've figured out how to get this information is by using some
-			# hard coded knowledge what the webpage shows in different states.
-			streamerStateLine=response.fullMessage.splitlines()[34]
-			if streamerStateLine[0:45]=="<table><tr><td><form action='saveHtmlValues'>":
-				# The table to modify parameters is showing which means data is not being taken
-				return "Stopped"
-			elif streamerStateLine[0:33]=='<form action="pauseAcquisition" >':
-				return "Running"
-			else: return "<unknown>"
-		except:
-			return "<unknown>"
+		return self.statusSnapshot()['acquisitionState']
 
+	@XDAQTools.timedOperation( "acquisitionStateAndEvent" )
 	def acquisitionStateAndEvent(self):
 		"""
 		Same as acquisitionState(), but returns a two element array with the state as the first element
 		and either the event number as the second, or 'None' if the acquisition is not running.
 		"""
-		try:
-			response=self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) )
-		except:
-			return ["<uncontactable>",None]
-		try:			
-			# The only way I've figured out how to get this information is by using some
-			# hard coded knowledge what the webpage shows in different states.
-			streamerStateLine=response.fullMessage.splitlines()[34]
-			if streamerStateLine[0:45]=="<table><tr><td><form action='saveHtmlValues'>":
-				# The table to modify parameters is showing which means data is not being taken
-				return ["Stopped",None]
-			elif streamerStateLine[0:33]=='<form action="pauseAcquisition" >':
-				#try :
-					# To get the event number, perform a regular expression search
-				event=re.findall('(?<=Acquisition number: )\w+', response.fullMessage)[0]
-				#except :
-				#	event="error - couldn't get the event number"
-				return ["Running",event]
-			else: return ["<unknown>",None]
-		except:
-			raise
-			return ["<unknown>",None]
+		snapshot=self.statusSnapshot()
+		if snapshot['eventNumber']==None : return [snapshot['acquisitionState'],None]
+		return [snapshot['acquisitionState'],str(snapshot['eventNumber'])]
+
+	def progressMonitor( self ) :
+		"""
+		Returns a DumpFileMonitor for the output file, expecting the number of events currently set.
+		Call this before starting the acquisition, and close() it when finished with.
+		"""
+		return DumpFileMonitor( self.parameters['destination'], int(self.parameters['nbAcq']) )
+
+	def waitForAcquisition( self, monitor, timeout=2.0 ) :
+		"""
+		Blocks until the acquisition has finished, or for at most timeout seconds. Returns True if it
+		has finished, False otherwise. monitor should come from progressMonitor().
+
+		This returns as soon as all the events are in the output file. If the file isn't growing (e.g.
+		the streamer isn't writing to a file) the streamer is asked with acquisitionState() after the
+		timeout instead.
+		"""
+		if monitor.waitForEvents( timeout=timeout ) : return True
+		return self.acquisitionState()!="Running"
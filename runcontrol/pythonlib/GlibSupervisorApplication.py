@@ -4,29 +4,49 @@ import os, inspect
 # of the CBCAnalysis installation.
 INSTALLATION_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))), os.pardir, os.pardir))
 
-import XDAQTools, re
-from I2cChip import I2cChip
+import XDAQTools, re, math, threading, Queue
+from contextlib import contextmanager
+from I2cChip import I2cChip, I2cFileWriter
+from ChipRegistry import ChipRegistry
 
 class GlibSupervisorApplication( XDAQTools.Application ) :
-	def __init__( self, host=None, port=None, className=None, instance=None, I2cRegisterDirectory=INSTALLATION_PATH+"/runcontrol/i2c" ) :
+	# For some reason, the GlibSupervisor calls FMC1 "FE1" and FMC2 "FE0".
+	FE_FOR_FMC={ 1:1, 2:0 }
+
+	def __init__( self, host=None, port=None, className=None, instance=None, I2cRegisterDirectory=INSTALLATION_PATH+"/runcontrol/i2c", chipRegistry=None ) :
 		# Because there's a chance I might reassign the class of a base Application instance to this
 		# class, I'll check and see if the base has been initialised before calling the super class
 		# constructor.
 		if not hasattr( self, "host" ) : super(GlibSupervisorApplication,self).__init__( host, port, className, instance )
 
 		self._directoryForI2C=I2cRegisterDirectory
+		# The connected chips are registered under the board number, which is the instance number
+		# of this GlibSupervisor. SimpleGlibProgram gives all its supervisors the same registry.
+		if chipRegistry==None : chipRegistry=ChipRegistry()
+		self.chipRegistry=chipRegistry
+		self.boardNumber=self.instance
 		# I2C parameters have to be saved to a file, and then the GlibSupervisor told to send the
 		# file to the board. This is the temporary directory I'll use to store the files.
 		# Have a lot of problems if I don't have permission to write to this directory, so try
 		# and make the directory unique to the user.
 		try: usernameSuffix="_"+os.environ['USER']
 		except KeyError: usernameSuffix=""
-		self.tempDirectory="/tmp/cbcTestStandTempFiles"+usernameSuffix+"/supervisor"
+		# These files are rewritten every time anything is sent, so use a memory backed file system
+		# if there is one.
+		if os.path.isdir("/dev/shm") and os.access("/dev/shm",os.W_OK) : tempRoot="/dev/shm"
+		else : tempRoot="/tmp"
+		self.tempDirectory=tempRoot+"/cbcTestStandTempFiles"+usernameSuffix+"/supervisor"
+		# Each board needs its own directory, otherwise the files for one would be sent to another
+		if self.boardNumber!=0 : self.tempDirectory+=str(self.boardNumber)
 		try :
 			os.makedirs( self.tempDirectory )
 		except OSError as error:
 			# Acceptable if the directory already exists, but any other error is a problem
 			if error.args[1] != 'File exists' : raise
+		self._i2cFileWriter=I2cFileWriter( self.tempDirectory )
+		# Names of the chips whose files were left in the temporary directory by the last send. None
+		# means it's not known, e.g. a previous process might have left files there.
+		self._chipNamesInTempDirectory=None
 		
 		# Note that because of the way the GlibSupervisor is coded, if some of these are missing
 		# the supervisor will crash. So always make sure all of these are included in the POST
@@ -41,6 +61,7 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 			'user_wb_ttc_fmc_regs_pc_commands2_negative_logic_CBC':'on'
 		}
 		self.saveParametersResource = "/urn:xdaq-application:lid="+str(self.id)+"/saveParameters"
+		self._parametersDirty=True # Nothing has been sent yet
 		## Parameters and resource for reading an I2C address file
 		self.readI2cParameters = { 'i2CFile':I2cRegisterDirectory+"/FE0CBC0.txt" }
 		self.readI2cResource = "/urn:xdaq-application:lid="+str(self.id)+"/i2cRead"
@@ -48,6 +69,22 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		# before hand with a read I2C request (not very RESTful but hey ho).
 		self.writeI2cParameters = {}
 		self.writeI2cResource = "/urn:xdaq-application:lid="+str(self.id)+"/i2cWriteFileValues"
+		# While an i2cTransaction is open any calls to sendI2c are held back until it finishes.
+		self._i2cTransactionDepth=0
+		self._i2cTransactionForce=False
+		# Held while sending, or changing the record of what has been sent. Verification (see
+		# enableI2cVerification) resends from its own thread, but reads the chips back without it.
+		self._i2cLock=threading.RLock()
+		# Each chip's count of sends, so that a verification that has been overtaken by a later send
+		# can be skipped.
+		self._i2cSendCount={}
+		self._i2cReadback=None
+		self._i2cVerificationRetries=0
+		self._i2cVerificationQueue=None
+		self._i2cVerificationThread=None
+		self._i2cVerificationAttempts={} # Chip name to how many times in a row it has failed
+		self._i2cVerificationFailures={}
+		self._i2cVerificationErrors=[]
 
 		# I can only do the setup for the CBCs once this application has gone to the configured
 		# state. I'll have to check this parameter in all methods and configure if it hasn't been
@@ -72,34 +109,31 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		# could do this during __init__.
 		
 		try: 
-			webpage = self.httpRequest( "GET", '/urn:xdaq-application:lid='+str(self.id), {}, True )
+			webpage = self.httpRequest( "GET", '/urn:xdaq-application:lid='+str(self.id) )
 		except:
 			# The XDAQ process probably hasn't been started. Replace the 'connection refused' error
 			# with one that is more discriptive to the user.
 			raise Exception("Couldn't connect to the XDAQ process to get information about the connected CBCs. Is the XDAQ process running and GlibSupervisor initialised?")
 		# Perform a regular expression search on the HTML to see what the
 		# state of each FMC is. I do this by looking at the alt text.
-		fmcState=re.findall( """(?<=alt=')\w+(?='/> FMC 1<)""", webpage.fullMessage )
-		if len(fmcState)!=1 : raise Exception( "Failed when querying which FMCs are connected. This information is only available after GlibSupervisor has been initialised.")
-		elif fmcState[0]=='ON' : self.isFMC1Connected=True
-		elif fmcState[0]=='OFF' : self.isFMC1Connected=False
-		else : raise Exception( "Failed when querying which FMCs are connected. FMC 1 reported '"+fmcState[0]+"' which is not equal to either 'ON' or 'OFF'.")
-		# Do the same for FMC 2
-		fmcState=re.findall( """(?<=alt=')\w+(?='/> FMC 2<)""", webpage.fullMessage )
-		if len(fmcState)!=1 : raise Exception( "Failed when querying which FMCs are connected. This information is only available after GlibSupervisor has been initialised.")
-		elif fmcState[0]=='ON' : self.isFMC2Connected=True
-		elif fmcState[0]=='OFF' : self.isFMC2Connected=False
-		else : raise Exception( "Failed when querying which FMCs are connected. FMC 2 reported '"+fmcState[0]+"' which is not equal to either 'ON' or 'OFF'.")
+		self.connectedFMCs=[]
+		for fmcNumber in sorted( GlibSupervisorApplication.FE_FOR_FMC.keys() ) :
+			fmcState=re.findall( """(?<=alt=')\w+(?='/> FMC """+str(fmcNumber)+"""<)""", webpage.fullMessage )
+			if len(fmcState)!=1 : raise Exception( "Failed when querying which FMCs are connected. This information is only available after GlibSupervisor has been initialised.")
+			elif fmcState[0]=='ON' : self.connectedFMCs.append( fmcNumber )
+			elif fmcState[0]!='OFF' : raise Exception( "Failed when querying which FMCs are connected. FMC "+str(fmcNumber)+" reported '"+fmcState[0]+"' which is not equal to either 'ON' or 'OFF'.")
+		self.isFMC1Connected=(1 in self.connectedFMCs)
+		self.isFMC2Connected=(2 in self.connectedFMCs)
 		
 		self._connectedCBCsHaveBeenInitialised=True
 		
-		self.i2cChips = {}
-		if self.isFMC1Connected :
-			self.i2cChips['FE1CBC0'] = I2cChip()
-			self.i2cChips['FE1CBC1'] = I2cChip()
-		if self.isFMC2Connected :
-			self.i2cChips['FE0CBC0'] = I2cChip()
-			self.i2cChips['FE0CBC1'] = I2cChip()
+		self.chipRegistry.removeBoard( self.boardNumber )
+		for fmcNumber in self.connectedFMCs :
+			for cbcNumber in range( 0, self.chipRegistry.cbcsPerFe ) :
+				self.chipRegistry.addChip( self.boardNumber, GlibSupervisorApplication.FE_FOR_FMC[fmcNumber], cbcNumber, I2cChip() )
+		# Keep a dictionary of the chips on this board keyed by the names the GlibSupervisor uses,
+		# since that's how they're referred to everywhere else.
+		self.i2cChips = self.chipRegistry.chipsByLocalName( self.boardNumber )
 
 		# Try and load the default parameters
 		failedChipNames = []
@@ -131,23 +165,68 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		Configure the parameters on the GLIB with the values required for data taking.
 		You can optionally set a trigger rate in Hz which will be rounded down to the
 		nearest power of 2.
-		Note that these parameters aren't sent to the board unti the "Configure" state
-		transition.
+		Note that these parameters are sent to the GlibSupervisor straight away, but not to
+		the board until the "Configure" state transition.
+		"""
+		self.stageConfigureParameters( triggerRate )
+		self.commitParameters( force=True )
+
+	def stageConfigureParameters( self, triggerRate=None ) :
+		"""
+		The same as setConfigureParameters, but nothing is sent until commitParameters() (which
+		SimpleGlibProgram.configure does), so that several changes go in one post.
 		"""
 		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
 		if triggerRate!=None :
 			triggerRateCode = int( math.log( triggerRate, 2 ) )
-			self.parameters['user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ']=triggerRateCode
-		response=self.httpRequest( "POST", self.saveParametersResource, self.parameters, False )
-		if response.status!= 200 : raise Exception( "GlibSupervisor.configure got the response "+str(response.status)+" - "+response.reason )
+			self.setParameter( 'user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ', triggerRateCode )
+
+	def setParameter( self, name, value ) :
+		"""
+		Changes one of the parameters in the form posted to the GlibSupervisor. Nothing is sent until
+		commitParameters().
+		"""
+		if name not in self.parameters or self.parameters[name]!=value :
+			self.parameters[name]=value
+			self._parametersDirty=True
+
+	def commitParameters( self, force=False ) :
+		"""
+		Sends the parameters to the GlibSupervisor if any have changed since they were last sent, or
+		always if force is True. They all go in one post. Returns True if anything was sent.
+		"""
+		parameters=self.parametersToCommit( force )
+		if parameters==None : return False
+		response=self.httpRequest( "POST", self.saveParametersResource, parameters )
+		if response.status!= 200 : raise Exception( "GlibSupervisor.commitParameters got the response "+str(response.status)+" - "+response.reason )
+		self.markParametersCommitted()
+		return True
+
+	def parametersToCommit( self, force=False ) :
+		"""
+		Returns a copy of the parameters that commitParameters would post, or None if nothing would be
+		sent. For anything (e.g. AsyncSimpleGlibProgram) that does the post itself, which should call
+		markParametersCommitted afterwards.
+		"""
+		if not (self._parametersDirty or force) : return None
+		return dict( self.parameters )
+
+	def markParametersCommitted( self ) :
+		self._parametersDirty=False
+
+	def markParametersUnsent( self ) :
+		"""
+		Makes the next commitParameters() send everything, e.g. because the process has been restarted.
+		"""
+		self._parametersDirty=True
 
 	def setAllChannelTrims( self, value ) :
 		"""
 		Sets the trim for all channels. Note that this isn't written to the board until sendI2C is called
 		"""
 		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
-		for channel in range(0,254) :
-			self.setChannelTrim( channel, value )
+		for chip in self.i2cChips.values() :
+			chip.setChannelTrims( [value]*len(chip.getChannelTrims()) )
 	
 	def setChannelTrim( self, channel, value, chipNames=None ) :
 		"""
@@ -184,31 +263,214 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		
 		if chipNames==None : chipNames=self.i2cChips.keys()
 		for name in chipNames :
-			chip = self.i2cChips[name]
-			for name in registerNameValueTuple :
-				register = chip.getRegister(name)
-				register.value = registerNameValueTuple[name]
+			self.i2cChips[name].setValues( registerNameValueTuple )
 
-	def sendI2c( self, registerNames=None, chipNames=None ) :
+	@contextmanager
+	def i2cTransaction( self ) :
 		"""
-		Sends all of the I2C registers to the chips by writing to temporary files and asking the
-		GlibSupervisor to send these files. By default does so for all connected CBCs, but this
-		can be limited by specifying an array for 'chipNames'.
+		Context manager that holds back sending any I2C changes until the end of the block, so that
+		several changes across several chips only need one send. E.g.
+		@code
+			with supervisor.i2cTransaction() :
+				supervisor.setI2c( {"VCth":0x78}, ["FE0CBC0"] )
+				supervisor.setChannelTrim( 5, 0x80 )
+				supervisor.sendI2c()   # held back
+			# everything that changed is sent here, once
+		@endcode
+		Calls to sendI2c within the block are not sent individually; when the block finishes
+		everything that has changed is sent, regardless of any registerNames or chipNames limits
+		given in those calls. If an exception is raised within the block nothing is sent and all
+		chips are put back to the values they had when the block started. Transactions can be
+		nested, in which case only the outermost one sends or rolls back.
 		"""
 		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
+		self._i2cTransactionDepth+=1
+		if self._i2cTransactionDepth>1 :
+			try :
+				yield self
+			finally :
+				self._i2cTransactionDepth-=1
+			return
+
+		self._i2cTransactionForce=False
+		startValues={}
+		for name in self.i2cChips :
+			startValues[name]=self.i2cChips[name].getValues()
+		try :
+			yield self
+		except :
+			self._i2cTransactionDepth-=1
+			for name in startValues :
+				self.i2cChips[name].setValues( startValues[name] )
+			raise
+		self._i2cTransactionDepth-=1
+		self.sendI2c( force=self._i2cTransactionForce )
+
+	def sendI2c( self, registerNames=None, chipNames=None, force=False ) :
+		"""
+		Sends the I2C registers to the chips by writing to temporary files and asking the
+		GlibSupervisor to send these files. By default does so for all connected CBCs, but this
+		can be limited by specifying an array for 'chipNames'.
 		
-		self.saveI2c( self.tempDirectory, registerNames, chipNames )
-		self.sendI2cFilesFromDirectory( self.tempDirectory )
+		Only registers that have changed since they were last sent are sent, and chips with no
+		changes are left out. If nothing has changed nothing is sent at all. Set 'force' to True
+		to send everything regardless, e.g. after something has reset the chips.
+		
+		If called within an i2cTransaction block nothing is sent until the block finishes.
+		"""
+		with self._i2cLock :
+			registersToSend=self._prepareI2cSend( registerNames, chipNames, force )
+			if len(registersToSend)==0 : return
+			self._sendI2cFilesFromDirectory( self.tempDirectory )
+			self._markI2cSent( registersToSend )
 
-	def saveI2c( self, directoryName, registerNames=None, chipNames=None ) :
+	def _prepareI2cSend( self, registerNames, chipNames, force ) :
+		"""
+		Works out what sendI2c has to send and writes the files for it to the temporary directory.
+		Returns a dictionary of chip name to the names of the registers written, which is empty if
+		nothing needs sending. Once the files have been sent, call _markI2cSent with the result.
+		Hold _i2cLock from before calling this until after _markI2cSent.
+		"""
 		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
-		# First make sure there are no files left over from previous sends. Allow an error
-		# of 'No such file or directory' but throw any other exceptions.
-		for filename in ["FE0CBC0.txt","FE0CBC1.txt","FE1CBC0.txt","FE1CBC1.txt"] :
+		
+		if self._i2cTransactionDepth>0 :
+			if force : self._i2cTransactionForce=True
+			return {}
+		
+		if chipNames==None : chipNames=self.i2cChips.keys()
+		if force :
+			for name in chipNames : self.i2cChips[name].markUnsent()
+		
+		registersToSend={}
+		for name in chipNames :
+			dirtyRegisterNames=self.i2cChips[name].dirtyRegisterNames( registerNames )
+			if len(dirtyRegisterNames)>0 : registersToSend[name]=dirtyRegisterNames
+		if len(registersToSend)==0 : return registersToSend
+		
+		# Make sure there are no files left over from previous sends for chips that aren't being sent
+		# this time, otherwise they'd be sent their old files. Allow an error of 'No such file or
+		# directory' but throw any other exceptions.
+		if self._chipNamesInTempDirectory==None : staleNames=self.i2cChips.keys()
+		else : staleNames=self._chipNamesInTempDirectory
+		self._chipNamesInTempDirectory=None # In case anything goes wrong before the end
+		for name in staleNames :
+			if name in registersToSend : continue
 			try :
-				os.remove( os.path.join(self.tempDirectory,filename) )
+				os.remove( os.path.join(self.tempDirectory,name+".txt") )
 			except Exception as error :
 				if error.args[1] != 'No such file or directory' : raise
+		for name in registersToSend :
+			chip=self.i2cChips[name]
+			if len(registersToSend[name])==len(chip.bank) : self._i2cFileWriter.write( name, chip )
+			else : self._i2cFileWriter.write( name, chip, registersToSend[name] )
+		self._chipNamesInTempDirectory=set( registersToSend.keys() )
+		for name in registersToSend : self._i2cSendCount[name]=self._i2cSendCount.get(name,0)+1
+		return registersToSend
+
+	def _markI2cSent( self, registersToSend ) :
+		for name in registersToSend :
+			self.i2cChips[name].markSent( registersToSend[name] )
+			if self._i2cReadback!=None :
+				expectedValues, positions = self.i2cChips[name].sentValues()
+				self._i2cVerificationQueue.put( (name,self._i2cSendCount[name],expectedValues,positions) )
+
+	def enableI2cVerification( self, readback, retries=2 ) :
+		"""
+		Checks that the chips really were programmed after every sendI2c. "readback" is a function
+		that is called as readback( supervisor, chipName ) and returns what is on the chip, as an
+		I2cRegisterFile or a dictionary of register name to value. It should read back the whole chip
+		in one go if at all possible. The GlibSupervisor doesn't have a request for this that I know
+		of, which is why it has to be given.
+		
+		Verification is done in a separate thread, and the read back is done without holding up
+		sendI2c, so that sendI2c returns as soon as the registers are sent and the check overlaps
+		whatever is done next (e.g. taking data for the next step of a scan). What is read back is
+		compared with what was sent in one go. Only the registers that don't match are resent, up to
+		"retries" times. Anything that still doesn't match is reported by waitForI2cVerification.
+		"""
+		self.waitForI2cVerification( raiseOnFailure=False )
+		self._i2cReadback=readback
+		self._i2cVerificationRetries=retries
+		if self._i2cVerificationThread==None :
+			self._i2cVerificationQueue=Queue.Queue()
+			self._i2cVerificationThread=threading.Thread( target=self._verifyI2cLoop, args=(self._i2cVerificationQueue,) )
+			self._i2cVerificationThread.daemon=True
+			self._i2cVerificationThread.start()
+
+	def disableI2cVerification( self ) :
+		"""
+		Stops verifying sends, once anything already sent has been verified. Returns the same as
+		waitForI2cVerification( raiseOnFailure=False ).
+		"""
+		result=self.waitForI2cVerification( raiseOnFailure=False )
+		self._i2cReadback=None
+		if self._i2cVerificationThread!=None :
+			self._i2cVerificationQueue.put( None )
+			self._i2cVerificationThread.join()
+			self._i2cVerificationThread=None
+			self._i2cVerificationQueue=None
+		return result
+
+	def waitForI2cVerification( self, raiseOnFailure=True ) :
+		"""
+		Waits until every send so far has been verified (and resent if necessary). Returns a dictionary
+		of chip name to the list of registers that still didn't match after all the retries, and
+		clears it. If raiseOnFailure is True an exception is raised instead if there were any, or if
+		the readback function itself failed.
+		"""
+		if self._i2cVerificationQueue!=None : self._i2cVerificationQueue.join()
+		with self._i2cLock :
+			failures=self._i2cVerificationFailures
+			errors=self._i2cVerificationErrors
+			self._i2cVerificationFailures={}
+			self._i2cVerificationErrors=[]
+		if raiseOnFailure :
+			if len(errors)!=0 : raise Exception( "Reading back the I2C registers failed: "+str(errors[0]) )
+			if len(failures)!=0 : raise Exception( "I2C registers didn't match what was sent: "+str(failures) )
+		return failures
+
+	def _verifyI2cLoop( self, queue ) :
+		while True :
+			item=queue.get()
+			try :
+				if item==None : return
+				self._verifyI2c( *item )
+			except Exception as error :
+				with self._i2cLock : self._i2cVerificationErrors.append( error )
+			finally :
+				queue.task_done()
+
+	def _verifyI2c( self, chipName, sendCount, expectedValues, positions ) :
+		readback=self._i2cReadback
+		# If the chip has been sent something since, that send will be verified instead
+		if readback==None or self._i2cSendCount.get(chipName)!=sendCount : return
+		# Sends can carry on while this is read back; anything sent in the meantime is noticed below
+		readRegisters=readback( self, chipName )
+		chip=self.i2cChips[chipName]
+		mismatchedNames=chip.compareValues( expectedValues, readRegisters, positions )
+		with self._i2cLock :
+			if self._i2cSendCount.get(chipName)!=sendCount : return
+			if len(mismatchedNames)==0 :
+				self._i2cVerificationAttempts.pop( chipName, None )
+				return
+			attempts=self._i2cVerificationAttempts.get( chipName, 0 )+1
+			if attempts>self._i2cVerificationRetries :
+				self._i2cVerificationAttempts.pop( chipName, None )
+				self._i2cVerificationFailures[chipName]=mismatchedNames
+				return
+			self._i2cVerificationAttempts[chipName]=attempts
+			# Whatever the chip has for these registers isn't what was thought, so send them again.
+			# In a transaction they go when it finishes.
+			chip.markUnsent( mismatchedNames )
+			self.sendI2c( mismatchedNames, [chipName] )
+
+	def saveI2c( self, directoryName, registerNames=None, chipNames=None, registerNamesForChip=None ) :
+		"""
+		Writes the I2C registers for each chip to "<directoryName>/<chipName>.txt". Limit which
+		registers are written with either 'registerNames' for all chips, or 'registerNamesForChip'
+		which is a dictionary of chip name to a list of register names.
+		"""
+		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
 		# make sure the directory exists
 		try:
 			os.makedirs( directoryName )
@@ -217,9 +479,34 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		
 		if chipNames==None : chipNames=self.i2cChips.keys()
 		for name in chipNames :
+			if registerNamesForChip!=None : registerNames=registerNamesForChip[name]
 			self.i2cChips[name].writeToFilename( os.path.join(directoryName,name+".txt"), registerNames )
 
+	def saveI2cSnapshot( self, snapshotStore, name ) :
+		"""
+		Saves the current I2C values of all chips in the I2cSnapshotStore under the given name.
+		Much cheaper than saveI2c if only a few registers change between snapshots.
+		"""
+		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
+		snapshotStore.save( name, self.i2cChips )
+
+	def restoreI2cSnapshot( self, snapshotStore, name ) :
+		"""
+		Sets the I2C values of all chips to those saved under the given name in the I2cSnapshotStore.
+		As with setI2c, nothing is sent to the chips until sendI2c is called.
+		"""
+		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
+		snapshotStore.restore( name, self.i2cChips )
+
 	def loadI2c( self, directoryName ) :
+		"""
+		Loads the register values for each chip from "<directoryName>/<chipName>.txt". All the files
+		are checked before anything is loaded, and an exception is raised if any of them have
+		registers with a different page or address to the ones held.
+		"""
+		for chipName in self.i2cChips.keys() :
+			conflictingNames=self.i2cChips[chipName].checkFile( directoryName+'/'+chipName+'.txt' )[0]
+			if len(conflictingNames)!=0 : raise Exception( "The I2C file for "+chipName+" in "+directoryName+" has a different layout for registers "+str(conflictingNames) )
 		for chipName in self.i2cChips.keys() :
 			self.i2cChips[chipName].loadFromFile(directoryName+'/'+chipName+'.txt')
 
@@ -238,18 +525,37 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		directory name, then the write is sent.
 		
 		Note that this method completely bypasses the I2C representation held internally by this
-		class.
+		class, so afterwards nothing is assumed about what is on the chips and the next sendI2c
+		will send everything.
 		"""
 		if not self._connectedCBCsHaveBeenInitialised : self._initConnectedCBCs()
 		
+		with self._i2cLock :
+			try :
+				self._sendI2cFilesFromDirectory( directoryName )
+			finally :
+				for name in self.i2cChips :
+					self.i2cChips[name].markUnsent()
+					# Any verification still waiting is out of date now
+					self._i2cSendCount[name]=self._i2cSendCount.get(name,0)+1
+
+	def _sendI2cFilesFromDirectory( self, directoryName ) :
+		"""
+		Implementation of sendI2cFilesFromDirectory that leaves the record of what was last sent alone.
+		"""
+		for resource, parameters, stage in self._i2cFileRequests( directoryName ) :
+			response=self.httpRequest( "POST", resource, parameters )
+			if response.status!= 200 : raise Exception( "GlibSupervisor.sendI2cFile during "+stage+" got the response "+str(response.status)+" - "+response.reason )
+
+	def _i2cFileRequests( self, directoryName ) :
+		"""
+		Returns the posts, in order, that tell the GlibSupervisor to send the files in the directory,
+		as a list of (resource, parameters, stage) where stage is used in error messages.
+		"""
 		self.writeI2cParameters = {} # clear this of any previous entries
-		# Note that for some reason, the GlibSupervisor calls FMC1 "FE1" and FMC2 "FE0".
-		if self.isFMC1Connected :
-			if os.path.isfile( directoryName+"/FE1CBC0.txt" ) : self.writeI2cParameters["chkFE1CBC0"]="on"
-			if os.path.isfile( directoryName+"/FE1CBC1.txt" ) : self.writeI2cParameters["chkFE1CBC1"]="on"
-		if self.isFMC2Connected :
-			if os.path.isfile( directoryName+"/FE0CBC0.txt" ) : self.writeI2cParameters["chkFE0CBC0"]="on"
-			if os.path.isfile( directoryName+"/FE0CBC1.txt" ) : self.writeI2cParameters["chkFE0CBC1"]="on"
+		# Only chips on connected FMCs are in i2cChips
+		for name in self.i2cChips.keys() :
+			if os.path.isfile( directoryName+"/"+name+".txt" ) : self.writeI2cParameters["chk"+name]="on"
 		
 		if len( self.writeI2cParameters ) == 0 :
 			raise Exception( "GlibSupervisor.sendI2cFilesFromDirectory was given a directory name containing no files with the required names (e.g. \"FE0CBC0.txt\")" )
@@ -257,10 +563,6 @@ class GlibSupervisorApplication( XDAQTools.Application ) :
 		# First need to set the directory name in the GlibSupervisor. The only way to do this is to
 		# call a "read" first.
 		self.readI2cParameters['i2CFiles']=directoryName
-		response=self.httpRequest( "POST", self.readI2cResource, self.readI2cParameters, False )
-		if response.status!= 200 : raise Exception( "GlibSupervisor.sendI2cFile during read got the response "+str(response.status)+" - "+response.reason )
-
-		# Now the directory has been set I can tell GlibSupervisor to write the files in it
-		response=self.httpRequest( "POST", self.writeI2cResource, self.writeI2cParameters, True )
-		if response.status!= 200 : raise Exception( "GlibSupervisor.sendI2cFile during write got the response "+str(response.status)+" - "+response.reason )
+		# Once the directory has been set I can tell GlibSupervisor to write the files in it
+		return [ (self.readI2cResource,dict(self.readI2cParameters),"read"), (self.writeI2cResource,dict(self.writeI2cParameters),"write") ]
 
@@ -1,22 +1,434 @@
+import array, os, marshal, threading, hashlib, weakref
 
-
-class I2cRegister :
+class I2cRegister(object) :
 	"""
 	Class to hold details about an I2C register for the CBC test stand.
-	 
+
+	Registers that belong to an I2cChip are views onto the chip's I2cRegisterBank, so changing
+	the value here changes it in the chip and vice versa. Registers created directly with the
+	constructor have a bank of their own.
+
 	Author Mark Grimes (mark.grimes@bristol.ac.uk)
 	Date 08/Aug/2013
 	"""
 	def __init__(self,name,page,address,defaultValue,value) :
-		self.name=name
-		self.page=int(page,0)
-		self.address=int(address,0)
-		self.defaultValue=int(defaultValue,0)
-		self.value=int(value,0)
+		self._bank=I2cRegisterBank()
+		self._bank.setRegister( name, int(page,0), int(address,0), int(defaultValue,0), int(value,0) )
+		self._position=0
+	@classmethod
+	def _view( cls, bank, position ) :
+		"""
+		Creates a register that reads and writes the given position in the bank.
+		"""
+		register=cls.__new__(cls)
+		register._bank=bank
+		register._position=position
+		return register
 	def __repr__(self) :
 		return "<I2cRegister "+self.name+", "+hex(self.value)+">"
+	def _setLayout( self, page=None, address=None, defaultValue=None ) :
+		# The layout is shared with other chips, so the bank has to switch to a modified schema
+		if page==None : page=self.page
+		if address==None : address=self.address
+		if defaultValue==None : defaultValue=self.defaultValue
+		self._bank.setRegister( self.name, page, address, defaultValue, self.value )
+	name=property( lambda self : self._bank.schema.names[self._position] )
+	page=property( lambda self : self._bank.schema.pages[self._position],
+		lambda self, newValue : self._setLayout(page=newValue) )
+	address=property( lambda self : self._bank.schema.addresses[self._position],
+		lambda self, newValue : self._setLayout(address=newValue) )
+	defaultValue=property( lambda self : self._bank.schema.defaultValues[self._position],
+		lambda self, newValue : self._setLayout(defaultValue=newValue) )
+	value=property( lambda self : self._bank.values[self._position],
+		lambda self, newValue : self._bank.values.__setitem__(self._position,newValue) )
 	def writeToFile(self,file) :
-		file.write( self.name.ljust(32)+" "+("0x%02x"%self.page).ljust(8)+" "+("0x%02x"%self.address).ljust(8)+" "+("0x%02x"%self.defaultValue).ljust(8)+" "+("0x%02x"%self.value).ljust(8)+"\n" )
+		file.write( self._bank.formatLine(self._position) )
+
+class I2cRegisterSchema(object) :
+	"""
+	The layout of the registers on a chip, i.e. the name, page, address and default value of each
+	register in the order they are held. Also works out which position holds the trim for each
+	channel.
+	
+	All the CBCs have the same layout, so chips share a single instance and only hold their own
+	values. Use I2cRegisterSchema.get rather than the constructor so that identical layouts give
+	the same instance, and never modify one; use withRegisters to get a modified copy.
+	
+	Only schemas that something is still using are kept, so that loading lots of different files
+	(e.g. ones with a register renamed) doesn't keep every layout ever seen.
+	"""
+	_instances=weakref.WeakValueDictionary()
+	_lock=threading.Lock()
+
+	@classmethod
+	def get( cls, names, pages, addresses, defaultValues ) :
+		pages=array.array('B',pages)
+		addresses=array.array('B',addresses)
+		defaultValues=array.array('B',defaultValues)
+		key=( tuple(names), pages.tostring(), addresses.tostring(), defaultValues.tostring() )
+		cls._lock.acquire()
+		try :
+			try :
+				return cls._instances[key]
+			except KeyError :
+				newSchema=cls( key[0], pages, addresses, defaultValues )
+				cls._instances[key]=newSchema
+				return newSchema
+		finally :
+			cls._lock.release()
+
+	@classmethod
+	def empty( cls ) :
+		return cls.get( [], [], [], [] )
+
+	def __init__( self, names, pages, addresses, defaultValues ) :
+		self.names=tuple(names)
+		self.pages=pages
+		self.addresses=addresses
+		self.defaultValues=defaultValues
+		self._linePrefixes=None
+		self.positions=dict( [(name,position) for position,name in enumerate(self.names)] )
+		if len(self.positions)!=len(self.names) : raise Exception( "I2cRegisterSchema was given duplicate register names" )
+		# I don't know if the channel numbers are padded with zeros in the register name, so I'll
+		# try a few possibilities.
+		self.channelPositions=[]
+		while True :
+			channel=len(self.channelPositions)+1
+			position=None
+			for name in [ "Channel%d"%channel, "Channel%02d"%channel, "Channel%03d"%channel ] :
+				position=self.positions.get(name)
+				if position!=None : break
+			if position==None : break
+			self.channelPositions.append(position)
+		# If the channels are stored one after the other (which they are in all the files I've seen)
+		# then bulk trim operations can be done with a single slice.
+		self.channelSlice=None
+		if len(self.channelPositions)>0 :
+			first=self.channelPositions[0]
+			if self.channelPositions==range(first,first+len(self.channelPositions)) :
+				self.channelSlice=slice(first,first+len(self.channelPositions))
+
+	def __len__( self ) :
+		return len(self.names)
+
+	def withRegisters( self, rows ) :
+		"""
+		Returns the schema with the page, address and default value of each register given in the
+		list of (name,page,address,defaultValue,...) tuples changed. Names that aren't already in
+		the schema are added on the end. Returns this schema if nothing changes.
+		"""
+		names=list(self.names)
+		pages=array.array('B',self.pages)
+		addresses=array.array('B',self.addresses)
+		defaultValues=array.array('B',self.defaultValues)
+		positions=dict(self.positions)
+		changed=False
+		for row in rows :
+			name, page, address, defaultValue = row[0:4]
+			position=positions.get(name)
+			if position==None :
+				positions[name]=len(names)
+				names.append(name)
+				pages.append(page)
+				addresses.append(address)
+				defaultValues.append(defaultValue)
+				changed=True
+			elif pages[position]!=page or addresses[position]!=address or defaultValues[position]!=defaultValue :
+				pages[position]=page
+				addresses[position]=address
+				defaultValues[position]=defaultValue
+				changed=True
+		if not changed : return self
+		return I2cRegisterSchema.get( names, pages, addresses, defaultValues )
+
+	def differences( self, other ) :
+		"""
+		Compares with another schema and returns the names of registers that are in both but have a
+		different page, address or default value, and the names of those in "other" that aren't in
+		this schema. Returns two empty lists if "other" is a subset of this schema.
+		"""
+		if other is self : return [],[]
+		conflicting=[]
+		missing=[]
+		positions=self.positions
+		for name, page, address, defaultValue in zip( other.names, other.pages, other.addresses, other.defaultValues ) :
+			position=positions.get(name)
+			if position==None : missing.append(name)
+			elif self.pages[position]!=page or self.addresses[position]!=address or self.defaultValues[position]!=defaultValue :
+				conflicting.append(name)
+		return conflicting, missing
+
+	def linePrefixes( self ) :
+		"""
+		Returns each register's line in the I2C file format up to the value column, which is the
+		only part that differs between chips. Worked out the first time it's asked for.
+		"""
+		if self._linePrefixes==None :
+			self._linePrefixes=[ self.names[position].ljust(32)+" "+("0x%02x"%self.pages[position]).ljust(8)+" "+("0x%02x"%self.addresses[position]).ljust(8)+" "+("0x%02x"%self.defaultValues[position]).ljust(8)+" " for position in range(0,len(self.names)) ]
+		return self._linePrefixes
+
+	def formatLine( self, position, value ) :
+		return self.names[position].ljust(32)+" "+("0x%02x"%self.pages[position]).ljust(8)+" "+("0x%02x"%self.addresses[position]).ljust(8)+" "+("0x%02x"%self.defaultValues[position]).ljust(8)+" "+("0x%02x"%value).ljust(8)+"\n"
+
+class I2cRegisterBank(object) :
+	"""
+	The registers of a chip. The layout is held in an I2cRegisterSchema that is shared with every
+	other chip with the same layout, so the only thing specific to each chip is the contiguous
+	array of register values.
+	"""
+	def __init__( self ) :
+		self.schema=I2cRegisterSchema.empty()
+		self.values=array.array('B')
+
+	def __len__( self ) :
+		return len(self.values)
+
+	def setRegister( self, name, page, address, defaultValue, value ) :
+		"""
+		Sets the details of the named register, adding it on the end if it isn't already held.
+		"""
+		self.setRegisters( [(name,page,address,defaultValue,value)] )
+
+	def setRegisters( self, rows ) :
+		"""
+		Same as setRegister but for a list of (name,page,address,defaultValue,value) tuples. The
+		schema is only replaced once, however many registers change layout.
+		"""
+		self.schema=self.schema.withRegisters( rows )
+		if len(self.values)<len(self.schema) : self.values.extend( [0]*(len(self.schema)-len(self.values)) )
+		positions=self.schema.positions
+		for row in rows :
+			self.values[positions[row[0]]]=row[4]
+
+	def setRegistersFromFile( self, registerFile ) :
+		"""
+		Sets the registers from an I2cRegisterFile. If the file has the same schema as this bank,
+		or this bank is empty, the values are copied across wholesale.
+		"""
+		if len(self.values)==0 : self.schema=registerFile.schema
+		if self.schema is registerFile.schema :
+			self.values[:]=registerFile.values
+		else :
+			self.setRegisters( registerFile.rows() )
+
+	def formatLine( self, position ) :
+		return self.schema.formatLine( position, self.values[position] )
+
+class I2cRegisterFile(object) :
+	"""
+	The parsed contents of an I2C register file, as a schema and an array of values. These are
+	shared through the cache so shouldn't be modified.
+	"""
+	def __init__( self, schema, values ) :
+		self.schema=schema
+		self.values=values
+
+	@classmethod
+	def parse( cls, filename ) :
+		rows=[]
+		inputFile = open(filename,'r')
+		for line in inputFile.readlines() :
+			# Take everything before any comments (comments start with either '#' or '*'
+			# and continue until the end of the line).
+			lineNoComments=line.split('#')[0]
+			lineNoComments=lineNoComments.split('*')[0]
+			if len(lineNoComments)>0:
+				splitLine = lineNoComments.split()
+				if len(splitLine) != 5 : raise Exception("I2C file appears to be in an incorrect format. Line '"+line+"' should split into 5 columns")
+				rows.append( (splitLine[0], int(splitLine[1],0), int(splitLine[2],0), int(splitLine[3],0), int(splitLine[4],0)) )
+		inputFile.close()
+		# Let an I2cRegisterBank sort out registers that are listed more than once
+		bank=I2cRegisterBank()
+		bank.setRegisters( rows )
+		return cls( bank.schema, bank.values )
+
+	def rows( self ) :
+		schema=self.schema
+		return zip( schema.names, schema.pages, schema.addresses, schema.defaultValues, self.values )
+
+	def toString( self ) :
+		"""
+		Compact binary form for saving to disk, which can be read back with fromString.
+		"""
+		schema=self.schema
+		return marshal.dumps( (schema.names, schema.pages.tostring(), schema.addresses.tostring(), schema.defaultValues.tostring(), self.values.tostring()) )
+
+	@classmethod
+	def fromString( cls, string ) :
+		names, pages, addresses, defaultValues, values = marshal.loads( string )
+		return cls( I2cRegisterSchema.get(names,pages,addresses,defaultValues), array.array('B',values) )
+
+class I2cRegisterFileCache(object) :
+	"""
+	Process wide cache of parsed I2C register files, so that loading the same file again doesn't
+	mean parsing it again. Entries are keyed on the file path, and are only used if the file's
+	modification time and size haven't changed.
+	
+	If sidecarDirectory is set, parsed files are also saved there in a compact binary form so that
+	a fresh process (e.g. restarting the GUI server) doesn't need to parse them either.
+	"""
+	# Change this if the sidecar format changes, so that old sidecar files are ignored
+	SIDECAR_VERSION=2
+
+	def __init__( self, sidecarDirectory=None ) :
+		self.sidecarDirectory=sidecarDirectory
+		self._entries={}
+		self._lock=threading.Lock()
+
+	def load( self, filename ) :
+		"""
+		Returns the I2cRegisterFile for the given filename, parsing it only if necessary.
+		"""
+		path=os.path.abspath(filename)
+		fileStatus=os.stat(path)
+		key=(fileStatus.st_mtime,fileStatus.st_size)
+		self._lock.acquire()
+		try :
+			entry=self._entries.get(path)
+		finally :
+			self._lock.release()
+		if entry!=None and entry[0]==key : return entry[1]
+
+		registerFile=self._loadSidecar( path, key )
+		if registerFile==None :
+			registerFile=I2cRegisterFile.parse( path )
+			self._saveSidecar( path, key, registerFile )
+		self._lock.acquire()
+		try :
+			self._entries[path]=(key,registerFile)
+		finally :
+			self._lock.release()
+		return registerFile
+
+	def invalidate( self, filename ) :
+		"""
+		Removes any entry for the file. Files written by this process are invalidated automatically,
+		in case the file system doesn't record modification times finely enough to notice.
+		"""
+		path=os.path.abspath(filename)
+		self._lock.acquire()
+		try :
+			self._entries.pop( path, None )
+		finally :
+			self._lock.release()
+
+	def clear( self ) :
+		self._lock.acquire()
+		try :
+			self._entries.clear()
+		finally :
+			self._lock.release()
+
+	def _sidecarFilename( self, path ) :
+		return os.path.join( self.sidecarDirectory, hashlib.sha1(path).hexdigest()+".i2ccache" )
+
+	def _loadSidecar( self, path, key ) :
+		if self.sidecarDirectory==None : return None
+		try :
+			sidecarFile=open( self._sidecarFilename(path), 'rb' )
+			try :
+				version, sidecarPath, sidecarKey, string = marshal.load( sidecarFile )
+			finally :
+				sidecarFile.close()
+			if version!=I2cRegisterFileCache.SIDECAR_VERSION or sidecarPath!=path or sidecarKey!=key : return None
+			return I2cRegisterFile.fromString( string )
+		except Exception :
+			# Missing or corrupt sidecar files just mean the file has to be parsed again
+			return None
+
+	def _saveSidecar( self, path, key, registerFile ) :
+		if self.sidecarDirectory==None : return
+		try :
+			if not os.path.isdir( self.sidecarDirectory ) : os.makedirs( self.sidecarDirectory )
+			# Write to a temporary file and rename so that other processes never see half a file
+			sidecarFilename=self._sidecarFilename(path)
+			temporaryFilename=sidecarFilename+"."+str(os.getpid())
+			sidecarFile=open( temporaryFilename, 'wb' )
+			try :
+				marshal.dump( (I2cRegisterFileCache.SIDECAR_VERSION, path, key, registerFile.toString()), sidecarFile )
+			finally :
+				sidecarFile.close()
+			os.rename( temporaryFilename, sidecarFilename )
+		except (IOError,OSError) :
+			# The sidecar is only an optimisation, so failing to write it isn't a problem
+			pass
+
+class I2cFileWriter(object) :
+	"""
+	Writes I2C files for sending to the board as quickly as possible, for when the same chips are
+	written over and over again (e.g. every step of a threshold scan).
+
+	Every line is pre-rendered from the schema and only the value column changes. Files with every
+	register are kept in a buffer for each chip, and only the value columns that have changed since
+	the last write are patched. Each file is written with a single write to a temporary file which is
+	then renamed, so the GlibSupervisor never sees half a file.
+	"""
+	# The value column for every possible register value, including the end of line
+	VALUE_COLUMNS=[ ("0x%02x"%value).ljust(8)+"\n" for value in range(0,256) ]
+
+	def __init__( self, directory ) :
+		self.directory=directory
+		# Keyed by chip name, each entry is [schema, buffer, value offsets, values in the buffer]
+		self._fullFiles={}
+
+	def write( self, name, chip, registerNames=None ) :
+		"""
+		Writes the chip's registers to "<directory>/<name>.txt" in the same format as
+		I2cChip.writeToFilename. If registerNames is specified only those registers are written.
+		"""
+		bank=chip.bank
+		if registerNames==None :
+			contents=self._fullFile( name, bank )
+		else :
+			positions=bank.schema.positions
+			linePrefixes=bank.schema.linePrefixes()
+			values=bank.values
+			valueColumns=I2cFileWriter.VALUE_COLUMNS
+			contents="".join( [linePrefixes[position]+valueColumns[values[position]] for position in sorted([positions[registerName] for registerName in registerNames if registerName in positions])] )
+		self._writeFile( os.path.join(self.directory,name+".txt"), contents )
+
+	def _fullFile( self, name, bank ) :
+		entry=self._fullFiles.get( name )
+		if entry==None or entry[0] is not bank.schema :
+			# Render everything from scratch and record where each value column starts
+			linePrefixes=bank.schema.linePrefixes()
+			valueColumns=I2cFileWriter.VALUE_COLUMNS
+			valueOffsets=[]
+			offset=0
+			for position in range(0,len(bank)) :
+				offset+=len(linePrefixes[position])
+				valueOffsets.append( offset )
+				offset+=len(valueColumns[0])
+			contents=bytearray( "".join( [linePrefixes[position]+valueColumns[bank.values[position]] for position in range(0,len(bank))] ) )
+			entry=[bank.schema,contents,valueOffsets,array.array('B',bank.values)]
+			self._fullFiles[name]=entry
+			return contents
+		schema, contents, valueOffsets, renderedValues = entry
+		values=bank.values
+		if values.tostring()!=renderedValues.tostring() :
+			valueColumns=I2cFileWriter.VALUE_COLUMNS
+			for position in range(0,len(values)) :
+				if values[position]!=renderedValues[position] :
+					# All value columns are the same width so they can be patched in place
+					offset=valueOffsets[position]
+					contents[offset:offset+4]=valueColumns[values[position]][0:4]
+			renderedValues[:]=values
+		return contents
+
+	def _writeFile( self, filename, contents ) :
+		temporaryFilename=os.path.join( os.path.dirname(filename), "."+os.path.basename(filename)+".tmp" )
+		fileDescriptor=os.open( temporaryFilename, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0644 )
+		try :
+			written=os.write( fileDescriptor, contents )
+			# A regular file should take it all in one go, but just in case
+			while written<len(contents) : written+=os.write( fileDescriptor, buffer(contents,written) )
+		finally :
+			os.close( fileDescriptor )
+		os.rename( temporaryFilename, filename )
+		registerFileCache.invalidate( filename )
+
+## The cache used by I2cChip.loadFromFile
+registerFileCache=I2cRegisterFileCache()
 
 class I2cChip :
 	"""
@@ -25,7 +437,12 @@ class I2cChip :
 	@date 08/Aug/2013
 	"""
 	def __init__( self, filename=None ) :
-		self.registers=[]
+		self.bank=I2cRegisterBank()
+		# The I2cRegister views onto the bank are only created if someone asks for them
+		self._registerViews=[]
+		# Shadow copy of the values last sent to the chip, so that only registers that have
+		# changed since need to be sent. None means nothing is known about what's on the chip.
+		self._sentValues=None
 		if filename!=None : self.loadFromFile(filename)
 
 	def loadFromFile( self, filename ) :
@@ -34,95 +451,238 @@ class I2cChip :
 		Overwrites any registers that were present before, but leaves ones not mentioned in the
 		text file alone.
 		"""
-		inputFile = open(filename,'r')
-		for line in inputFile.readlines() :
-			# Take everything before any comments (comments start with either '#' or '*'
-			# and continue until the end of the line).
-			lineNoComments=line.split('#')[0]
-			lineNoComments=lineNoComments.split('*')[0]
-			if len(lineNoComments)>0:
-				splitLine = lineNoComments.split()
-				if len(splitLine) != 5 : raise Exception("I2C file appears to be in an incorrect format. Line '"+line+"' should split into 5 columns")
-				newRegister = I2cRegister( splitLine[0], splitLine[1], splitLine[2], splitLine[3], splitLine[4] )
-				self.addRegister( newRegister )
-		
+		self.bank.setRegistersFromFile( registerFileCache.load(filename) )
+
+	def checkFile( self, filename ) :
+		"""
+		Compares the layout of the registers in the file with the registers held. Returns the names of
+		registers that have a different page, address or default value in the file, and the names
+		of registers in the file that aren't held.
+		"""
+		return self.bank.schema.differences( registerFileCache.load(filename).schema )
+
+	@property
+	def registers( self ) :
+		"""
+		List of I2cRegister views onto the registers held, in the order they were loaded.
+		"""
+		for position in range( len(self._registerViews), len(self.bank) ) :
+			self._registerViews.append( I2cRegister._view(self.bank,position) )
+		return self._registerViews
 
 	def addRegister(self,register) :
-		self.registers.append(register)
+		"""
+		Adds the register. If a register with the same name is already held, that one is
+		overwritten with the details of the new one.
+		"""
+		self.bank.setRegister( register.name, register.page, register.address, register.defaultValue, register.value )
 
 	def getRegister(self,registerName) :
 		"""
 		Returns the Register instance with the given name
 		"""
-		for register in self.registers :
-			if register.name==registerName : return register
-		# If control got this far then no register was found
-		return None
-	
+		position=self.bank.schema.positions.get(registerName)
+		if position==None : return None
+		return self.registers[position]
+
 	def getValues(self,registerNames=None) :
 		"""
 		Returns the value of each register in {"<name>": <value>, ...} tuple form. If an array of
 		registerNames is specified only those are returned.
 		"""
+		if registerNames==None : return dict( zip(self.bank.schema.names,self.bank.values) )
 		returnValue = {}
-		for register in self.registers :
-			addThisValue=True
-			if registerNames!=None :
-				if registerNames.count(register.name)==0 : addThisValue=False
-			if addThisValue : returnValue[register.name]=register.value
+		positions=self.bank.schema.positions
+		for name in registerNames :
+			position=positions.get(name)
+			if position!=None : returnValue[name]=self.bank.values[position]
 		return returnValue
-	
+
+	def setValues(self,registerNameValueTuple) :
+		"""
+		Sets the registers named by the keys in the tuple to the values in the tuple.
+		"""
+		positions=self.bank.schema.positions
+		for name in registerNameValueTuple :
+			position=positions.get(name)
+			if position==None : raise Exception( "Nothing known about register "+str(name) )
+			self.bank.values[position]=registerNameValueTuple[name]
+
 	def setChannelTrim( self, channelNumber, value ) :
 		"""
 		Set the register with the name "Channel<channelNumber+1>" to the supplied value.
-		
+
 		Note that the argument starts counting from zero, whereas the register string
 		name starts counting from 1. So calling setChannelTrim( 23, <value> ) will
 		change the register named "Channel024". This is because all other code regarding
 		channels starts counting from zero.
 		"""
-		# I don't know of the channel numbers are padded with zeros in the register
-		# name, so I'll try a few possibilities
-		possibleNames = [ "Channel%d"%(channelNumber+1), "Channel%02d"%(channelNumber+1), "Channel%03d"%(channelNumber+1) ]
-		for name in possibleNames :
-			register = self.getRegister(name)
-		if register==None :
-			raise Exception( "Nothing known about channel "+str(channelNumber) )
-		register.value=value
+		self.bank.values[self._channelPosition(channelNumber)]=value
 
 	def getChannelTrim( self, channelNumber ) :
 		"""
 		Returns the value in register "Channel<channelNumber+1>".
-		
+
 		Note that the argument starts counting from zero, whereas the register string
 		name starts counting from 1. So calling getChannelTrim( 23 ) will return the
 		value of the register named "Channel024". This is because all other code regarding
 		channels starts counting from zero.
 		"""
-		# I don't know of the channel numbers are padded with zeros in the register
-		# name, so I'll try a few possibilities
-		possibleNames = [ "Channel%d"%(channelNumber+1), "Channel%02d"%(channelNumber+1), "Channel%03d"%(channelNumber+1) ]
-		for name in possibleNames :
-			register = self.getRegister(name)
-		if register==None :
+		return self.bank.values[self._channelPosition(channelNumber)]
+
+	def _channelPosition( self, channelNumber ) :
+		"""
+		Returns the position in the bank of the trim for the given channel (counting from zero).
+		"""
+		channelPositions=self.bank.schema.channelPositions
+		if channelNumber<0 or channelNumber>=len(channelPositions) :
 			raise Exception( "Nothing known about channel "+str(channelNumber) )
-		return register.value
-	
+		return channelPositions[channelNumber]
+
+	def getChannelTrims( self ) :
+		"""
+		Returns the trims for all channels as an array, indexed by the channel number counting
+		from zero.
+		"""
+		schema=self.bank.schema
+		if schema.channelSlice!=None : return self.bank.values[schema.channelSlice]
+		values=self.bank.values
+		return array.array( 'B', [values[position] for position in schema.channelPositions] )
+
+	def setChannelTrims( self, trims ) :
+		"""
+		Sets the trims for all channels in one go. "trims" can be any sequence with one entry per
+		channel, indexed by the channel number counting from zero.
+		"""
+		schema=self.bank.schema
+		if len(trims)!=len(schema.channelPositions) :
+			raise Exception( "setChannelTrims was given "+str(len(trims))+" trims but there are "+str(len(schema.channelPositions))+" channels" )
+		if schema.channelSlice!=None :
+			if not isinstance(trims,array.array) or trims.typecode!='B' : trims=array.array('B',trims)
+			self.bank.values[schema.channelSlice]=trims
+		else :
+			values=self.bank.values
+			for channelNumber in range(0,len(trims)) :
+				values[schema.channelPositions[channelNumber]]=trims[channelNumber]
+
+	def dirtyRegisterNames( self, registerNames=None ) :
+		"""
+		Returns the names of the registers whose values have changed since markSent was last called,
+		in the order they are held. If registerNames is specified only those are considered.
+		"""
+		names=self.bank.schema.names
+		if registerNames==None : return [names[position] for position in self._dirtyPositions()]
+		positions=self.bank.schema.positions
+		dirtyPositions=set( self._dirtyPositions() )
+		return [names[position] for position in sorted( [positions[name] for name in registerNames if name in positions] ) if position in dirtyPositions]
+
+	def isDirty( self ) :
+		"""
+		Returns True if any register has changed since markSent was last called.
+		"""
+		sentValues=self._sentValues
+		if sentValues==None or len(sentValues)!=len(self.bank) : return True
+		return sentValues.tostring()!=self.bank.values.tostring()
+
+	def _dirtyPositions( self ) :
+		if not self.isDirty() : return []
+		values=self.bank.values
+		sentValues=self._sentValues
+		if sentValues==None : return range(0,len(values))
+		# Anything added since the last send has never been sent
+		return [position for position in range(0,len(sentValues)) if values[position]!=sentValues[position]]+range( len(sentValues), len(values) )
+
+	def markSent( self, registerNames=None ) :
+		"""
+		Records that the current values are what is on the chip. If registerNames is specified only
+		those registers are recorded.
+		"""
+		values=self.bank.values
+		if registerNames==None :
+			self._sentValues=array.array( 'B', values )
+			return
+		if self._sentValues==None :
+			# Registers that haven't been sent have to still show up as dirty, so fill the shadow
+			# with the bitwise inverse of the current values.
+			self._sentValues=array.array( 'B', [value^0xff for value in values] )
+		elif len(self._sentValues)<len(values) :
+			self._sentValues.extend( [value^0xff for value in values[len(self._sentValues):]] )
+		positions=self.bank.schema.positions
+		for name in registerNames :
+			position=positions.get(name)
+			if position!=None : self._sentValues[position]=values[position]
+
+	def markUnsent( self, registerNames=None ) :
+		"""
+		Forgets what is on the chip, so that all registers are considered dirty. Call this when
+		the chip has been changed by something else, e.g. a reset. If registerNames is specified
+		only those registers are forgotten.
+		"""
+		if registerNames==None or self._sentValues==None :
+			self._sentValues=None
+			return
+		values=self.bank.values
+		positions=self.bank.schema.positions
+		for name in registerNames :
+			position=positions.get(name)
+			if position!=None and position<len(self._sentValues) : self._sentValues[position]=values[position]^0xff
+
+	def sentValues( self ) :
+		"""
+		Returns what is believed to be on the chip, as a copy of the values array and a list of the
+		positions it's known for (None if it's known for all of them). Returns (None,None) if nothing
+		is known. Used to check a read back from the chip with compareValues.
+		"""
+		sentValues=self._sentValues
+		if sentValues==None : return (None,None)
+		values=self.bank.values
+		if sentValues.tostring()==values.tostring() : return (array.array('B',sentValues),None)
+		# Registers that haven't been sent show up as values that differ from the current ones
+		return (array.array('B',sentValues),[position for position in range(0,min(len(sentValues),len(values))) if values[position]==sentValues[position]])
+
+	def compareValues( self, expectedValues, readRegisters, positions=None ) :
+		"""
+		Compares the registers read back from the chip with the expected values (from sentValues) and
+		returns the names of the registers that don't match. "readRegisters" can be an I2cRegisterFile
+		or a dictionary of register name to value; registers that weren't read aren't compared. If
+		positions is specified only those registers are compared.
+		"""
+		schema=self.bank.schema
+		if isinstance( readRegisters, I2cRegisterFile ) and readRegisters.schema is schema :
+			readValues=readRegisters.values
+		else :
+			if isinstance( readRegisters, I2cRegisterFile ) : readRegisters=dict( zip(readRegisters.schema.names,readRegisters.values) )
+			readValues=array.array( 'B', expectedValues )
+			readPositions=[]
+			for name in readRegisters :
+				position=schema.positions.get(name)
+				if position==None or position>=len(readValues) : continue
+				readValues[position]=readRegisters[name]
+				readPositions.append( position )
+			if positions==None : positions=readPositions
+			else : positions=list( set(positions) & set(readPositions) )
+		# Everything usually matches, so compare the whole lot in one go before looking for which don't
+		if positions==None and readValues.tostring()==expectedValues.tostring() : return []
+		if positions==None : positions=range( 0, min(len(readValues),len(expectedValues)) )
+		return [schema.names[position] for position in sorted(positions) if readValues[position]!=expectedValues[position]]
+
 	def writeToFilename( self, filename, registerNames=None ) :
 		"""
 		Writes all currently held values to the given filename. If registerNames is specified only those
 		registers are saved.
 		"""
-		file = open( filename, 'w+' )
-		for register in self.registers :
-			shouldWrite=True
-			if registerNames != None :
-				if registerNames.count(register.name)==0 : shouldWrite=False
-			if shouldWrite : register.writeToFile(file)
-		file.close()
+		if registerNames==None :
+			positions=range(0,len(self.bank))
+		else :
+			# Keep the order the registers are held in, whatever order the names are given in
+			positions=sorted( [self.bank.schema.positions[name] for name in registerNames if name in self.bank.schema.positions] )
+		self._writePositions( filename, positions )
 
 	def writeTrimsToFilename( self, filename ) :
+		self._writePositions( filename, [position for position in range(0,len(self.bank)) if self.bank.schema.names[position][0:7]=='Channel'] )
+
+	def _writePositions( self, filename, positions ) :
 		file = open( filename, 'w+' )
-		for register in self.registers :
-			if register.name[0:7]=='Channel' :register.writeToFile(file)
+		file.write( "".join( [self.bank.formatLine(position) for position in positions] ) )
 		file.close()
+		registerFileCache.invalidate( filename )
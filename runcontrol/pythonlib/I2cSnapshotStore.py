@@ -0,0 +1,196 @@
+import os, marshal, hashlib, array, threading, thread
+from I2cChip import I2cRegisterSchema, I2cRegisterFile
+
+class I2cSnapshotStore(object) :
+	"""
+	Stores the state of a set of I2cChips under a name, e.g. after every loop of a trim calibration,
+	without writing out a full directory of register files each time.
+
+	Everything is stored by the hash of its content, so identical content is only ever stored once.
+	The register layout (I2cRegisterSchema) is stored separately from the values, so each chip in a
+	snapshot costs one small array of values, and nothing at all if those values are already in the
+	store from an earlier snapshot. Snapshots themselves are just a list of which value array each
+	chip uses.
+
+	The directory layout is
+	@code
+		<directory>/objects/<hash>     - schemas and value arrays
+		<directory>/snapshots/<name>   - chip name to value array hash
+	@endcode
+	"""
+	def __init__( self, directory ) :
+		self.directory=directory
+		self._objectsDirectory=os.path.join( directory, "objects" )
+		self._snapshotsDirectory=os.path.join( directory, "snapshots" )
+		for subdirectory in [self._objectsDirectory,self._snapshotsDirectory] :
+			if not os.path.isdir( subdirectory ) : os.makedirs( subdirectory )
+		# Objects never change once written, so anything read can be kept
+		self._objectCache={}
+		self._lock=threading.Lock()
+
+	def names( self ) :
+		"""
+		Returns the names of all the snapshots in the store.
+		"""
+		return sorted( [name for name in os.listdir(self._snapshotsDirectory) if not name.startswith(".")] )
+
+	def save( self, name, chips ) :
+		"""
+		Saves the current state of the chips, given as a dictionary of chip name to I2cChip, under
+		the given name. Overwrites any snapshot already saved with that name.
+		"""
+		self._checkName( name )
+		manifest={}
+		for chipName in chips :
+			bank=chips[chipName].bank
+			schemaHash=self._putObject( ("schema", bank.schema.names, bank.schema.pages.tostring(), bank.schema.addresses.tostring(), bank.schema.defaultValues.tostring()) )
+			manifest[chipName]=self._putObject( ("values", schemaHash, bank.values.tostring()) )
+		self._writeFile( os.path.join(self._snapshotsDirectory,name), marshal.dumps(manifest,0) )
+
+	def load( self, name ) :
+		"""
+		Returns the snapshot as a dictionary of chip name to I2cRegisterFile.
+		"""
+		result={}
+		manifest=self._manifest( name )
+		for chipName in manifest :
+			result[chipName]=self._registerFile( manifest[chipName] )
+		return result
+
+	def restore( self, name, chips ) :
+		"""
+		Sets the chips, given as a dictionary of chip name to I2cChip, to the values in the snapshot.
+		Chips that aren't in the snapshot are left alone. This only changes the values held in memory,
+		call sendI2c afterwards to send them to the board.
+		"""
+		snapshot=self.load( name )
+		for chipName in chips :
+			if chipName in snapshot : chips[chipName].bank.setRegistersFromFile( snapshot[chipName] )
+
+	def diff( self, firstName, secondName ) :
+		"""
+		Compares two snapshots. Returns a dictionary keyed by chip name, where each entry is a list of
+		(registerName, firstValue, secondValue) for the registers that differ. Chips that are the same
+		in both are left out; a register or chip that is only in one of the snapshots has None for the
+		other value.
+		"""
+		firstManifest=self._manifest( firstName )
+		secondManifest=self._manifest( secondName )
+		result={}
+		for chipName in set( firstManifest.keys()+secondManifest.keys() ) :
+			firstHash=firstManifest.get( chipName )
+			secondHash=secondManifest.get( chipName )
+			if firstHash==secondHash : continue
+			differences=self._diffValues( firstHash, secondHash )
+			if len(differences)!=0 : result[chipName]=differences
+		return result
+
+	def delete( self, name ) :
+		"""
+		Removes the snapshot. The objects it used are left in the store since other snapshots might
+		use them too.
+		"""
+		self._checkName( name )
+		os.remove( os.path.join(self._snapshotsDirectory,name) )
+
+	def _diffValues( self, firstHash, secondHash ) :
+		if firstHash==None : firstFile=None
+		else : firstFile=self._registerFile( firstHash )
+		if secondHash==None : secondFile=None
+		else : secondFile=self._registerFile( secondHash )
+
+		if firstFile!=None and secondFile!=None and firstFile.schema is secondFile.schema :
+			# Same layout, so it's just a comparison of the two arrays
+			names=firstFile.schema.names
+			return [(names[position],firstValue,secondValue) for position,(firstValue,secondValue) in enumerate(zip(firstFile.values,secondFile.values)) if firstValue!=secondValue]
+
+		firstValues={}
+		if firstFile!=None : firstValues=dict( zip(firstFile.schema.names,firstFile.values) )
+		secondValues={}
+		if secondFile!=None : secondValues=dict( zip(secondFile.schema.names,secondFile.values) )
+		differences=[]
+		if firstFile!=None : names=list(firstFile.schema.names)
+		else : names=[]
+		if secondFile!=None : names+=[name for name in secondFile.schema.names if name not in firstValues]
+		for name in names :
+			firstValue=firstValues.get(name)
+			secondValue=secondValues.get(name)
+			if firstValue!=secondValue : differences.append( (name,firstValue,secondValue) )
+		return differences
+
+	def _checkName( self, name ) :
+		if len(name)==0 or name!=os.path.basename(name) or name.startswith(".") :
+			raise Exception( "'"+name+"' can't be used as an I2C snapshot name" )
+
+	def _manifest( self, name ) :
+		self._checkName( name )
+		try :
+			inputFile=open( os.path.join(self._snapshotsDirectory,name), 'rb' )
+		except IOError :
+			raise Exception( "There is no I2C snapshot called '"+name+"' in "+self.directory )
+		try :
+			return marshal.load( inputFile )
+		finally :
+			inputFile.close()
+
+	def _registerFile( self, valuesHash ) :
+		kind, schemaHash, values = self._getObject( valuesHash )
+		kind, names, pages, addresses, defaultValues = self._getObject( schemaHash )
+		return I2cRegisterFile( I2cRegisterSchema.get(names,pages,addresses,defaultValues), array.array('B',values) )
+
+	def _putObject( self, content ) :
+		"""
+		Stores the content (anything marshal can handle) if it isn't already stored, and returns its hash.
+		"""
+		# Version 0 of the marshal format never records whether strings are interned, so the same
+		# content always gives the same bytes and hence the same hash.
+		string=marshal.dumps( content, 0 )
+		objectHash=hashlib.sha1( string ).hexdigest()
+		self._lock.acquire()
+		try :
+			if objectHash in self._objectCache : return objectHash
+		finally :
+			self._lock.release()
+		filename=os.path.join( self._objectsDirectory, objectHash )
+		if not os.path.exists( filename ) : self._writeFile( filename, string )
+		# Only remember it once it's definitely in the store, otherwise a failed write would mean it's
+		# never written.
+		self._lock.acquire()
+		try :
+			self._objectCache[objectHash]=content
+		finally :
+			self._lock.release()
+		return objectHash
+
+	def _getObject( self, objectHash ) :
+		self._lock.acquire()
+		try :
+			if objectHash in self._objectCache : return self._objectCache[objectHash]
+		finally :
+			self._lock.release()
+		inputFile=open( os.path.join(self._objectsDirectory,objectHash), 'rb' )
+		try :
+			content=marshal.load( inputFile )
+		finally :
+			inputFile.close()
+		self._lock.acquire()
+		try :
+			self._objectCache[objectHash]=content
+		finally :
+			self._lock.release()
+		return content
+
+	def _writeFile( self, filename, string ) :
+		# Write to a hidden temporary file and rename, so that nothing ever sees half a file. The
+		# temporary name is different for each thread in case two are writing the same object.
+		temporaryFilename=os.path.join( os.path.dirname(filename), "."+os.path.basename(filename)+".tmp"+str(os.getpid())+"_"+str(thread.get_ident()) )
+		try :
+			outputFile=open( temporaryFilename, 'wb' )
+			try :
+				outputFile.write( string )
+			finally :
+				outputFile.close()
+			os.rename( temporaryFilename, filename )
+		except :
+			if os.path.exists( temporaryFilename ) : os.remove( temporaryFilename )
+			raise
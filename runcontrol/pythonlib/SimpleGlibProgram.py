@@ -1,17 +1,31 @@
-import XDAQTools
+import XDAQTools, AsyncXDAQTools, os, contextlib
+from contextlib import contextmanager
 from GlibStreamerApplication import GlibStreamerApplication
 from GlibSupervisorApplication import GlibSupervisorApplication
+from ChipRegistry import ChipRegistry
 
 class SimpleGlibProgram( XDAQTools.Program ) :
 	def __init__( self, xdaqConfigFilename ) :
 		super(SimpleGlibProgram,self).__init__( xdaqConfigFilename )
 		self._extendStreamerAndSupervisor()
+		# See session()
+		self._sessionDepth=0
+		self._sessionNeedsRestart=False
+		## If not None, XDAQTools.statistics is written to this file as JSON at the end of every run
+		self.statisticsFilename=None
 		
 	def _extendStreamerAndSupervisor( self ) :
 		# The super class constructor will create all of the Context and Application instances.
 		# After that I need to run through each Application and find which ones are the
 		# GlibSupervisor and GlibStreamer. Once I find them, I'll change the class type to my
 		# Application subclasses defined above, and keep a note of which ones they are.
+		# There can be several GlibSupervisors if there are several boards; "supervisors" has all
+		# of them, and everything this class does goes to all of them. "supervisor" is the last one
+		# found, for anything that only expects one board. They all register their chips in this
+		# program's chipRegistry, so chip names given to this class are the registry names, e.g.
+		# "GLIB1_FE0CBC1" (which for board 0 are the same as the names the supervisor uses).
+		self.chipRegistry=ChipRegistry()
+		self.supervisors=[]
 		for context in self.contexts :
 			for application in context.applications :
 				if application.className=="GlibStreamer" :
@@ -20,41 +34,47 @@ class SimpleGlibProgram( XDAQTools.Program ) :
 					self.streamer=application # Make a note so I can access it easily later
 				elif application.className=="GlibSupervisor" :
 					application.__class__=GlibSupervisorApplication # Change the class type to my extension
-					application.__init__() # Call the constructor. A check is made to not reinitialise the base.
+					application.__init__( chipRegistry=self.chipRegistry ) # Call the constructor. A check is made to not reinitialise the base.
 					self.supervisor=application # Make a note so I can access it easily later
+					self.supervisors.append( application )
 
 	def reloadXDAQConfig( self ) :
 		del self.streamer
 		del self.supervisor
+		del self.supervisors
+		del self.chipRegistry
 		super(SimpleGlibProgram,self).reloadXDAQConfig()
 		self._extendStreamerAndSupervisor()
 	
 	def initialiseCBCs( self ) :
 		"""
 		Initialises the state of the connected CBCs by checking which FMCs are connected.
-		This means that the XDAQ process for the GlibSupervisor has to be started and
-		initialised. If the process previously wasn't running it will be killed afterwards.
+		This means that the XDAQ process for each GlibSupervisor has to be started and
+		initialised. If a process previously wasn't running it will be killed afterwards.
 		"""
-		if self.supervisor._connectedCBCsHaveBeenInitialised : return
+		XDAQTools.workerPool.map( self._initialiseCBCs, self.supervisors )
+
+	def _initialiseCBCs( self, supervisor ) :
+		if supervisor._connectedCBCsHaveBeenInitialised : return
 
 		try :
-			currentState=self.supervisor.getState()
+			currentState=supervisor.getState()
 			supervisorContext=None
 			if currentState=="<uncontactable>" :
 				# Need to find the context for the supervisor and start it. I don't
 				# know which one it is though so I'll have to search through them.
 				for context in self.contexts :
 					for application in context.applications :
-						if application==self.supervisor : supervisorContext=context
+						if application==supervisor : supervisorContext=context
 				supervisorContext.startProcess( ignoreIfCurrentlyRunning=True )
 				supervisorContext.waitUntilProcessStarted()
-				currentState=self.supervisor.getState()
+				currentState=supervisor.getState()
 	
 			if currentState=="Initial" :
-				self.supervisor.sendCommand( "Initialise" )
-				self.supervisor.waitForState( "Halted" )
+				supervisor.sendCommand( "Initialise" )
+				supervisor.waitForState( "Halted" )
 	
-			self.supervisor._initConnectedCBCs()
+			supervisor._initConnectedCBCs()
 	
 			# If I had to start the process then I'll kill it so that it was in the state
 			# it was in beforehand.
@@ -65,64 +85,243 @@ class SimpleGlibProgram( XDAQTools.Program ) :
 			if currentState=="<uncontactable>" : supervisorContext.killProcess()
 			raise
 			
-		
+	def connectedCBCNames( self ) :
+		"""
+		The names of the connected CBCs on all the boards, as used by the chipRegistry.
+		"""
+		self.initialiseCBCs()
+		return self.chipRegistry.names()
+
+	def _supervisorsForChips( self, chipNames ) :
+		"""
+		Splits a list of chip names (as used by the chipRegistry) up by board. Returns a list of
+		(supervisor, names the supervisor uses for the chips) for each board that has any of them.
+		If chipNames is None every supervisor is returned with None for the names, i.e. all chips.
+		"""
+		if chipNames==None : return [(supervisor,None) for supervisor in self.supervisors]
+		# The registry only knows the names once the chips have been found
+		for supervisor in self.supervisors :
+			if not supervisor._connectedCBCsHaveBeenInitialised : supervisor._initConnectedCBCs()
+		localNamesForBoard={}
+		for name in chipNames :
+			board, fe, cbc = self.chipRegistry.keyForName( name )
+			localNamesForBoard.setdefault( board, [] ).append( ChipRegistry.localName(fe,cbc) )
+		return [(supervisor,localNamesForBoard[supervisor.boardNumber]) for supervisor in self.supervisors if supervisor.boardNumber in localNamesForBoard]
+
+	def _sendCommand( self, applications, command ) :
+		"""
+		Sends the command to all of the applications at the same time.
+		"""
+		XDAQTools.workerPool.map( lambda application : application.sendCommand(command), applications )
+
+	def _waitForSupervisors( self, state, timeout, supervisors=None ) :
+		if supervisors==None : supervisors=self.supervisors
+		XDAQTools.stateWatcher.wait( supervisors, lambda supervisorState : supervisorState==state, timeout, "Not all of the GlibSupervisors reached state "+state+" within "+str(timeout)+" seconds." )
+
 	def initialise( self, triggerRate=None, numberOfEvents=100, timeout=5.0 ) :
 		"""
 		Starts the initialise process. If "timeout" is positive then control will block
 		until all the applications have reached the required state, or until "timeout"
 		seconds have passed.
 		"""
-		self.supervisor.sendCommand( "Initialise" )
-		if timeout>0 : self.supervisor.waitForState( "Halted", timeout )
+		self._sendCommand( self.supervisors, "Initialise" )
+		if timeout>0 : self._waitForSupervisors( "Halted", timeout )
 		
-		# Now that everything is initialised, I'll set the parameters of the GlibSupervisor and
+		# Now that everything is initialised, I'll set the parameters of the GlibSupervisors and
 		# GlibStreamer to what I want to be the defaults. I'll set them here rather than at the
 		# start of configure(..) so that the user can go into the web interface and make additional
 		# changes on top. These settings aren't actually sent to the board until the streamer
-		# and supervisor are sent the "Configure" command, so the user can make additional changes
-		# and then call the configure(..) method.
-		self.supervisor.setConfigureParameters(triggerRate)
-		self.streamer.setConfigureParameters(numberOfEvents)
+		# and supervisors are sent the "Configure" command, so the user can make additional changes
+		# and then call the configure(..) method. The processes might be new, so send everything.
+		for supervisor in self.supervisors : supervisor.markParametersUnsent()
+		self.streamer.markParametersUnsent()
+		self.setConfigureParameters( triggerRate, numberOfEvents )
+		self.commitParameters()
+
+	def setConfigureParameters( self, triggerRate=None, numberOfEvents=100 ) :
+		"""
+		Sets the parameters of all the GlibSupervisors and the GlibStreamer to the defaults for data
+		taking. Nothing is sent until commitParameters().
+		"""
+		for supervisor in self.supervisors : supervisor.stageConfigureParameters(triggerRate)
+		self.streamer.stageConfigureParameters(numberOfEvents)
+
+	@contextmanager
+	def session( self ) :
+		"""
+		Context manager that keeps the XDAQ processes running between runs, e.g.
+		@code
+			with daqProgram.session() :
+				for loop in range(0,10) : SCurveRun( None, daqProgram, analyser, range(100,150) ).run()
+		@endcode
+		Normally every run restarts the processes from scratch and kills them at the end. Within a
+		session startRun reuses the processes from the previous run if they're still healthy, and
+		finishRun leaves them running. If a run fails (abortRun) the next startRun restarts everything.
+		The processes are killed when the session finishes. Sessions can be nested, in which case only
+		the outermost one kills the processes.
+		"""
+		self._sessionDepth+=1
+		try :
+			yield self
+		finally :
+			self._sessionDepth-=1
+			if self._sessionDepth==0 :
+				self._sessionNeedsRestart=False
+				self.killAllProcesses()
+				self.waitUntilAllProcessesKilled()
+
+	def startRun( self, triggerRate=None, numberOfEvents=100 ) :
+		"""
+		Gets the XDAQ processes ready for a run, i.e. started and initialised with the parameters set as
+		in initialise(..), ready for setOutputFilename(..) and configure(). Outside a session this always
+		restarts the processes. Within a session, processes still running from the previous run are
+		reused if they can all be contacted, and only sent the transitions needed to get back to Halted.
+		"""
+		if self._sessionDepth>0 and not self._sessionNeedsRestart :
+			try :
+				if self._returnToHalted( triggerRate, numberOfEvents ) : return
+			except Exception :
+				pass # Something's not right, so start from scratch
+		self.startAllProcesses( forceRestart=True ) # forceRestart will kill the XDAQ processes first if they're running
+		self.waitUntilAllProcessesStarted()
+		self.initialise( triggerRate, numberOfEvents )
+		self._sessionNeedsRestart=False
+
+	def finishRun( self ) :
+		"""
+		Called at the end of a run. Kills the XDAQ processes unless within a session.
+		"""
+		if self.statisticsFilename!=None : XDAQTools.statistics.dump( self.statisticsFilename )
+		if self._sessionDepth>0 : return
+		self.killAllProcesses()
+		self.waitUntilAllProcessesKilled()
+
+	def abortRun( self ) :
+		"""
+		Called when a run fails. Kills the XDAQ processes, and if within a session makes sure the next
+		startRun starts everything from scratch. Doesn't return until the processes have gone, so
+		that the next run can't be talking to a streamer that is still acquiring. This is called while
+		handling another error, so a failure to wait is only printed.
+		"""
+		if self.statisticsFilename!=None : XDAQTools.statistics.dump( self.statisticsFilename )
+		self._sessionNeedsRestart=True
+		self.killAllProcesses()
+		try :
+			self.waitUntilAllProcessesKilled()
+		except Exception as error :
+			print "SimpleGlibProgram.abortRun: "+str(error)
+
+	def _returnToHalted( self, triggerRate, numberOfEvents ) :
+		"""
+		Tries to get processes that are already running back to the state they'd be in after
+		initialise(..). Returns False if they're not in a state this can be done from.
+		"""
+		states=self.queryAllStates()
+		if "<uncontactable>" in states.values() : return False
+		for supervisor in self.supervisors :
+			if states[supervisor] not in ["Initial","Halted","Configured","Enabled","Paused"] : return False
+		runningSupervisors=[supervisor for supervisor in self.supervisors if states[supervisor] in ["Configured","Enabled","Paused"]]
+		initialSupervisors=[supervisor for supervisor in self.supervisors if states[supervisor]=="Initial"]
+		self._sendCommand( runningSupervisors, "Halt" )
+		# The streamer can be left acquiring even if the supervisors aren't, so it's checked separately
+		if states[self.streamer]!="Halted" : self.streamer.sendCommand( "halt" )
+		# Nothing can be changed until they have all stopped, otherwise the next run could start while
+		# the streamer is still writing out the last one.
+		haltingApplications=[self.streamer]
+		for supervisor in self.supervisors :
+			if supervisor not in initialSupervisors : haltingApplications.append( supervisor )
+		XDAQTools.stateWatcher.wait( haltingApplications, lambda state : state=="Halted", 5.0, "The GlibSupervisors and GlibStreamer did not return to Halted within 5 seconds." )
+		if len(initialSupervisors)==len(self.supervisors) :
+			self.initialise( triggerRate, numberOfEvents )
+			return True
+		# Any supervisor that's back at the start (e.g. its board was reset) needs initialising and
+		# everything sending to it again.
+		if len(initialSupervisors)!=0 :
+			self._sendCommand( initialSupervisors, "Initialise" )
+			self._waitForSupervisors( "Halted", 5.0, initialSupervisors )
+			for supervisor in initialSupervisors : supervisor.markParametersUnsent()
+		# Put the parameters back to the defaults, the same as initialise does. Only what has
+		# changed since the last run gets sent.
+		self.setConfigureParameters( triggerRate, numberOfEvents )
+		self.commitParameters()
+		return True
 
 	def setOutputFilename( self, filename ) :
-		self.streamer.setOutputFilename( filename )
+		"""
+		Sets the file the streamer writes to. It's sent with the other parameters by configure(), or
+		by commitParameters() to send it before then.
+		"""
+		self.streamer.stageOutputFilename( filename )
 		
 	def setAndSendI2c( self, registerNameValueTuple, chipNames=None ) :
-		self.supervisor.setI2c( registerNameValueTuple, chipNames )
-		self.supervisor.sendI2c( registerNameValueTuple.keys(), chipNames )
+		"""
+		Sets the registers on the given chips (all of them if chipNames is None) and sends them to the
+		boards, which are all sent to at the same time.
+		"""
+		supervisorsAndChipNames=self._supervisorsForChips( chipNames )
+		for supervisor, localNames in supervisorsAndChipNames : supervisor.setI2c( registerNameValueTuple, localNames )
+		XDAQTools.workerPool.map( lambda item : item[0].sendI2c( registerNameValueTuple.keys(), item[1] ), supervisorsAndChipNames )
+
+	def sendI2c( self, registerNames=None, chipNames=None, force=False ) :
+		"""
+		The same as GlibSupervisorApplication.sendI2c but for every board, all at the same time.
+		"""
+		XDAQTools.workerPool.map( lambda item : item[0].sendI2c( registerNames, item[1], force ), self._supervisorsForChips(chipNames) )
+
+	def i2cTransaction( self ) :
+		"""
+		Groups several setAndSendI2c calls into one send to each board. See the docs for
+		GlibSupervisorApplication.i2cTransaction.
+		"""
+		return contextlib.nested( *[supervisor.i2cTransaction() for supervisor in self.supervisors] )
+
+	def _i2cDirectory( self, directoryName, supervisor ) :
+		# Board 0 uses the directory itself so that files saved before there were several boards
+		# can still be loaded. The chips on the other boards have the same filenames, so each of
+		# those boards gets a subdirectory.
+		if supervisor.boardNumber==0 : return directoryName
+		return os.path.join( directoryName, "GLIB"+str(supervisor.boardNumber) )
 	
 	def saveI2c( self, directoryName ) :
-		self.supervisor.saveI2c( directoryName )
+		for supervisor in self.supervisors : supervisor.saveI2c( self._i2cDirectory(directoryName,supervisor) )
 
 	def loadI2c( self, directoryName ) :
-		self.supervisor.loadI2c( directoryName )
+		for supervisor in self.supervisors : supervisor.loadI2c( self._i2cDirectory(directoryName,supervisor) )
+
+	def commitParameters( self ) :
+		"""
+		Sends any parameters of the GlibSupervisors and GlibStreamer that have been changed since they
+		were last sent, e.g. by setOutputFilename. At most one post is made to each, all at the same time.
+		"""
+		XDAQTools.workerPool.map( lambda application : application.commitParameters(), self.supervisors+[self.streamer] )
 
 	def configure( self, timeout=5.0 ) :
-		self.supervisor.sendCommand( "Configure" )
+		self.commitParameters()
+		self._sendCommand( self.supervisors, "Configure" )
 		self.streamer.sendCommand( "configure" )
 		
-		if timeout>0 : self.supervisor.waitForState( "Configured", timeout )
+		if timeout>0 : self._waitForSupervisors( "Configured", timeout )
 		# Configuring the GlibSupervisor resets all I2C registers, so reset whatever
-		# my settings are.
-		self.supervisor.sendI2c()
+		# my settings are. Everything has to be sent, not just what has changed.
+		self.sendI2c( force=True )
 
 	def stop( self, timeout=5.0 ) :
 		self.streamer.sendCommand( "stop" )
-		self.supervisor.sendCommand( "Stop" )
+		self._sendCommand( self.supervisors, "Stop" )
 
-		if timeout>0 : self.supervisor.waitForState( "Configured", timeout )
+		if timeout>0 : self._waitForSupervisors( "Configured", timeout )
 
 	def enable( self, timeout=5.0 ) :
-		self.supervisor.sendCommand( "Enable" )
+		self._sendCommand( self.supervisors, "Enable" )
 		self.streamer.sendCommand( "start" )
 
-		if timeout>0 : self.supervisor.waitForState( "Enabled", timeout )
+		if timeout>0 : self._waitForSupervisors( "Enabled", timeout )
 
 	def halt( self, timeout=5.0 ) :
-		self.supervisor.sendCommand( "Halt" )
+		self._sendCommand( self.supervisors, "Halt" )
 		self.streamer.sendCommand( "halt" )
 
-		if timeout>0 : self.supervisor.waitForState( "Halted", timeout )
+		if timeout>0 : self._waitForSupervisors( "Halted", timeout )
 
 	def pause( self, timeout=5.0 ) :
 		self.streamer.sendCommand( "stop" )
@@ -130,3 +329,98 @@ class SimpleGlibProgram( XDAQTools.Program ) :
 	def play( self, timeout=5.0 ) :
 		self.streamer.sendCommand( "start" )
 		
+
+class AsyncSimpleGlibProgram( AsyncXDAQTools.AsyncProgram ) :
+	"""
+	Coroutine versions of the SimpleGlibProgram state transitions, so that the supervisor and streamer
+	are told at the same time, and several programs (e.g. one per board) can go through their
+	transitions together under one AsyncXDAQTools.EventLoop. E.g.
+	@code
+		programs=[AsyncSimpleGlibProgram(program) for program in [program1,program2]]
+		AsyncXDAQTools.EventLoop().run( AsyncXDAQTools.gather( *[program.configure() for program in programs] ) )
+	@endcode
+	Sending the parameters and the I2C registers as part of initialise and configure is done with
+	coroutines as well, but anything else to do with I2C is done with the SimpleGlibProgram as usual.
+	"""
+	def __init__( self, program ) :
+		super(AsyncSimpleGlibProgram,self).__init__( program )
+		self.supervisors=[self.asyncApplication(supervisor) for supervisor in program.supervisors]
+		self.supervisor=self.asyncApplication( program.supervisor )
+		self.streamer=self.asyncApplication( program.streamer )
+
+	def _sendCommand( self, applications, command ) :
+		yield AsyncXDAQTools.gather( *[application.sendCommand(command) for application in applications] )
+
+	def _waitForSupervisors( self, state, timeout ) :
+		yield AsyncXDAQTools.gather( *[supervisor.waitForState(state,timeout) for supervisor in self.supervisors] )
+
+	def initialise( self, triggerRate=None, numberOfEvents=100, timeout=5.0 ) :
+		yield self._sendCommand( self.supervisors, "Initialise" )
+		if timeout>0 : yield self._waitForSupervisors( "Halted", timeout )
+		# See SimpleGlibProgram.initialise
+		for supervisor in self.program.supervisors : supervisor.markParametersUnsent()
+		self.program.streamer.markParametersUnsent()
+		self.program.setConfigureParameters( triggerRate, numberOfEvents )
+		yield self.commitParameters()
+
+	def commitParameters( self ) :
+		"""
+		Coroutine version of SimpleGlibProgram.commitParameters, posting to the supervisors and streamer
+		at the same time.
+		"""
+		yield AsyncXDAQTools.gather( *[self._commitParameters(application) for application in self.supervisors+[self.streamer]] )
+
+	def _commitParameters( self, asyncApplication ) :
+		application=asyncApplication.application
+		parameters=application.parametersToCommit()
+		if parameters==None : return
+		response=yield asyncApplication.httpRequest( "POST", application.saveParametersResource, parameters )
+		if response.status!=200 : raise Exception( application.className+".commitParameters got the response "+str(response.status)+" - "+response.reason )
+		application.markParametersCommitted()
+
+	def sendI2c( self, registerNames=None, chipNames=None, force=False ) :
+		"""
+		Coroutine version of SimpleGlibProgram.sendI2c, sending to all the boards at the same time. The
+		files are written straight away, only the posts to the GlibSupervisors are waited for.
+		"""
+		yield AsyncXDAQTools.gather( *[self._sendI2c(self.asyncApplication(supervisor),registerNames,localNames,force) for supervisor, localNames in self.program._supervisorsForChips(chipNames)] )
+
+	def _sendI2c( self, asyncSupervisor, registerNames, chipNames, force ) :
+		supervisor=asyncSupervisor.application
+		# Held across the yields so that a resend from I2C verification can't get in between
+		supervisor._i2cLock.acquire()
+		try :
+			registersToSend=supervisor._prepareI2cSend( registerNames, chipNames, force )
+			if len(registersToSend)==0 : return
+			# These have to go one after the other, the first tells the supervisor where the files are
+			for resource, parameters, stage in supervisor._i2cFileRequests( supervisor.tempDirectory ) :
+				response=yield asyncSupervisor.httpRequest( "POST", resource, parameters )
+				if response.status!=200 : raise Exception( "GlibSupervisor.sendI2cFile during "+stage+" got the response "+str(response.status)+" - "+response.reason )
+			supervisor._markI2cSent( registersToSend )
+		finally :
+			supervisor._i2cLock.release()
+
+	def configure( self, timeout=5.0 ) :
+		yield self.commitParameters()
+		yield AsyncXDAQTools.gather( self._sendCommand(self.supervisors,"Configure"), self.streamer.sendCommand("configure") )
+		if timeout>0 : yield self._waitForSupervisors( "Configured", timeout )
+		# Configuring the GlibSupervisor resets all I2C registers, see SimpleGlibProgram.configure
+		yield self.sendI2c( force=True )
+
+	def stop( self, timeout=5.0 ) :
+		yield AsyncXDAQTools.gather( self.streamer.sendCommand("stop"), self._sendCommand(self.supervisors,"Stop") )
+		if timeout>0 : yield self._waitForSupervisors( "Configured", timeout )
+
+	def enable( self, timeout=5.0 ) :
+		yield AsyncXDAQTools.gather( self._sendCommand(self.supervisors,"Enable"), self.streamer.sendCommand("start") )
+		if timeout>0 : yield self._waitForSupervisors( "Enabled", timeout )
+
+	def halt( self, timeout=5.0 ) :
+		yield AsyncXDAQTools.gather( self._sendCommand(self.supervisors,"Halt"), self.streamer.sendCommand("halt") )
+		if timeout>0 : yield self._waitForSupervisors( "Halted", timeout )
+
+	def pause( self, timeout=5.0 ) :
+		yield self.streamer.sendCommand( "stop" )
+
+	def play( self, timeout=5.0 ) :
+		yield self.streamer.sendCommand( "start" )
@@ -0,0 +1,633 @@
+"""
+@brief Stand-in for the xdaq daemon, the XDAQ processes and the GLIB, so that the run control can be
+run (and timed) without any hardware.
+
+Only the parts of the http and SOAP interfaces that XDAQTools, GlibSupervisorApplication and
+GlibStreamerApplication use are simulated:
+	- the jobcontrol application (lid=10) on the daemon port: startXdaqExe, killExec, getJobStatus and
+	  the job table on its main page;
+	- the executive (lid=0) of each started process, which answers ParameterQuery with its pid;
+	- GlibSupervisor: the Initialise/Configure/Enable/Stop/Halt state machine, ParameterQuery, the FMC
+	  status on the main page, saveParameters, i2cRead and i2cWriteFileValues;
+	- GlibStreamer: configure/start/stop/halt, validParam and the status page. While acquiring it writes
+	  168 byte events to the destination file at the trigger rate set on the supervisor, until nbAcq
+	  events have been written.
+Any other application in the config (e.g. ParamViewer) answers ParameterQuery and serves an empty page.
+
+Processes are started from the config file sent in the startXdaqExe message, the same as for the real
+daemon, so the normal config (e.g. GlibSuper.xml) can be used unchanged. Latency can be added to every
+request, to process start up and to state transitions to see how the run control copes with a slow
+system.
+
+Run as a script (from the runcontrol directory, "-h" lists the options):
+@code
+	python pythonlib/XDAQSimulator.py --latency 0.002 --start-delay 1.0
+@endcode
+or start one in the same process:
+@code
+	simulator=XDAQSimulator( latency=0.002 )
+	simulator.start()
+	...
+	simulator.stop()
+@endcode
+
+@author Mark Grimes (mark.grimes@bristol.ac.uk)
+"""
+import BaseHTTPServer, SocketServer, socket, threading, time, os, re, random, struct, urllib, urlparse
+import xml.etree.ElementTree as ElementTree
+from XDAQTools import soapEnvelope
+
+## The size of the events the GLIB writes to the dump file
+EVENT_SIZE=168
+
+def _localName( tag ) :
+	return tag.split("}")[-1]
+
+def _soapFault( message ) :
+	return soapEnvelope( '<SOAP-ENV:Fault><faultcode>Server</faultcode><faultstring>'+message+'</faultstring></SOAP-ENV:Fault>' )
+
+def _xmlEscape( text ) :
+	return text.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
+
+class _Server( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ) :
+	"""
+	http server that passes every request on to owner.handle, and keeps track of the open
+	connections so that they can all be dropped when a simulated process is killed.
+	"""
+	daemon_threads=True
+	allow_reuse_address=True
+	request_queue_size=64
+
+	def __init__( self, port, owner, simulator ) :
+		BaseHTTPServer.HTTPServer.__init__( self, ("",int(port)), _RequestHandler )
+		self.owner=owner
+		self.simulator=simulator
+		self.closed=False
+		self._connections=[]
+		self._connectionsLock=threading.Lock()
+
+	def process_request( self, request, clientAddress ) :
+		self._connectionsLock.acquire()
+		try :
+			self._connections.append( request )
+		finally :
+			self._connectionsLock.release()
+		SocketServer.ThreadingMixIn.process_request( self, request, clientAddress )
+
+	def close_request( self, request ) :
+		self._connectionsLock.acquire()
+		try :
+			if request in self._connections : self._connections.remove( request )
+		finally :
+			self._connectionsLock.release()
+		BaseHTTPServer.HTTPServer.close_request( self, request )
+
+	def serveInBackground( self ) :
+		thread=threading.Thread( target=self.serve_forever, kwargs={"poll_interval":0.05} )
+		thread.daemon=True
+		thread.start()
+
+	def close( self ) :
+		"""
+		Stops listening and drops every open connection, like a process that has died.
+		"""
+		self.closed=True
+		self.shutdown()
+		self.server_close()
+		self._connectionsLock.acquire()
+		try :
+			connections=list(self._connections)
+		finally :
+			self._connectionsLock.release()
+		for connection in connections :
+			try :
+				connection.shutdown( socket.SHUT_RDWR )
+			except socket.error :
+				pass
+
+class _RequestHandler( BaseHTTPServer.BaseHTTPRequestHandler ) :
+	# Keep connections open, since that's what XDAQTools.connectionPool expects
+	protocol_version="HTTP/1.1"
+
+	def setup( self ) :
+		BaseHTTPServer.BaseHTTPRequestHandler.setup( self )
+		# The headers are written one at a time, which with Nagle's algorithm and delayed acks adds
+		# tens of milliseconds to every response.
+		self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+	def log_message( self, format, *args ) :
+		pass
+
+	def do_GET( self ) :
+		self._handle( "GET", "" )
+
+	def do_POST( self ) :
+		length=int( self.headers.getheader("Content-Length","0") )
+		self._handle( "POST", self.rfile.read(length) )
+
+	def _handle( self, method, body ) :
+		if self.server.closed :
+			self.close_connection=1
+			return
+		self.server.simulator.delay()
+		try :
+			status, content = self.server.owner.handle( method, urllib.unquote(self.path), self.headers.getheader("SOAPAction"), body )
+		except Exception as error :
+			status, content = 500, _soapFault( _xmlEscape(str(error)) )
+		self.send_response( status )
+		if content.startswith("<?xml") : self.send_header( "Content-Type", "text/xml" )
+		else : self.send_header( "Content-Type", "text/html" )
+		self.send_header( "Content-Length", str(len(content)) )
+		self.end_headers()
+		self.wfile.write( content )
+
+def _parseSoap( body ) :
+	"""
+	Returns the command name and the element for the first thing in the SOAP body.
+	"""
+	for child in ElementTree.fromstring( body ).getchildren() :
+		if _localName(child.tag)=="Body" :
+			command=child.getchildren()[0]
+			return _localName(command.tag), command
+	raise Exception( "No SOAP body" )
+
+_resourceExpression=re.compile( r"^/urn:xdaq-application:lid=(\d+)/?(.*)$" )
+_actionExpression=re.compile( r"urn:xdaq-application:(?:lid=(\d+)|class=([^,]+),instance=(\d+))" )
+
+class _JobControl(object) :
+	"""
+	The xdaq daemon, which starts and kills the processes.
+	"""
+	def __init__( self, simulator ) :
+		self.simulator=simulator
+		self.jobs={} # jid (as a string) to _Process
+		self._nextJobID=1
+		self._lock=threading.Lock()
+
+	def handle( self, method, path, action, body ) :
+		if method=="GET" :
+			match=_resourceExpression.match( path )
+			if match==None or match.group(1)!="10" : return 404, "<html><body>Not found</body></html>"
+			return 200, self.page()
+		command, element = _parseSoap( body )
+		if command=="startXdaqExe" : return 200, self.startXdaqExe( element )
+		elif command=="killExec" : return self.killExec( element.get("jid") )
+		elif command=="getJobStatus" : return self.getJobStatus( element.get("jid") )
+		return 500, _soapFault( "jobcontrol doesn't know the command "+command )
+
+	def page( self ) :
+		lines=['<html><body><table>','<tr><th>jid</th><th>user</th><th>pid</th><th>status</th><th>port</th></tr>']
+		self._lock.acquire()
+		try :
+			for jobID in sorted( self.jobs.keys(), key=int ) :
+				process=self.jobs[jobID]
+				cells=[jobID,process.user,process.pid,process.status(),str(process.port)]
+				lines.append( '<tr>'+"".join(['<td bgcolor="#F0F0D0">'+cell+'</td>' for cell in cells])+'</tr>' )
+		finally :
+			self._lock.release()
+		lines.append( '</table></body></html>' )
+		return "\n".join( lines )
+
+	def startXdaqExe( self, element ) :
+		port=element.get("argv").split("-p")[1].split()[0]
+		configFile=None
+		for child in element.getchildren() :
+			if _localName(child.tag)=="ConfigFile" : configFile=child.text
+		if configFile==None : raise Exception( "startXdaqExe has no ConfigFile" )
+		self._lock.acquire()
+		try :
+			jobID=str(self._nextJobID)
+			self._nextJobID+=1
+			process=_Process( self.simulator, jobID, element.get("user"), port, configFile.strip() )
+			self.jobs[jobID]=process
+		finally :
+			self._lock.release()
+		process.start()
+		return soapEnvelope( '<xdaq:jidResponse xmlns:xdaq="urn:xdaq-soap:3.0"><xdaq:jid>'+jobID+'</xdaq:jid></xdaq:jidResponse>' )
+
+	def killExec( self, jobID ) :
+		process=self.jobs.get( jobID )
+		if process==None or not process.isActive() : reply="no job killed."
+		else :
+			process.kill()
+			reply="killed by JID"
+		return 200, soapEnvelope( '<xdaq:getStateResponse xmlns:xdaq="urn:xdaq-soap:3.0"><xdaq:reply>'+reply+'</xdaq:reply></xdaq:getStateResponse>' )
+
+	def getJobStatus( self, jobID ) :
+		process=self.jobs.get( jobID )
+		if process==None : return 500, _soapFault( "No job with jid "+str(jobID) )
+		return 200, soapEnvelope( '<xdaq:getJobStatusResponse xmlns:xdaq="urn:xdaq-soap:3.0"><xdaq:jid>'+jobID+'</xdaq:jid><xdaq:pid>'+process.pid
+			+'</xdaq:pid><xdaq:status>'+process.status()+'</xdaq:status><xdaq:user>'+process.user+'</xdaq:user><xdaq:execPath>/opt/xdaq/bin/xdaq.exe</xdaq:execPath></xdaq:getJobStatusResponse>' )
+
+class _Process(object) :
+	"""
+	A started XDAQ process, i.e. one context from the config file listening on its port.
+	"""
+	def __init__( self, simulator, jobID, user, port, configFile ) :
+		self.simulator=simulator
+		self.jobID=jobID
+		self.user=user
+		self.port=int(port)
+		self.pid=str( simulator.nextPid() )
+		self.applications={} # lid to _Application
+		self.killed=False
+		self.server=None
+		self._lock=threading.Lock()
+		# Find the context for this port
+		context=None
+		for node in ElementTree.fromstring( configFile ).getchildren() :
+			if _localName(node.tag)=="Context" and node.get("url").split(":")[-1]==str(port) : context=node
+		if context==None : raise Exception( "There's no context for port "+str(port)+" in the config file" )
+		for node in context.getchildren() :
+			if _localName(node.tag)!="Application" : continue
+			className=node.get("class")
+			applicationClass=_applicationClasses.get( className, _Application )
+			application=applicationClass( self, className, node.get("instance"), node.get("id") )
+			self.applications[application.lid]=application
+
+	def status( self ) :
+		# Active jobs have status "0"
+		if self.isActive() : return "0"
+		return "1"
+
+	def isActive( self ) :
+		return not self.killed
+
+	def start( self ) :
+		if self.simulator.startDelay>0 : self.simulator.after( self.simulator.startDelay, self._listen )
+		else : self._listen()
+
+	def _listen( self ) :
+		self._lock.acquire()
+		try :
+			if self.killed : return
+			try :
+				self.server=_Server( self.port, self, self.simulator )
+			except socket.error :
+				# The port is taken, so the process dies straight away like xdaq.exe would
+				self.killed=True
+				return
+			self.server.serveInBackground()
+		finally :
+			self._lock.release()
+
+	def kill( self ) :
+		self._lock.acquire()
+		try :
+			self.killed=True
+			server=self.server
+			self.server=None
+		finally :
+			self._lock.release()
+		for application in self.applications.values() : application.kill()
+		# Closing waits for the server loop to notice, which shouldn't hold up the reply to killExec
+		if server!=None : self.simulator.after( 0, server.close )
+
+	def handle( self, method, path, action, body ) :
+		if method=="POST" and path=="/cgi-bin/query" :
+			match=_actionExpression.search( action or "" )
+			if match==None : return 500, _soapFault( "Unrecognised SOAPAction "+str(action) )
+			if match.group(1)=="0" : application=None # The executive
+			elif match.group(1)!=None : application=self.applications.get( match.group(1) )
+			else :
+				application=None
+				for candidate in self.applications.values() :
+					if candidate.className==match.group(2) and candidate.instance==match.group(3) : application=candidate
+				if application==None : return 500, _soapFault( "No application for "+action )
+			command, element = _parseSoap( body )
+			if application==None :
+				if command!="ParameterQuery" : return 500, _soapFault( "The executive doesn't know the command "+command )
+				return 200, self.parameterQuery( None )
+			if command=="ParameterQuery" : return 200, self.parameterQuery( application )
+			return application.command( command )
+		match=_resourceExpression.match( path )
+		if match==None or match.group(1) not in self.applications : return 404, "<html><body>Not found</body></html>"
+		form={}
+		if method=="POST" :
+			for key, values in urlparse.parse_qs( body, keep_blank_values=True ).items() : form[key]=values[-1]
+		return self.applications[match.group(1)].resource( match.group(2), form )
+
+	def parameterQuery( self, application ) :
+		if application==None : className, lid, instance = "Executive", "0", "0"
+		else : className, lid, instance = application.className, application.lid, application.instance
+		parts=['<xdaq:ParameterQueryResponse xmlns:xdaq="urn:xdaq-soap:3.0"><p:properties xmlns:p="urn:xdaq-application:'+className+'" xsi:type="SOAP-ENC:Struct">',
+			'<p:descriptor xsi:type="SOAP-ENC:Struct"><p:properties xsi:type="SOAP-ENC:Struct">']
+		for name, value in [("class",className),("context","http://127.0.0.1:"+str(self.port)),("id",lid),("instance",instance),("pid",self.pid)] :
+			parts.append( '<p:'+name+' xsi:type="xsd:string">'+value+'</p:'+name+'>' )
+		parts.append( '</p:properties></p:descriptor>' )
+		if application!=None :
+			for name, value in application.parameters() :
+				parts.append( '<p:'+name+' xsi:type="xsd:string">'+_xmlEscape(str(value))+'</p:'+name+'>' )
+		parts.append( '</p:properties></xdaq:ParameterQueryResponse>' )
+		return soapEnvelope( "".join(parts) )
+
+class _Application(object) :
+	"""
+	An application that doesn't do anything other than answer ParameterQuery and serve an empty
+	page. Subclasses add a state machine and http resources.
+	"""
+	# Command name to (the states it can be sent in, the state it moves to). Any state if the first is None.
+	transitions={}
+
+	def __init__( self, process, className, instance, lid ) :
+		self.process=process
+		self.simulator=process.simulator
+		self.className=className
+		self.instance=instance
+		self.lid=lid
+		self.state=None
+		self._lock=threading.Lock()
+
+	def parameters( self ) :
+		"""
+		Returns (name,value) tuples for ParameterQuery.
+		"""
+		if self.state==None : return []
+		return [("stateName",self.state)]
+
+	def command( self, command ) :
+		if command not in self.transitions : return 500, _soapFault( self.className+" doesn't know the command "+command )
+		allowedStates, newState = self.transitions[command]
+		self._lock.acquire()
+		try :
+			if allowedStates!=None and self.state not in allowedStates :
+				return 500, _soapFault( self.className+" can't "+command+" from the state "+str(self.state) )
+		finally :
+			self._lock.release()
+		# Like the real thing, the transition happens after the reply has been sent
+		if self.simulator.transitionDelay>0 : self.simulator.after( self.simulator.transitionDelay, self._transition, command, newState )
+		else : self._transition( command, newState )
+		return 200, soapEnvelope( '<xdaq:'+command+'Response xmlns:xdaq="urn:xdaq-soap:3.0"><xdaq:state xdaq:stateName="'+newState+'"/></xdaq:'+command+'Response>' )
+
+	def _transition( self, command, newState ) :
+		self._lock.acquire()
+		try :
+			self.state=newState
+		finally :
+			self._lock.release()
+
+	def resource( self, name, form ) :
+		if name=="" : return 200, "<html><body>"+self.className+"</body></html>"
+		return 404, "<html><body>Not found</body></html>"
+
+	def kill( self ) :
+		pass
+
+class _GlibSupervisor( _Application ) :
+	transitions={ "Initialise":(["Initial"],"Halted"),
+		"Configure":(["Halted","Configured"],"Configured"),
+		"Enable":(["Configured"],"Enabled"),
+		"Stop":(["Enabled","Configured"],"Configured"),
+		"Halt":(["Halted","Configured","Enabled"],"Halted") }
+
+	def __init__( self, process, className, instance, lid ) :
+		super(_GlibSupervisor,self).__init__( process, className, instance, lid )
+		self.state="Initial"
+		self.savedParameters={}
+		self.parameterPosts=0 # How many times saveParameters has been posted to
+		self.i2cDirectory=None
+		self.i2cFiles={} # chip name to the contents of the last file written to it
+		self.chipValues={} # chip name to a dictionary of register name to what the chip has
+		# Chip name to a dictionary of register name to how many more writes of it to ignore, to
+		# act like a chip that doesn't get programmed properly
+		self.ignoredWrites={}
+
+	def triggerRate( self ) :
+		"""
+		The trigger rate in Hz, from the code the run control sets (2 to the power of the code).
+		"""
+		return 2**int( self.savedParameters.get("user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ",5) )
+
+	def resource( self, name, form ) :
+		if name=="" :
+			lines=['<html><body>','<p>GlibSupervisor</p>']
+			# The FMC status only appears once the board has been initialised
+			if self.state!="Initial" :
+				for fmcNumber in [1,2] :
+					if fmcNumber in self.simulator.connectedFMCs : status="ON"
+					else : status="OFF"
+					lines.append( "<img src='/led.png' alt='"+status+"'/> FMC "+str(fmcNumber)+"<br/>" )
+			lines.append( '</body></html>' )
+			return 200, "\n".join( lines )
+		elif name=="saveParameters" :
+			self.savedParameters.update( form )
+			self.parameterPosts+=1
+			return 200, "<html><body>Parameters saved</body></html>"
+		elif name=="i2cRead" :
+			self.i2cDirectory=form.get("i2CFiles")
+			return 200, "<html><body>I2C directory set</body></html>"
+		elif name=="i2cWriteFileValues" :
+			if self.i2cDirectory==None : return 500, "<html><body>No I2C directory set</body></html>"
+			for key in form.keys() :
+				if not key.startswith("chk") : continue
+				chipName=key[3:]
+				inputFile=open( os.path.join(self.i2cDirectory,chipName+".txt") )
+				try :
+					self.i2cFiles[chipName]=inputFile.read()
+				finally :
+					inputFile.close()
+				self._writeChip( chipName, self.i2cFiles[chipName] )
+			return 200, "<html><body>I2C values written</body></html>"
+		return super(_GlibSupervisor,self).resource( name, form )
+
+	def _writeChip( self, chipName, fileContents ) :
+		values=self.chipValues.setdefault( chipName, {} )
+		ignoredWrites=self.ignoredWrites.get( chipName, {} )
+		for line in fileContents.splitlines() :
+			columns=line.split('#')[0].split('*')[0].split()
+			if len(columns)!=5 : continue
+			if ignoredWrites.get(columns[0],0)>0 :
+				ignoredWrites[columns[0]]-=1
+				continue
+			values[columns[0]]=int( columns[4], 0 )
+
+class _GlibStreamer( _Application ) :
+	# The streamer lets anything through
+	transitions={ "configure":(None,"Configured"),
+		"start":(None,"Enabled"),
+		"stop":(None,"Configured"),
+		"halt":(None,"Halted") }
+
+	def __init__( self, process, className, instance, lid ) :
+		super(_GlibStreamer,self).__init__( process, className, instance, lid )
+		self.state="Halted"
+		self.savedParameters={ "destination":"/tmp/scriptedRun.dat", "nbAcq":"100" }
+		self.parameterPosts=0 # How many times validParam has been posted to
+		self._acquisition=None
+
+	def parameters( self ) :
+		# The real streamer doesn't report its state here, which is why GlibStreamerApplication
+		# reads it from the status page.
+		return []
+
+	def _transition( self, command, newState ) :
+		if command in ["stop","halt","configure"] : self._stopAcquisition()
+		super(_GlibStreamer,self)._transition( command, newState )
+		if command=="start" :
+			self._stopAcquisition()
+			self._acquisition=_Acquisition( self.savedParameters["destination"], int(self.savedParameters["nbAcq"]), self.simulator.triggerRate() )
+			self._acquisition.start()
+
+	def _stopAcquisition( self ) :
+		acquisition=self._acquisition
+		self._acquisition=None
+		if acquisition!=None : acquisition.stop()
+
+	def kill( self ) :
+		self._stopAcquisition()
+
+	def resource( self, name, form ) :
+		if name=="" : return 200, self.statusPage()
+		elif name=="validParam" :
+			self.savedParameters.update( form )
+			self.parameterPosts+=1
+			return 200, "<html><body>Parameters saved</body></html>"
+		return super(_GlibStreamer,self).resource( name, form )
+
+	def statusPage( self ) :
+		"""
+		The page is laid out so that the state is on line 19 and line 34 shows whether data is being
+		taken, which is where GlibStreamerApplication looks for them.
+		"""
+		lines=['<html>','<head>','<title>GlibStreamer</title>','</head>','<body>']
+		while len(lines)<19 : lines.append( '<p></p>' )
+		lines.append( '<span>'+str(self.state)+'</span>' )
+		while len(lines)<34 : lines.append( '<p></p>' )
+		acquisition=self._acquisition
+		if acquisition!=None and acquisition.isRunning() :
+			lines.append( '<form action="pauseAcquisition" ><input type="submit" value="Pause"/></form>' )
+			lines.append( '<p>Acquisition number: '+str(acquisition.eventsWritten)+'</p>' )
+		else :
+			lines.append( "<table><tr><td><form action='saveHtmlValues'><input type='submit' value='Save'/></form></td></tr></table>" )
+		lines.append( '</body></html>' )
+		return "\n".join( lines )
+
+_applicationClasses={ "GlibSupervisor":_GlibSupervisor, "GlibStreamer":_GlibStreamer }
+
+class _Acquisition( threading.Thread ) :
+	"""
+	Writes synthetic events to the dump file at the trigger rate until numberOfEvents have been written
+	or it's stopped. The events are the right size with an incrementing event counter in the first word,
+	and no hits.
+	"""
+	def __init__( self, filename, numberOfEvents, triggerRate ) :
+		super(_Acquisition,self).__init__()
+		self.daemon=True
+		self.filename=filename
+		self.numberOfEvents=numberOfEvents
+		self.triggerRate=float(triggerRate)
+		self.eventsWritten=0
+		self._stopped=threading.Event()
+		self._padding="\0"*(EVENT_SIZE-4)
+
+	def isRunning( self ) :
+		return self.isAlive() and self.eventsWritten<self.numberOfEvents
+
+	def stop( self ) :
+		self._stopped.set()
+		self.join()
+
+	def run( self ) :
+		outputFile=open( self.filename, "wb" )
+		try :
+			startTime=time.time()
+			while self.eventsWritten<self.numberOfEvents and not self._stopped.isSet() :
+				eventsDue=min( self.numberOfEvents, int((time.time()-startTime)*self.triggerRate) )
+				events=[]
+				for eventNumber in range(self.eventsWritten,eventsDue) :
+					events.append( struct.pack(">I",eventNumber)+self._padding )
+				if len(events)!=0 :
+					outputFile.write( "".join(events) )
+					outputFile.flush()
+					self.eventsWritten=eventsDue
+				# Wait until the next event is due, but check regularly for being stopped
+				self._stopped.wait( min(0.05,max(0.001,(self.eventsWritten+1)/self.triggerRate-(time.time()-startTime))) )
+		finally :
+			outputFile.close()
+
+class XDAQSimulator(object) :
+	"""
+	Simulates the xdaq daemon listening on jobControlPort, and any XDAQ processes it's asked to start.
+
+	latency         - seconds added to every http request (including SOAP messages).
+	jitter          - up to this many extra seconds are added at random to every request.
+	startDelay      - seconds between a process being started and it answering requests.
+	transitionDelay - seconds between a state transition command being answered and the state changing.
+	triggerRate     - events per second the streamer writes. If None the rate set on the supervisor is used.
+	connectedFMCs   - which FMCs the supervisor reports as connected.
+	"""
+	def __init__( self, jobControlPort=9999, latency=0.0, jitter=0.0, startDelay=0.0, transitionDelay=0.0, triggerRate=None, connectedFMCs=[1,2] ) :
+		self.jobControlPort=jobControlPort
+		self.latency=latency
+		self.jitter=jitter
+		self.startDelay=startDelay
+		self.transitionDelay=transitionDelay
+		self.fixedTriggerRate=triggerRate
+		self.connectedFMCs=connectedFMCs
+		self.jobControl=_JobControl( self )
+		self._server=None
+		self._nextPid=20000
+		self._lock=threading.Lock()
+
+	def start( self ) :
+		self._server=_Server( self.jobControlPort, self.jobControl, self )
+		self._server.serveInBackground()
+
+	def stop( self ) :
+		"""
+		Kills every process that's still running and stops the daemon.
+		"""
+		for process in self.jobControl.jobs.values() :
+			if process.isActive() : process.kill()
+		if self._server!=None : self._server.close()
+		self._server=None
+
+	def delay( self ) :
+		"""
+		Adds the latency to a request. Called by the request handlers.
+		"""
+		delay=self.latency
+		if self.jitter>0 : delay+=random.uniform( 0, self.jitter )
+		if delay>0 : time.sleep( delay )
+
+	def after( self, delay, function, *arguments ) :
+		timer=threading.Timer( delay, function, arguments )
+		timer.daemon=True
+		timer.start()
+
+	def nextPid( self ) :
+		self._lock.acquire()
+		try :
+			self._nextPid+=1
+			return self._nextPid
+		finally :
+			self._lock.release()
+
+	def triggerRate( self ) :
+		if self.fixedTriggerRate!=None : return self.fixedTriggerRate
+		for process in self.jobControl.jobs.values() :
+			if not process.isActive() : continue
+			for application in process.applications.values() :
+				if isinstance( application, _GlibSupervisor ) : return application.triggerRate()
+		return 32
+
+if __name__ == '__main__':
+	from optparse import OptionParser
+	parser=OptionParser( usage="%prog [options]", description="Simulates the xdaq daemon, XDAQ processes and GLIB for the run control." )
+	parser.add_option( "-p", "--port", type="int", default=9999, help="port for the xdaq daemon (default %default)" )
+	parser.add_option( "--latency", type="float", default=0.0, help="seconds added to every request" )
+	parser.add_option( "--jitter", type="float", default=0.0, help="up to this many extra seconds added at random to every request" )
+	parser.add_option( "--start-delay", type="float", default=0.0, help="seconds before a started process answers requests" )
+	parser.add_option( "--transition-delay", type="float", default=0.0, help="seconds before a state transition takes effect" )
+	parser.add_option( "--trigger-rate", type="float", default=None, help="events per second, instead of the rate set on the supervisor" )
+	parser.add_option( "--fmcs", default="1,2", help="comma separated list of the connected FMCs (default %default)" )
+	options, arguments = parser.parse_args()
+	connectedFMCs=[int(fmc) for fmc in options.fmcs.split(",") if fmc!=""]
+
+	simulator=XDAQSimulator( options.port, options.latency, options.jitter, options.start_delay, options.transition_delay, options.trigger_rate, connectedFMCs )
+	simulator.start()
+	print "Simulating the xdaq daemon on port "+str(options.port)+". Press Ctrl-C to stop."
+	try :
+		while True : time.sleep(1)
+	except KeyboardInterrupt :
+		simulator.stop()
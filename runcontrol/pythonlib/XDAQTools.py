@@ -20,11 +20,21 @@ Program     - Basically encompasses everything. Your full XDAQ program, which ha
 """
 
 import xml.etree.ElementTree as ElementTree
+import xml.sax.saxutils as saxutils
+import xml.parsers.expat as expat
 import httplib
 import urllib
 import time
 import os
 import re
+import socket
+import select
+import threading
+import Queue
+import bisect
+import json
+import atexit
+from contextlib import contextmanager
 
 class ETElementExtension( ElementTree._ElementInterface ) :
 	"""
@@ -59,94 +69,875 @@ class ETElementExtension( ElementTree._ElementInterface ) :
 		if len(result)==0 : return None
 		else : return result[0]
 
-def sendSoapMessage( host, port, soapBody, className=None, instance=None, lid=10 ):
+class _ExtractionFinished(Exception) :
+	"""
+	Raised from inside the parser to stop it once everything asked for has been found.
+	"""
+	pass
+
+_compiledPaths={}
+
+def _compilePath( path ) :
+	compiledPath=_compiledPaths.get( path )
+	if compiledPath==None :
+		compiledPath=tuple( [name for name in path.split("/") if name!=""] )
+		if len(compiledPath)==0 : raise Exception( "Can't extract the empty path '"+path+"'" )
+		_compiledPaths[path]=compiledPath
+	return compiledPath
+
+def extractAll( response, paths ) :
+	"""
+	Returns the text of the elements at each of the paths in the xml response, in the same order as the
+	paths, or None for any that aren't there. Each path is the names of the elements starting from the
+	child of the root, separated by "/" and ignoring xml namespaces. E.g. for a SOAP response
+	@code
+	state, = extractAll( response, ["Body/ParameterQueryResponse/properties/stateName"] )
+	@endcode
+	gives the same as
+	@code
+	response=ElementTree.fromstring( response )
+	response.__class__=ETElementExtension
+	state=response.getchildnamed("Body").getchildnamed("ParameterQueryResponse").getchildnamed("properties").getchildnamed("stateName").text
+	@endcode
+	but no tree is built, and parsing stops as soon as everything has been found. As with ".text" only
+	the text before the element's first child is returned.
+	"""
+	compiledPaths=[_compilePath(path) for path in paths]
+	results=[None]*len(paths)
+	# For each path, how many of its names match the elements currently open
+	matched=[0]*len(paths)
+	state={ "depth":0, "found":0, "collecting":None, "text":[] }
+
+	def startElement( tag, attributes ) :
+		depth=state["depth"]
+		state["depth"]=depth+1
+		if state["collecting"]!=None : finishText()
+		if depth==0 : return # the root element isn't part of the path
+		# Tags come as "<namespace> <name>", or just "<name>" if there's no namespace
+		name=tag[tag.rfind(" ")+1:]
+		for index in range(0,len(compiledPaths)) :
+			compiledPath=compiledPaths[index]
+			if matched[index]==depth-1 and depth<=len(compiledPath) and compiledPath[depth-1]==name :
+				matched[index]=depth
+				if depth==len(compiledPath) :
+					state["collecting"]=index
+					state["text"]=[]
+
+	def characterData( data ) :
+		if state["collecting"]!=None : state["text"].append( data )
+
+	def finishText() :
+		index=state["collecting"]
+		state["collecting"]=None
+		if len(state["text"])==0 : results[index]=None
+		else : results[index]="".join( state["text"] )
+		matched[index]=-1 # Only take the first match, -1 never matches anything again
+		state["found"]+=1
+		if state["found"]==len(compiledPaths) : raise _ExtractionFinished()
+
+	def endElement( tag ) :
+		if state["collecting"]!=None : finishText()
+		depth=state["depth"]-1
+		state["depth"]=depth
+		# If the element just closed was matched, the path now only matches up to its parent
+		for index in range(0,len(compiledPaths)) :
+			if matched[index]>=depth and depth>0 : matched[index]=depth-1
+
+	parser=expat.ParserCreate( namespace_separator=" " )
+	parser.returns_unicode=False # Plain strings like ElementTree gives for ascii
+	parser.StartElementHandler=startElement
+	parser.EndElementHandler=endElement
+	parser.CharacterDataHandler=characterData
+	try :
+		parser.Parse( response, True )
+	except _ExtractionFinished :
+		pass
+	return results
+
+def extract( response, path ) :
+	"""
+	Returns the text of the element at the path in the xml response, or None if it isn't there. See
+	extractAll for the format of path.
+	"""
+	return extractAll( response, [path] )[0]
+
+class TransportStatistics(object) :
+	"""
+	Keeps a count of everything sent to the XDAQ processes, so that you can see where the time goes.
+	Entries are kept per (target, command), where target is usually "<className>:<instance>" of the
+	application and command is the SOAP command or http resource, e.g. ("GlibSupervisor:0","ParameterQuery")
+	or ("GlibStreamer:0","POST validParam"). For each one the number of calls, failures and retries, the
+	bytes sent and received, and a histogram of how long the calls took are kept.
+
+	As well as single requests, the higher level operations (e.g. "getState", "waitForState") are timed
+	as a whole under their own command names; the requests they make are counted separately too.
+
+	Usually there's only one, the "statistics" instance in this module, e.g.
+	@code
+		XDAQTools.statistics.reset()
+		... take a run ...
+		print XDAQTools.statistics.summary()
+		XDAQTools.statistics.dump( "/tmp/xdaqStatistics.json" )
+	@endcode
+	"""
+	## Upper edges, in seconds, of the bins of the latency histogram. The last bin is for anything slower.
+	binEdges=[0.0001*2**index for index in range(0,18)]
+
+	def __init__( self ) :
+		## Set to False to stop recording
+		self.enabled=True
+		self._entries={}
+		self._lock=threading.Lock()
+
+	def record( self, target, command, seconds, bytesSent=0, bytesReceived=0, retries=0, failed=False ) :
+		"""
+		Adds one call to the entry for (target, command).
+		"""
+		if not self.enabled : return
+		binNumber=bisect.bisect_left( self.binEdges, seconds )
+		key=(target,command)
+		self._lock.acquire()
+		try :
+			entry=self._entries.get( key )
+			if entry==None :
+				entry={ "calls":0, "failures":0, "retries":0, "bytesSent":0, "bytesReceived":0, "totalTime":0.0,
+					"minimumTime":seconds, "maximumTime":seconds, "histogram":[0]*(len(self.binEdges)+1) }
+				self._entries[key]=entry
+			entry["calls"]+=1
+			if failed : entry["failures"]+=1
+			entry["retries"]+=retries
+			entry["bytesSent"]+=bytesSent
+			entry["bytesReceived"]+=bytesReceived
+			entry["totalTime"]+=seconds
+			entry["minimumTime"]=min( entry["minimumTime"], seconds )
+			entry["maximumTime"]=max( entry["maximumTime"], seconds )
+			entry["histogram"][binNumber]+=1
+		finally :
+			self._lock.release()
+
+	@contextmanager
+	def timer( self, target, command ) :
+		"""
+		Context manager that records how long the block takes under (target, command). It's recorded as
+		a failure if the block raises an exception.
+		"""
+		startTime=time.time()
+		failed=True
+		try :
+			yield
+			failed=False
+		finally :
+			self.record( target, command, time.time()-startTime, failed=failed )
+
+	def results( self ) :
+		"""
+		Returns a list of dictionaries, one for each (target, command), with the slowest in total first.
+		As well as the counts described in the class documentation each has "target", "command" and
+		"meanTime".
+		"""
+		results=[]
+		self._lock.acquire()
+		try :
+			for (target,command), entry in self._entries.items() :
+				result=dict(entry)
+				result["histogram"]=list(entry["histogram"])
+				result["target"]=target
+				result["command"]=command
+				result["meanTime"]=entry["totalTime"]/entry["calls"]
+				results.append( result )
+		finally :
+			self._lock.release()
+		results.sort( key=lambda result : result["totalTime"], reverse=True )
+		return results
+
+	def reset( self ) :
+		self._lock.acquire()
+		try :
+			self._entries={}
+		finally :
+			self._lock.release()
+
+	def summary( self ) :
+		"""
+		Returns a table of the results as a string, suitable for printing.
+		"""
+		lines=["target".ljust(26)+"command".ljust(30)+"calls".rjust(7)+"total/s".rjust(10)+"mean/ms".rjust(10)+"max/ms".rjust(10)+"retries".rjust(8)+"kB out".rjust(9)+"kB in".rjust(9)]
+		for result in self.results() :
+			lines.append( result["target"][:25].ljust(26)+result["command"][:29].ljust(30)+str(result["calls"]).rjust(7)
+				+("%10.3f"%result["totalTime"])+("%10.2f"%(result["meanTime"]*1000))+("%10.2f"%(result["maximumTime"]*1000))
+				+str(result["retries"]).rjust(8)+("%9.1f"%(result["bytesSent"]/1024.0))+("%9.1f"%(result["bytesReceived"]/1024.0)) )
+		return "\n".join( lines )
+
+	def dump( self, filename ) :
+		"""
+		Writes the results, and the histogram bin edges, to a file as JSON.
+		"""
+		outputFile=open( filename, "w" )
+		try :
+			json.dump( { "binEdges":self.binEdges, "results":self.results() }, outputFile, indent=1 )
+		finally :
+			outputFile.close()
+
+## Everything sent through this module is recorded here
+statistics=TransportStatistics()
+
+_soapCommandExpression=re.compile( r"Body>\s*<(?:[\w-]+:)?([\w-]+)" )
+
+def soapStatisticsLabel( host, port, message, className=None, instance=None, lid=10 ) :
+	"""
+	Returns the (target, command) that a SOAP message is recorded under in statistics.
+	"""
+	match=_soapCommandExpression.search( message )
+	if match==None : command="<unknown SOAP command>"
+	else : command=match.group(1)
+	if className==None or instance==None : target="lid="+str(lid)+"@"+host+":"+str(port)
+	else : target=className+":"+str(instance)
+	return (target,command)
+
+def httpStatisticsLabel( application, requestType, resource ) :
+	"""
+	Returns the (target, command) that an http request to an application is recorded under in statistics.
+	The command is the request type and whatever comes after the application in the resource, e.g.
+	"POST saveParameters", or "GET main page" for the application's own page.
+	"""
+	parts=resource.split( "/", 2 )
+	if len(parts)<3 or parts[2]=="" : name="main page"
+	else : name=parts[2]
+	return (application.className+":"+str(application.instance),requestType+" "+name)
+
+def timedOperation( command ) :
+	"""
+	Decorator for Application methods that records how long every call takes in statistics, under
+	the application and the given command name.
+	"""
+	def decorator( method ) :
+		def timedMethod( self, *arguments, **keywordArguments ) :
+			with statistics.timer( self.className+":"+str(self.instance), command ) :
+				return method( self, *arguments, **keywordArguments )
+		timedMethod.__name__=method.__name__
+		timedMethod.__doc__=method.__doc__
+		return timedMethod
+	return decorator
+
+class HTTPConnectionPool(object) :
+	"""
+	Keeps HTTP connections open between requests so that each request doesn't have to set up and tear
+	down a TCP connection. Connections are kept per (host, port) and only one request uses a given
+	connection at a time, so this can be shared between threads.
+
+	The XDAQ processes speak HTTP/1.1 so connections are kept alive unless the server says otherwise.
+	A connection that has been sitting idle might have been closed by the other end (e.g. if the
+	XDAQ process was restarted). If it fails before the request has been completely sent the request
+	can't have been acted on, so it's tried once more on a new connection. Failing after that (e.g. no
+	reply) could mean the request was carried out, so it's only tried again if it's idempotent - most
+	SOAP commands (starting a process, Configure, writing I2C values) must not be sent twice.
+	Usually there's only one pool, the "connectionPool" instance in this module.
+	"""
+	def __init__( self, maximumIdlePerHost=4, timeout=None ) :
+		self.maximumIdlePerHost=maximumIdlePerHost
+		self.timeout=timeout
+		self._idleConnections={} # (host,port) to a list of connections not currently in use
+		self._lock=threading.Lock()
+
+	def request( self, host, port, method, url, body=None, headers={}, label=None, idempotent=None ) :
+		"""
+		Sends the request and returns the response, which has already been read. The body of the
+		response is in the member "fullMessage".
+		
+		If label is given the request is recorded in statistics, with label as the (target, command).
+		Set idempotent to True if the request does no harm when carried out twice, so that it can be
+		sent again if a reused connection fails after sending. By default only GET requests are.
+		"""
+		if idempotent==None : idempotent=(method=="GET")
+		key=(host,int(port))
+		startTime=time.time()
+		retries=0
+		try :
+			while True :
+				connection, reused = self._checkOut( key )
+				sent=False
+				try :
+					connection.request( method, url, body, headers )
+					sent=True
+					response=connection.getresponse()
+					response.fullMessage=response.read()
+				except (httplib.HTTPException, socket.error) :
+					connection.close()
+					# Only a connection that's been lying around is likely to be stale; if a new one fails
+					# there's a real problem.
+					if reused and (idempotent or not sent) :
+						retries+=1
+						continue
+					raise
+				except :
+					connection.close()
+					raise
+				if response.will_close : connection.close()
+				else : self._checkIn( key, connection )
+				if label!=None : statistics.record( label[0], label[1], time.time()-startTime, len(body or ""), len(response.fullMessage), retries, response.status!=200 )
+				return response
+		except :
+			if label!=None : statistics.record( label[0], label[1], time.time()-startTime, len(body or ""), 0, retries, True )
+			raise
+
+	def close( self, host=None, port=None ) :
+		"""
+		Closes the idle connections to the given host and port, or all of them if neither is given.
+		"""
+		self._lock.acquire()
+		try :
+			for key in self._idleConnections.keys() :
+				if (host==None or key[0]==host) and (port==None or key[1]==int(port)) :
+					for connection in self._idleConnections.pop( key ) : connection.close()
+		finally :
+			self._lock.release()
+
+	def _checkOut( self, key ) :
+		while True :
+			self._lock.acquire()
+			try :
+				idleConnections=self._idleConnections.get( key )
+				if not idleConnections : break
+				connection=idleConnections.pop()
+			finally :
+				self._lock.release()
+			if not self._isDropped( connection ) : return (connection,True)
+			connection.close()
+		return (httplib.HTTPConnection( key[0], key[1], timeout=self.timeout ),False)
+
+	def _isDropped( self, connection ) :
+		"""
+		Returns True if the other end has closed an idle connection. Nothing should arrive on an idle
+		connection, so if there's anything to read it's the end of the stream (or something has gone
+		wrong); either way it's no use. Checking first means a request isn't sent down a dead connection
+		and then left not knowing if it was acted on.
+		"""
+		if connection.sock==None : return True
+		try :
+			return len( select.select([connection.sock],[],[],0)[0] )!=0
+		except (select.error, socket.error, ValueError) :
+			return True
+
+	def _checkIn( self, key, connection ) :
+		self._lock.acquire()
+		try :
+			idleConnections=self._idleConnections.setdefault( key, [] )
+			if len(idleConnections)<self.maximumIdlePerHost :
+				idleConnections.append( connection )
+				return
+		finally :
+			self._lock.release()
+		connection.close()
+
+## The pool used for all communication with the XDAQ processes
+connectionPool=HTTPConnectionPool()
+
+## The port the xdaq daemon (the job control that starts and kills processes) listens on
+jobControlPort=9999
+
+## Set to True to check that every SOAP message is well formed XML before it's sent. Useful for
+## debugging, but it means parsing every message so it's off by default.
+validateSoapMessages=False
+
+# Everything in a SOAP message apart from the body. These never change, so there's no point building
+# them up for every message.
+_SOAP_ENVELOPE_START='<?xml version="1.0" encoding="UTF-8"?>\n<SOAP-ENV:Envelope SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/"><SOAP-ENV:Header></SOAP-ENV:Header><SOAP-ENV:Body>'
+_SOAP_ENVELOPE_END='</SOAP-ENV:Body></SOAP-ENV:Envelope>'
+
+class SoapTemplate(object) :
+	"""
+	A complete SOAP message for an XDAQ command, rendered once, with only the values of the command's
+	attributes left to fill in. E.g.
+	@code
+	template=SoapTemplate( "getJobStatus", ["jid"] )
+	message=template.render( {"jid":"123"} )
+	@endcode
+	Attribute values are escaped for XML when they are filled in.
+	"""
+	def __init__( self, command, attributeNames=[] ) :
+		self.command=command
+		self.attributeNames=list(attributeNames)
+		body='<xdaq:'+command
+		for name in self.attributeNames : body+=' '+name+'="%('+name+')s"'
+		body+=' xmlns:xdaq="urn:xdaq-soap:3.0"/>'
+		if len(self.attributeNames)==0 : self._message=_SOAP_ENVELOPE_START+body+_SOAP_ENVELOPE_END
+		else : self._message=_SOAP_ENVELOPE_START.replace('%','%%')+body+_SOAP_ENVELOPE_END.replace('%','%%')
+
+	def render( self, attributes={} ) :
+		if len(self.attributeNames)==0 : return self._message
+		escapedAttributes={}
+		for name in self.attributeNames :
+			escapedAttributes[name]=saxutils.escape( str(attributes[name]), {'"':"&quot;"} )
+		return self._message%escapedAttributes
+
+_soapTemplates={}
+_soapTemplatesLock=threading.Lock()
+
+def soapCommandMessage( command, **attributes ) :
+	"""
+	Returns the complete SOAP message for the XDAQ command with the given attributes, e.g.
+	soapCommandMessage( "killExec", user="xtaldaq", jid="12" ). Templates are kept for every
+	combination of command and attribute names asked for, so the message is only ever built once.
+	"""
+	key=(command,tuple(sorted(attributes.keys())))
+	template=_soapTemplates.get( key )
+	if template==None :
+		_soapTemplatesLock.acquire()
+		try :
+			template=_soapTemplates.setdefault( key, SoapTemplate(command,key[1]) )
+		finally :
+			_soapTemplatesLock.release()
+	return template.render( attributes )
+
+def soapEnvelope( soapBody ) :
+	"""
+	Wraps the body in a SOAP envelope and returns the complete message.
+	"""
+	return _SOAP_ENVELOPE_START+soapBody+_SOAP_ENVELOPE_END
+
+_soapHeaders={}
+
+def sendSoapMessage( host, port, soapBody, className=None, instance=None, lid=10, idempotent=False ):
 	"""
 	Sends a soap message with the body provided to the host and port provided.
-	No checking is provided that the soapBody provided is valid.
+	No checking is provided that the soapBody provided is valid, unless validateSoapMessages
+	is True.
 	
 	If a className and instance are provided they are sent in the SOAPAction header. If either one is "None"
-	then the lid is used (default is 10). If port is "None" then it defaults to 9999. This is because the
-	runcontrol application has lid (local ID) of 10 in the root XDAQ daemon that listens on port 9999. 
+	then the lid is used (default is 10). If port is "None" then it defaults to jobControlPort (9999). This
+	is because the runcontrol application has lid (local ID) of 10 in the root XDAQ daemon that listens there.
+	
+	Set idempotent to True for messages that only ask for information (e.g. ParameterQuery), so that
+	they can be sent again if the connection fails. See HTTPConnectionPool.
 
 	Author Mark Grimes (mark.grimes@bristol.ac.uk) but heavily copied from a file called xdglib.py
 	Date 16/Sep/2013
 	"""
-	message = """<?xml version="1.0" encoding="UTF-8"?>
-	<SOAP-ENV:Envelope
-	 SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"
-	 xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"
-	 xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-	 xmlns:xsd="http://www.w3.org/2001/XMLSchema"
-	 xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/">
-	<SOAP-ENV:Header>
-	</SOAP-ENV:Header>
-	<SOAP-ENV:Body>"""
-	message += soapBody
-	message += """</SOAP-ENV:Body>
-	</SOAP-ENV:Envelope>"""
-	
-	if className==None or instance==None:	
-		headers = {"Content-Type":"text/xml", "charset":"utf-8","Content-Description":"SOAP Message", "SOAPAction":"urn:xdaq-application:lid="+str(lid)}
-	else:
-		headers = {"Content-Type":"text/xml", "charset":"utf-8","Content-Description":"SOAP Message", "SOAPAction":"urn:xdaq-application:class="+className+",instance="+str(instance)}
+	return sendSoapEnvelope( host, port, soapEnvelope(soapBody), className, instance, lid, idempotent )
+
+def soapHeaders( className=None, instance=None, lid=10 ) :
+	"""
+	Returns the http headers for a SOAP message to the application with the given className and
+	instance, or the lid if either of those is None. See sendSoapMessage.
+	"""
+	if className==None or instance==None: action="urn:xdaq-application:lid="+str(lid)
+	else: action="urn:xdaq-application:class="+className+",instance="+str(instance)
+	headers=_soapHeaders.get( action )
+	if headers==None :
+		headers = {"Content-Type":"text/xml", "charset":"utf-8","Content-Description":"SOAP Message", "SOAPAction":action}
+		_soapHeaders[action]=headers
+	return headers
+
+def sendSoapEnvelope( host, port, message, className=None, instance=None, lid=10, idempotent=False ):
+	"""
+	The same as sendSoapMessage, but for a message that is already complete, e.g. from
+	soapCommandMessage.
+	"""
+	if validateSoapMessages :
+		try :
+			ElementTree.XML( message )
+		except Exception as error :
+			raise Exception( "Invalid SOAP message ("+str(error)+"): "+message )
 
-	if port==None : port=9999 # The port that the xdaq daemon listens on
-	listeningUrl=host+":"+str(port)
+	if port==None : port=jobControlPort
 
-	connection = httplib.HTTPConnection( listeningUrl )
-	connection.request("POST", urllib.quote("/cgi-bin/query"), ElementTree.tostring( ElementTree.XML(message) ), headers )
-	response = connection.getresponse()
+	response = connectionPool.request( host, port, "POST", "/cgi-bin/query", message, soapHeaders(className,instance,lid), soapStatisticsLabel(host,port,message,className,instance,lid), idempotent )
 	if (response.status != 200):
-		connection.close()
 		raise Exception( "Unable to send soap message because: "+str(response.status)+" - "+response.reason )
-	data = response.read()
-	connection.close()
-	return data
+	return response.fullMessage
+
+## How long, in seconds, the result of getActiveJobIDs is reused for
+activeJobIDsCacheTime=2.0
+_activeJobIDsCache={} # (host,port) to (time,result)
+_activeJobIDsCacheLock=threading.Lock()
 
-def getActiveJobIDs( host="127.0.0.1", port=9999 ) :
+def getActiveJobIDs( host="127.0.0.1", port=None, maximumAge=None ) :
 	"""
 	Returns a list of the job IDs for all active XDAQ processes. This is given as array of
 	tuples that list the job ID and the pid for each process. These are in the tuple as "jid"
 	and "pid" respectively.
+	
+	The result is kept and returned again for anything asking within maximumAge seconds (by default
+	activeJobIDsCacheTime), so that reattaching lots of contexts only asks once. It's forgotten
+	whenever a process is started or killed through this module. The port is that of the xdaq daemon,
+	jobControlPort by default.
 	"""
+	if port==None : port=jobControlPort
+	if maximumAge==None : maximumAge=activeJobIDsCacheTime
+	key=(host,int(port))
+	_activeJobIDsCacheLock.acquire()
+	try :
+		cacheEntry=_activeJobIDsCache.get( key )
+	finally :
+		_activeJobIDsCacheLock.release()
+	if cacheEntry!=None and time.time()-cacheEntry[0]<=maximumAge : return list(cacheEntry[1])
+
 	# I can't find a SOAP request anywhere that will tell me the job ID for a given context.
 	# The only place I've been able to find this information is in the jobcontrol webpage.
 	# I'll have to request that page and filter out the information I want.
-	listeningUrl=host+":"+str(port)
-	connection = httplib.HTTPConnection( listeningUrl )
-	connection.request("GET", "/urn:xdaq-application:lid=10/", {}, {} )
-	response = connection.getresponse()
+	response = connectionPool.request( host, port, "GET", "/urn:xdaq-application:lid=10/", label=("lid=10@"+host+":"+str(port),"GET job table") )
 	if (response.status != 200):
-		connection.close()
 		raise Exception( "Unable to send soap message because: "+str(response.status)+" - "+response.reason )
-	data = response.read()
+	data = response.fullMessage
 	# I now have the full HTML for the jobcontrol default webpage. The job IDs are buried inside a table
 	# somewhere inside this. I'll do a regular expression search for the format of the table cell. This
 	# command will return any cell contents that immediately follows the HTML '<td bgcolor="#F0F0D0">'.
 	potentialJobIDs=re.findall('(?<=\<td bgcolor="#F0F0D0"\>)\w+',data)
 	# I now have a list of entries in the job status table. Some of these will be job IDs and some will be
-	# other data (e.g. user, status). This list always seems to have the data in the same place, but to be
-	# safe I'll just query the job status for each entry. When it's not a job ID I'll just get an error
-	# message. Besides, I don't know which job IDs are for still active jobs. This information will be in
-	# the response to the getJobStatus message.
-	activeJobIDs = []
+	# other data (e.g. user, status). Job IDs are always numbers, so anything else can be thrown away
+	# straight away, as can repeats. The rest could still be other numbers from the table so I'll query
+	# the job status for each one. When it's not a job ID I'll just get an error message. Besides, I
+	# don't know which job IDs are for still active jobs. This information will be in the response to
+	# the getJobStatus message.
+	candidateJobIDs=[]
 	for jobID in potentialJobIDs :
+		if jobID.isdigit() and jobID not in candidateJobIDs : candidateJobIDs.append( jobID )
+	def queryJob( jobID ) :
 		# Ask for information about the job. If it isn't actually a job ID an exception will be thrown
 		# which I'll catch and ignore.
-		response=ElementTree.fromstring( sendSoapMessage( host, str(port), '<xdaq:getJobStatus jid="'+jobID+'" xmlns:xdaq="urn:xdaq-soap:3.0" />', lid=10 ) )
 		try:
-			response.__class__=ETElementExtension
-			status=response.getchildnamed("Body").getchildnamed("getJobStatusResponse").getchildnamed("status").text
-			pid=response.getchildnamed("Body").getchildnamed("getJobStatusResponse").getchildnamed("pid").text
+			response=sendSoapEnvelope( host, str(port), soapCommandMessage("getJobStatus",jid=jobID), lid=10, idempotent=True )
+			status, pid = extractAll( response, ["Body/getJobStatusResponse/status","Body/getJobStatusResponse/pid"] )
 			# Active jobs seem to be given the status "0"
-			if status=="0" : activeJobIDs.append( { "jid":jobID, "pid":pid } )
+			if status=="0" : return { "jid":jobID, "pid":pid }
 		except:
 			pass
-	return activeJobIDs
+		return None
+	activeJobIDs = [job for job in _parallelMap( queryJob, candidateJobIDs ) if job!=None]
+
+	_activeJobIDsCacheLock.acquire()
+	try :
+		_activeJobIDsCache[key]=(time.time(),activeJobIDs)
+	finally :
+		_activeJobIDsCacheLock.release()
+	return list(activeJobIDs)
+
+def forgetActiveJobIDs( host=None ) :
+	"""
+	Makes the next call to getActiveJobIDs for the host (or all hosts if host is None) ask again.
+	"""
+	_activeJobIDsCacheLock.acquire()
+	try :
+		for key in _activeJobIDsCache.keys() :
+			if host==None or key[0]==host : del _activeJobIDsCache[key]
+	finally :
+		_activeJobIDsCacheLock.release()
+
+class _Batch(object) :
+	"""
+	One call to WorkerPool.map. Each item is run by whichever thread claims it first.
+	"""
+	def __init__( self, function, items ) :
+		self.function=function
+		self.items=items
+		self.results=[None]*len(items)
+		self.errors=[]
+		self._claimed=[False]*len(items)
+		self._remaining=len(items)
+		self._condition=threading.Condition()
+
+	def run( self, index ) :
+		self._condition.acquire()
+		try :
+			if self._claimed[index] : return
+			self._claimed[index]=True
+		finally :
+			self._condition.release()
+		try :
+			self.results[index]=self.function( self.items[index] )
+		except Exception as error :
+			self.errors.append( error )
+		self._condition.acquire()
+		try :
+			self._remaining-=1
+			if self._remaining==0 : self._condition.notifyAll()
+		finally :
+			self._condition.release()
+
+	def wait( self ) :
+		self._condition.acquire()
+		try :
+			while self._remaining!=0 : self._condition.wait()
+		finally :
+			self._condition.release()
+
+class WorkerPool(object) :
+	"""
+	A fixed number of long lived threads that calls can be spread over, for anything that spends its
+	time waiting for a reply over the network. The threads are only started the first time they're
+	needed, and are daemons so they don't stop the program exiting.
+	
+	The thread calling map works through the items as well, so a call made from inside one of the
+	workers (e.g. a context start that waits for states) always finishes even if every worker is busy.
+	Usually there's only one pool, the "workerPool" instance in this module.
+	"""
+	def __init__( self, numberOfThreads=16 ) :
+		self.numberOfThreads=numberOfThreads
+		self._queue=Queue.Queue()
+		self._threads=[]
+		self._lock=threading.Lock()
+
+	def map( self, function, items ) :
+		"""
+		Returns [function(item) for item in items], but with the calls spread over the pool. If any
+		of the calls raise an exception the first one is raised once all the calls have finished.
+		"""
+		items=list(items)
+		if len(items)<2 or self.numberOfThreads<1 : return [function(item) for item in items]
+		self._startThreads()
+		batch=_Batch( function, items )
+		for index in range(1,len(items)) : self._queue.put( (batch,index) )
+		for index in range(0,len(items)) : batch.run( index )
+		batch.wait()
+		if len(batch.errors)!=0 : raise batch.errors[0]
+		return batch.results
+
+	def _startThreads( self ) :
+		self._lock.acquire()
+		try :
+			while len(self._threads)<self.numberOfThreads :
+				thread=threading.Thread( target=self._work )
+				thread.daemon=True
+				thread.start()
+				self._threads.append( thread )
+		finally :
+			self._lock.release()
+
+	def stop( self, timeout=1.0 ) :
+		"""
+		Tells the threads to finish once they've done what they're working on, and waits up to timeout
+		seconds for them. Called when the interpreter exits, since python 2 daemon threads that are
+		still waiting then print errors as the modules are torn down. The pool can still be used
+		afterwards, new threads are started.
+		"""
+		self._lock.acquire()
+		try :
+			threads=self._threads
+			self._threads=[]
+		finally :
+			self._lock.release()
+		for thread in threads : self._queue.put( None )
+		endTime=time.time()+timeout
+		for thread in threads : thread.join( max(0.0,endTime-time.time()) )
+
+	def _work( self ) :
+		while True :
+			task=self._queue.get()
+			if task==None : return
+			batch, index = task
+			batch.run( index )
+
+## The threads used for everything this module does in parallel
+workerPool=WorkerPool()
+atexit.register( workerPool.stop )
+
+def _parallelMap( function, items, maximumThreads=16 ) :
+	"""
+	Returns [function(item) for item in items], but with the calls spread over workerPool. Useful for
+	anything that spends its time waiting for a reply over the network. If maximumThreads is less than
+	2 the calls are made one after the other in this thread.
+	"""
+	if maximumThreads<2 : return [function(item) for item in items]
+	return workerPool.map( function, items )
 
+def queryStates( applications, maximumThreads=16 ) :
+	"""
+	Asks all of the applications for their state at the same time, and returns a dictionary of
+	application to state. Applications that can't be contacted have the state "<uncontactable>"
+	as with Application.getState.
+	"""
+	applications=list(applications)
+	return dict( zip( applications, _parallelMap( lambda application : application.getState(), applications, maximumThreads ) ) )
+
+class StateWatcher(object) :
+	"""
+	Waits for applications to reach a state. However many threads are waiting, and for however many
+	applications, there is only one thread polling; each time it asks every application that someone
+	is waiting on at the same time (with queryStates) and wakes up each waiter as soon as all of its
+	applications are in the state it wants.
 	
+	Polls start "initialInterval" seconds apart. Every poll where nothing changed the interval is
+	multiplied by "backoff" up to "maximumInterval", and whenever anything does change or someone new
+	starts waiting it goes back to the start. So state transitions are noticed within a few
+	milliseconds, but nothing is hammered if it's taking a while.
+	
+	By default the "state" is what Application.getState returns, but anything can be polled by giving
+	a different probe, which is called as probe( application ).
+	"""
+	def __init__( self, initialInterval=0.005, maximumInterval=0.2, backoff=2.0, probe=None ) :
+		self.initialInterval=initialInterval
+		self.maximumInterval=maximumInterval
+		self.backoff=backoff
+		if probe==None : probe=lambda application : application.getState()
+		self.probe=probe
+		self._condition=threading.Condition()
+		self._waiters=[]
+		self._pollingThread=None
+		self._newWaiter=False
+
+	def wait( self, applications, isReady, timeout, errorMessage=None ) :
+		"""
+		Blocks until isReady( state ) is True for all of the applications, and returns a dictionary of
+		application to state. Throws an exception with errorMessage if this hasn't happened within
+		"timeout" seconds. The applications are always asked at least once, so a timeout of zero just
+		checks whether they're ready now. If asking them raises an exception, that is raised here.
+		"""
+		applications=list(applications)
+		if len(applications)==0 : return {}
+		if errorMessage==None : errorMessage="Applications "+str(applications)+" did not reach the required state within "+str(timeout)+" seconds."
+		timeoutEndTime=time.time()+timeout
+		# Check straight away in this thread, so anything that's already ready doesn't wait for the
+		# poller and a timeout shorter than one round trip still gets an answer.
+		states=dict( zip( applications, _parallelMap( self.probe, applications ) ) )
+		if self._allReady( applications, isReady, states ) : return states
+		if timeoutEndTime<=time.time() : raise Exception( errorMessage )
+
+		waiter={ "applications":applications, "isReady":isReady, "states":None, "error":None }
+		self._condition.acquire()
+		try :
+			self._waiters.append( waiter )
+			self._newWaiter=True
+			if self._pollingThread==None :
+				self._pollingThread=threading.Thread( target=self._poll )
+				self._pollingThread.daemon=True
+				self._pollingThread.start()
+			else : self._condition.notifyAll() # Make sure the new applications are polled straight away
+			while waiter["states"]==None and waiter["error"]==None :
+				remainingTime=timeoutEndTime-time.time()
+				if remainingTime<=0 :
+					self._waiters.remove( waiter )
+					raise Exception( errorMessage )
+				self._condition.wait( remainingTime )
+			if waiter["error"]!=None : raise waiter["error"]
+			return waiter["states"]
+		finally :
+			self._condition.release()
+
+	def _allReady( self, applications, isReady, states ) :
+		for application in applications :
+			if not isReady( states[application] ) : return False
+		return True
+
+	def _poll( self ) :
+		try :
+			self._pollUntilNoWaiters()
+		finally :
+			# However the loop finished, the next wait has to start a new poller
+			self._condition.acquire()
+			try :
+				if self._pollingThread==threading.currentThread() : self._pollingThread=None
+				self._condition.notifyAll()
+			finally :
+				self._condition.release()
+
+	def _pollUntilNoWaiters( self ) :
+		interval=self.initialInterval
+		previousStates={}
+		while True :
+			self._condition.acquire()
+			try :
+				if len(self._waiters)==0 :
+					self._pollingThread=None
+					return
+				waiters=list(self._waiters)
+				self._newWaiter=False
+			finally :
+				self._condition.release()
+
+			applications=[]
+			for waiter in waiters :
+				for application in waiter["applications"] :
+					if application not in applications : applications.append( application )
+			try :
+				states=dict( zip( applications, _parallelMap( self.probe, applications ) ) )
+			except Exception as error :
+				# Pass the error on to everyone waiting on this poll rather than dying with it
+				self._condition.acquire()
+				try :
+					for waiter in waiters :
+						if waiter not in self._waiters : continue
+						waiter["error"]=error
+						self._waiters.remove( waiter )
+					self._condition.notifyAll()
+				finally :
+					self._condition.release()
+				previousStates={}
+				interval=self.initialInterval
+				continue
+			changed=False
+			for application in applications :
+				if previousStates.get( application, self )!=states[application] : changed=True
+			previousStates=states
+
+			self._condition.acquire()
+			try :
+				for waiter in waiters :
+					if waiter not in self._waiters : continue # Gave up waiting
+					if self._allReady( waiter["applications"], waiter["isReady"], states ) :
+						readyStates={}
+						for application in waiter["applications"] : readyStates[application]=states[application]
+						waiter["states"]=readyStates
+						self._waiters.remove( waiter )
+				self._condition.notifyAll()
+				if changed or self._newWaiter : interval=self.initialInterval
+				else : interval=min( interval*self.backoff, self.maximumInterval )
+				if len(self._waiters)!=0 and not self._newWaiter : self._condition.wait( interval )
+			finally :
+				self._condition.release()
+
+## Waits for applications to reach a given state
+stateWatcher=StateWatcher()
+## Waits for applications to be ready to take requests, see Application.isReady
+readinessWatcher=StateWatcher( probe=lambda application : application.isReady() )
 
 def sendSoapStartCommand( host, port, configFilename, forcedEnvironmentVariables={} ):
+	return sendSoapEnvelope( host, None, soapStartCommandMessage(port,configFilename,forcedEnvironmentVariables) )
+
+# Complete startXdaqExe messages, keyed on everything that goes into them. See soapStartCommandMessage.
+_startCommandMessages={}
+_startCommandMessagesLock=threading.Lock()
+
+def soapStartCommandMessage( port, configFilename, forcedEnvironmentVariables={} ):
+	"""
+	Returns the complete SOAP message (i.e. including the envelope) that asks the xdaq daemon to start
+	a process listening on "port" with the given config file.
+	
+	The message is kept and reused for as long as the config file's modification time and the
+	environment variables stay the same, so starting the same processes over and over during a scan
+	doesn't read the config file each time.
+	"""
+	environmentVariables=_startEnvironmentVariables( forcedEnvironmentVariables )
+	modificationTime=os.stat( configFilename ).st_mtime
+	key=( port, configFilename, modificationTime, tuple(sorted(environmentVariables.items())) )
+	_startCommandMessagesLock.acquire()
+	try :
+		message=_startCommandMessages.get( key )
+	finally :
+		_startCommandMessagesLock.release()
+	if message==None :
+		message=soapEnvelope( _renderStartCommandBody(port,configFilename,environmentVariables) )
+		_startCommandMessagesLock.acquire()
+		try :
+			# Anything for an earlier version of this config file is never going to be used again
+			for oldKey in _startCommandMessages.keys() :
+				if oldKey[0:2]==key[0:2] : del _startCommandMessages[oldKey]
+			_startCommandMessages[key]=message
+		finally :
+			_startCommandMessagesLock.release()
+	return message
+
+def soapStartCommandBody( port, configFilename, forcedEnvironmentVariables={} ):
+	"""
+	Returns the body of the SOAP message that asks the xdaq daemon to start a process listening on
+	"port" with the given config file. This is never cached, use soapStartCommandMessage for
+	repeated starts.
+	"""
+	return _renderStartCommandBody( port, configFilename, _startEnvironmentVariables(forcedEnvironmentVariables) )
+
+def _startEnvironmentVariables( forcedEnvironmentVariables ):
+	"""
+	Returns the environment variables that the started process should have.
+	"""
 	# These are the environment variables that must be provided. I'm pretty sure I can
 	# trim this down, but that's a job for a later date.
 	requiredEnvironmentVariableNames=['USER',
@@ -177,29 +968,26 @@ def sendSoapStartCommand( host, port, configFilename, forcedEnvironmentVariables
 	for variableName in forcedEnvironmentVariables:
 		# Doesn't matter if I overwrite anything from the previous step, because they will be the same.
 		environmentVariables[variableName]=forcedEnvironmentVariables[variableName]
-	
-	
-	# Now I have all of the environment variables figured out I can craft the message body
-	soapBody = '<xdaq:startXdaqExe execPath="'+environmentVariables['XDAQ_ROOT']+'/bin/xdaq.exe" user="'+environmentVariables["USER"]+'" argv="-p '+str(port)+' -l INFO" xmlns:xdaq="urn:xdaq-soap:3.0" >\n'
-	soapBody += '<EnvironmentVariable '
-	
+	return environmentVariables
 
-
-	for key in environmentVariables:
-		soapBody+=key+'="'+environmentVariables[key]+'" '
-	soapBody += """/>
+def _renderStartCommandBody( port, configFilename, environmentVariables ):
+	# Now I have all of the environment variables figured out I can craft the message body
+	parts=['<xdaq:startXdaqExe execPath="'+environmentVariables['XDAQ_ROOT']+'/bin/xdaq.exe" user="'+environmentVariables["USER"]+'" argv="-p '+str(port)+' -l INFO" xmlns:xdaq="urn:xdaq-soap:3.0" >\n',
+		'<EnvironmentVariable ']
+	for key in sorted(environmentVariables.keys()):
+		parts.append( key+'="'+environmentVariables[key]+'" ' )
+	parts.append( """/>
 	<ConfigFile>
-	<![CDATA[\n"""
-		
+	<![CDATA[\n""" )
 	configFile=open(configFilename)
-	for line in configFile.readlines():
-		soapBody += line
-	  
-	soapBody += """]]>
+	try :
+		parts.append( configFile.read() )
+	finally :
+		configFile.close()
+	parts.append( """]]>
 	</ConfigFile>
-	</xdaq:startXdaqExe>"""
-	
-	return sendSoapMessage( host, None, soapBody )
+	</xdaq:startXdaqExe>""" )
+	return "".join( parts )
 
 		
 class Context(object) :
@@ -229,10 +1017,16 @@ class Context(object) :
 		elif len(splitByNamespace)==2 : tagname=splitByNamespace[1]
 		else : raise Exception( "Couldn't split off the namespace in '"+elementTreeNode.tag+"'" )
 		if tagname!="Context" : raise Exception( "Not a Context node" )
-		# Loop over the items and record the url and port
+		# Loop over the items and record the url and port. A context can optionally say which other
+		# contexts have to be started before it with a "startAfter" attribute (in any namespace so that
+		# XDAQ ignores it), which is a space separated list of their urls.
+		currentURL=None
+		self.startAfter=[]
 		for item in elementTreeNode.items() :
 			if item[0]=="url" : currentURL=item[1]
+			elif item[0].split("}")[-1]=="startAfter" : self.startAfter=item[1].split()
 		if currentURL==None : raise Exception( "Couldn't get the URL for this context" )
+		self.url=currentURL
 		self.host=currentURL.split(":")[-2].split("/")[-1] # Get everything after "http://" and before the port (i.e. last ":" separator)
 		self.port=currentURL.split(":")[-1]
 		# Now loop over all of the children and look for Application nodes
@@ -270,9 +1064,8 @@ class Context(object) :
 		mypid = None
 		self.jobid = -1
 		try :
-			response=ElementTree.fromstring( sendSoapMessage( self.host, self.port, '<xdaq:ParameterQuery xmlns:xdaq="urn:xdaq-soap:3.0" />', lid=0 ) )
-			response.__class__=ETElementExtension
-			mypid=response.getchildnamed("Body").getchildnamed("ParameterQueryResponse").getchildnamed("properties").getchildnamed("descriptor").getchildnamed("properties").getchildnamed("pid").text
+			response=sendSoapEnvelope( self.host, self.port, soapCommandMessage("ParameterQuery"), lid=0, idempotent=True )
+			mypid=extract( response, "Body/ParameterQueryResponse/properties/descriptor/properties/pid" )
 		except :
 			pass
 		if mypid == None : return False
@@ -306,54 +1099,44 @@ class Context(object) :
 				if not forceStart : raise Exception("Context "+str(self)+" appears to already be running. Try again with either forceRestart or forceStart set to True.")
 
 		self.jobid=-1
-		response=ElementTree.fromstring( sendSoapStartCommand( self.host, self.port, self.configFilename, self.forcedEnvironmentVariables ) )
+		forgetActiveJobIDs( self.host )
+		response=sendSoapStartCommand( self.host, self.port, self.configFilename, self.forcedEnvironmentVariables )
 		try:
-			response.__class__=ETElementExtension
-			self.jobid = response.getchildnamed("Body").getchildnamed("jidResponse").getchildnamed("jid").text
+			jobid = extract( response, "Body/jidResponse/jid" )
 		except:
-			raise Exception( "Couldn't start process. Response was: "+ElementTree.tostring(response) )
+			jobid = None
+		if jobid==None : raise Exception( "Couldn't start process. Response was: "+response )
+		self.jobid = jobid
 		
 	def killProcess(self) :
 		if self.jobid==-1 :
 			return False
-		response=ElementTree.fromstring( sendSoapMessage( self.host, None, '<xdaq:killExec user="xtaldaq" jid="'+self.jobid+'" xmlns:xdaq="urn:xdaq-soap:3.0" />' ) )
+		response=sendSoapEnvelope( self.host, None, soapCommandMessage("killExec",user="xtaldaq",jid=self.jobid) )
 		try:
-			response.__class__=ETElementExtension
-			reply=response.getchildnamed("Body").getchildnamed("getStateResponse").getchildnamed("reply").text
+			reply=extract( response, "Body/getStateResponse/reply" )
 			if reply=='no job killed.' : return False
 			elif reply=='killed by JID' :
 				self.jobid=-1
+				forgetActiveJobIDs( self.host )
+				# Any connections kept open to the process are no use now
+				connectionPool.close( self.host, self.port )
 				return True
 		except:
-			raise Exception( "Couldn't kill process. Response was: "+ElementTree.tostring(response) )
+			raise Exception( "Couldn't kill process. Response was: "+response )
 
 	def waitUntilProcessStarted( self, timeout=30.0 ) :
 		"""
 		Blocks until the process has started and all applications are contactable, or throws an exception if
 		"timeout" seconds have passed.
 		"""
-		timeoutEndTime=time.time()+timeout;
-		while True :
-			allAplicationsStarted=True
-			for application in self.applications:
-				if application.getState()=="<uncontactable>": allAplicationsStarted=False
-				if allAplicationsStarted: return
-				if timeoutEndTime<time.time() : raise Exception("Context "+repr(self)+" did not start all applications within "+str(timeout)+" seconds.")
-				time.sleep(0.5)
+		stateWatcher.wait( self.applications, lambda state : state!="<uncontactable>", timeout, "Context "+repr(self)+" did not start all applications within "+str(timeout)+" seconds." )
 
 	def waitUntilProcessKilled( self, timeout=10.0 ) :
 		"""
 		Blocks until the process has stopped and all applications are uncontactable, or throws an exception if
 		"timeout" seconds have passed.
 		"""
-		timeoutEndTime=time.time()+timeout;
-		while True :
-			allAplicationsStopped=True
-			for application in self.applications:
-				if application.getState()!="<uncontactable>": allAplicationsStopped=False
-				if allAplicationsStopped: return
-				if timeoutEndTime<time.time() : raise Exception("Context "+repr(self)+" did not kill all applications within "+str(timeout)+" seconds.")
-				time.sleep(0.5)
+		stateWatcher.wait( self.applications, lambda state : state=="<uncontactable>", timeout, "Context "+repr(self)+" did not kill all applications within "+str(timeout)+" seconds." )
 
 class Application(object) :
 	"""
@@ -368,66 +1151,57 @@ class Application(object) :
 		self.className=className
 		self.instance=instance
 		self.id=id
-		self.connection=httplib.HTTPConnection( self.host+":"+str(self.port) )
-		# Make sure the connection is closed, because all the other methods assume
-		# it's in that state. Presumably the connection will have failed at that
-		# stage anyway.
-		self.connection.close()
 
 	def __repr__(self) :
 		return "<XDAQ Application "+self.host+", "+str(self.port)+", "+self.className+", "+str(self.instance)+">"
 
 	def sendCommand( self, command ) :
-		return sendSoapMessage( self.host, self.port, '<xdaq:'+command+' xmlns:xdaq="urn:xdaq-soap:3.0"/>', self.className, self.instance )
+		# Only ParameterQuery is safe to send twice if the connection fails, state changes aren't
+		return sendSoapEnvelope( self.host, self.port, soapCommandMessage(command), self.className, self.instance, idempotent=(command=="ParameterQuery") )
 
+	@timedOperation( "getState" )
 	def getState(self) :
 		try :
-			result=ElementTree.fromstring( self.sendCommand('ParameterQuery') )
-			result.__class__=ETElementExtension
-			try :
-				return result.getchildnamed("Body").getchildnamed("ParameterQueryResponse").getchildnamed("properties").getchildnamed("stateName").text
-			except :
-				return "<unknown>"
+			state=extract( self.sendCommand('ParameterQuery'), "Body/ParameterQueryResponse/properties/stateName" )
 		except : return "<uncontactable>"
+		if state==None : return "<unknown>"
+		return state
 
+	@timedOperation( "waitForState" )
 	def waitForState(self,state,timeout=5.0):
 		"""
 		Blocks until the state of the application has reached the one specified, or if "timeout" seconds
 		have passed then an exception will be thrown. If timeout is negative then the application must
 		already be in the desired state or the exception is thrown immediately.
 		"""
-		timeoutEndTime=time.time()+timeout;
-		while True :
+		if timeout<0 :
 			if self.getState()==state : return
-			if timeoutEndTime<time.time() : raise Exception("Application "+repr(self)+" did not reach state "+state+" within "+str(timeout)+" seconds.")
-			time.sleep(0.2)
+			raise Exception("Application "+repr(self)+" is not in state "+state+".")
+		stateWatcher.wait( [self], lambda applicationState : applicationState==state, timeout, "Application "+repr(self)+" did not reach state "+state+" within "+str(timeout)+" seconds." )
+
+	def isReady( self ) :
+		"""
+		Returns True if the application is answering http requests properly, i.e. its main page can be
+		fetched. It can answer SOAP messages a little before this when the process is starting.
+		"""
+		try :
+			return self.httpRequest( "GET", "/urn:xdaq-application:lid="+str(self.id) ).status==200
+		except :
+			return False
 			
-	def httpRequest( self, requestType, resource, parameters={}, storeMessage=True ) :
+	def httpRequest( self, requestType, resource, parameters={}, idempotent=None ) :
 		"""
 		Send an http request to the application to the resource specified, with
 		optional parameters specified as a dictionary. "requestType" is the http
 		type, e.g. "GET" or "POST".
+		
+		The response message is always read so that the connection can be reused, and
+		is stored in the member "fullMessage" of the returned response. See
+		HTTPConnectionPool.request for idempotent.
 		"""
-		try :
-			self.connection.connect()
-			# I copied this from an example on stack overflow
-			headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
-			self.connection.request( requestType, urllib.quote(resource), urllib.urlencode(parameters), headers )
-			response = self.connection.getresponse()
-			if storeMessage:
-				# I need to "read" the response message before the connection gets closed.
-				# I'll store the message in a custom member of the response class that gets
-				# returned to the user.
-				response.fullMessage=response.read()
-			self.connection.close()
-			return response
-		except :
-			# Make sure the connection is closed before leaving this method, no
-			# matter what the circumstances are. Otherwise the connection might
-			# block next time I try to use it
-			self.connection.close()
-			# It's now okay to throw the original exception
-			raise
+		# I copied this from an example on stack overflow
+		headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
+		return connectionPool.request( self.host, self.port, requestType, urllib.quote(resource), urllib.urlencode(parameters), headers, httpStatisticsLabel(self,requestType,resource), idempotent )
 
 
 class Program(object) :
@@ -474,34 +1248,94 @@ class Program(object) :
 		for context in self.contexts:
 			context.forcedEnvironmentVariables = environmentVariables
 
-	def startAllProcesses( self, ignoreIfCurrentlyRunning=False, forceRestart=False, forceStart=False ) :
+	def contextStages( self ) :
+		"""
+		Splits the contexts into a list of stages, where every context in a stage only has to be started
+		after contexts in earlier stages (as given by the "startAfter" attribute in the config). Contexts
+		in the same stage don't depend on each other so can be started at the same time.
+		"""
+		contextsByURL={}
+		for context in self.contexts : contextsByURL[context.url]=context
+		for context in self.contexts :
+			for url in context.startAfter :
+				if url not in contextsByURL : raise Exception( "Context "+repr(context)+" is set to start after "+url+" but there is no context with that url" )
+		stages=[]
+		done=set()
+		remaining=list(self.contexts)
+		while len(remaining)!=0 :
+			stage=[context for context in remaining if len([url for url in context.startAfter if contextsByURL[url] not in done])==0]
+			if len(stage)==0 : raise Exception( "The startAfter attributes of contexts "+str(remaining)+" depend on each other in a loop" )
+			stages.append( stage )
+			done.update( stage )
+			remaining=[context for context in remaining if context not in done]
+		return stages
+
+	def startAllProcesses( self, ignoreIfCurrentlyRunning=False, forceRestart=False, forceStart=False, timeout=30.0 ) :
 		"""
 		Starts all of the processes. See the docs for startProcess for the meaning of the parameters.
+		
+		Contexts that don't depend on each other are started at the same time. If any contexts have to
+		be started after others (see contextStages) then before moving on to them, this waits up to
+		"timeout" seconds for the ones they depend on to be contactable. Returns a dictionary of context
+		to how long it took to start in seconds.
 		"""
-		for context in self.contexts:
+		stages=self.contextStages()
+		timings={}
+		def start( context ) :
+			startTime=time.time()
 			context.startProcess( ignoreIfCurrentlyRunning, forceRestart, forceStart )
+			if len(stages)>1 : context.waitUntilProcessStarted( timeout )
+			timings[context]=time.time()-startTime
+		for stage in stages :
+			_parallelMap( start, stage )
+		return timings
 
-	def killAllProcesses( self ) :
-		for context in self.contexts:
-			context.killProcess()
+	def killAllProcesses( self, timeout=10.0 ) :
+		"""
+		Kills all the processes, all at the same time unless contexts have to be started in a particular
+		order (see contextStages), in which case they're killed in the reverse order and this waits up
+		to "timeout" seconds for each stage to die before moving on. Returns a dictionary of context to
+		how long it took to kill in seconds.
+		"""
+		stages=self.contextStages()
+		stages.reverse()
+		timings={}
+		def kill( context ) :
+			startTime=time.time()
+			if context.killProcess() and len(stages)>1 : context.waitUntilProcessKilled( timeout )
+			timings[context]=time.time()-startTime
+		for stage in stages :
+			_parallelMap( kill, stage )
+		return timings
 			
 	def reattachAll( self ) :
 		activeJobIDs=getActiveJobIDs()
-		for context in self.contexts:
-			context.reattach( activeJobIDs )
+		# Each context has to be asked for its pid, so ask them all at once
+		_parallelMap( lambda context : context.reattach( activeJobIDs ), self.contexts )
 			
+	def allApplications( self ) :
+		applications=[]
+		for context in self.contexts : applications.extend( context.applications )
+		return applications
+
+	def queryAllStates( self, applications=None ) :
+		"""
+		Returns a dictionary of application to state for all applications (or only the ones given).
+		All the applications are asked at the same time, so this takes about as long as the slowest
+		one to reply however many contexts there are.
+		"""
+		if applications==None : applications=self.allApplications()
+		return queryStates( applications )
+
 	def waitUntilAllProcessesStarted( self, timeout=30.0 ) :
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		for context in self.contexts:
-			context.waitUntilProcessStarted( timeout-(time.time()-startTime) )
-		# Add an arbitrary wait time because I've had cases where the process appears to be
-		# running but the applications don't respond quite yet.
-		time.sleep(2)
+		startTime=time.time()
+		stateWatcher.wait( self.allApplications(), lambda state : state!="<uncontactable>", timeout, "Not all applications started within "+str(timeout)+" seconds." )
+		# I've had cases where the process appears to be running but the applications don't respond
+		# quite yet, so make sure they all answer properly before carrying on.
+		readinessWatcher.wait( self.allApplications(), lambda ready : ready, max(timeout-(time.time()-startTime),0.0), "Not all applications were ready within "+str(timeout)+" seconds." )
 
 	def waitUntilAllProcessesKilled( self, timeout=10.0 ) :
-		startTime=time.time() # Since they don't run concurrently, I need to subtract previous waits
-		for context in self.contexts:
-			context.waitUntilProcessKilled( timeout-(time.time()-startTime) )
+		stateWatcher.wait( self.allApplications(), lambda state : state=="<uncontactable>", timeout, "Not all applications were killed within "+str(timeout)+" seconds." )
 
 	def sendAllCommand( self, command ) :
 		for context in self.contexts :
@@ -509,6 +1343,7 @@ class Program(object) :
 				application.sendCommand( command )
 
 	def printAllStates( self, hideComms=False ) :
+		states=self.queryAllStates()
 		for context in self.contexts :
 			firstApplication=True
 			for application in context.applications :
@@ -517,7 +1352,7 @@ class Program(object) :
 						contextString=context.host+":"+str(context.port)+" (job ID="+str(context.jobid)+")"
 						firstApplication=False
 					else : contextString=""
-					print contextString.ljust(40)+application.className.ljust(30)+str(application.instance).rjust(4)+"   "+application.getState()
+					print contextString.ljust(40)+application.className.ljust(30)+str(application.instance).rjust(4)+"   "+states[application]
 
 	def findAllMatchingApplications( self, className, instance=None ) :
 		"""
@@ -547,8 +1382,9 @@ class Program(object) :
 		throws an exception if "timeout" seconds have elapsed.
 		"""
 		matchingApps=self.findAllMatchingApplications( className, instance )
-		for application in matchingApps :
-			try:
-				application.waitForState( state, timeout )
-			except Exception as error:
-				print str(error)
+		try :
+			stateWatcher.wait( matchingApps, lambda applicationState : applicationState==state, timeout )
+		except :
+			states=self.queryAllStates( matchingApps )
+			for application in matchingApps :
+				if states[application]!=state : print "Application "+repr(application)+" did not reach state "+state+" within "+str(timeout)+" seconds."
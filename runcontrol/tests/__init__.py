@@ -0,0 +1,9 @@
+"""
+@brief Unit tests for pythonlib. Anything that needs XDAQ processes or a GLIB runs against
+pythonlib/XDAQSimulator, so no hardware is needed.
+
+Run from the runcontrol directory with
+@code
+	python -m unittest discover -s tests -t .
+@endcode
+"""
@@ -0,0 +1,183 @@
+"""
+@brief Runs a GlibSupervisor and GlibStreamer in pythonlib/XDAQSimulator for the tests, either on their
+own (SimulatedBoard) or as a SimpleGlibProgram with any number of boards (SimulatedProgram).
+
+Everything listens on ports picked by the operating system, so the tests don't need (or get in the
+way of) the normal xdaq daemon port.
+"""
+import os, socket, shutil, tempfile, time
+from pythonlib import XDAQTools
+from pythonlib.XDAQSimulator import XDAQSimulator
+from pythonlib.GlibSupervisorApplication import GlibSupervisorApplication
+from pythonlib.GlibStreamerApplication import GlibStreamerApplication
+from pythonlib.SimpleGlibProgram import SimpleGlibProgram
+from pythonlib.I2cChip import I2cFileWriter
+from environmentVariables_default import getEnvironmentVariables
+
+SUPERVISOR_ID=94804
+STREAMER_ID=1434
+
+_CONFIG="""<xc:Partition xmlns:xc="http://xdaq.web.cern.ch/xdaq/xsd/2004/XMLConfiguration-30">
+	<xc:Context url="http://127.0.0.1:%d">
+		<xc:Application class="GlibSupervisor" id="%d" instance="0" network="local"/>
+		<xc:Application class="GlibStreamer" id="%d" instance="0" network="local"/>
+	</xc:Context>
+</xc:Partition>
+"""
+
+_PROGRAM_CONFIG_START="""<xc:Partition xmlns:xc="http://xdaq.web.cern.ch/xdaq/xsd/2004/XMLConfiguration-30">
+"""
+# The streamer goes in the context of the first board
+_PROGRAM_CONTEXT="""	<xc:Context url="http://127.0.0.1:%d">
+		<xc:Application class="GlibSupervisor" id="%d" instance="%d" network="local"/>%s
+	</xc:Context>
+"""
+_PROGRAM_STREAMER="""
+		<xc:Application class="GlibStreamer" id="%d" instance="0" network="local"/>"""
+_PROGRAM_CONFIG_END="""</xc:Partition>
+"""
+
+def freePort() :
+	"""
+	Returns a port that nothing is listening on at the moment.
+	"""
+	listener=socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+	try :
+		listener.bind( ("127.0.0.1",0) )
+		return listener.getsockname()[1]
+	finally :
+		listener.close()
+
+class SimulatedBoard(object) :
+	"""
+	Starts a simulator and one XDAQ process in it with a supervisor and a streamer. Any keyword
+	arguments are passed on to XDAQSimulator. Call stop() when finished.
+	"""
+	def __init__( self, **simulatorOptions ) :
+		self.directory=tempfile.mkdtemp()
+		self.jobControlPort=freePort()
+		self.port=freePort()
+		self.simulator=XDAQSimulator( jobControlPort=self.jobControlPort, **simulatorOptions )
+		self.process=None
+		self.simulator.start()
+		try :
+			self.configFilename=os.path.join( self.directory, "config.xml" )
+			configFile=open( self.configFilename, "w" )
+			try :
+				configFile.write( _CONFIG%(self.port,SUPERVISOR_ID,STREAMER_ID) )
+			finally :
+				configFile.close()
+			message=XDAQTools.soapStartCommandMessage( self.port, self.configFilename, getEnvironmentVariables() )
+			XDAQTools.sendSoapEnvelope( "127.0.0.1", self.jobControlPort, message )
+			self.process=self.simulator.jobControl.jobs.values()[0]
+			self.simulatedSupervisor=self.process.applications[str(SUPERVISOR_ID)]
+			self.simulatedStreamer=self.process.applications[str(STREAMER_ID)]
+			self.supervisorApplication=XDAQTools.Application( "127.0.0.1", self.port, "GlibSupervisor", 0, SUPERVISOR_ID )
+			self.streamerApplication=XDAQTools.Application( "127.0.0.1", self.port, "GlibStreamer", 0, STREAMER_ID )
+			XDAQTools.stateWatcher.wait( [self.supervisorApplication], lambda state : state!="<uncontactable>", 10.0 )
+		except :
+			self.stop()
+			raise
+
+	def supervisor( self ) :
+		"""
+		Initialises the supervisor and returns it as a GlibSupervisorApplication, with its I2C files
+		written to a temporary directory.
+		"""
+		self.supervisorApplication.sendCommand( "Initialise" )
+		self.supervisorApplication.waitForState( "Halted", 5.0 )
+		application=self.supervisorApplication
+		application.__class__=GlibSupervisorApplication
+		application.__init__()
+		application.tempDirectory=os.path.join( self.directory, "supervisor" )
+		os.makedirs( application.tempDirectory )
+		application._i2cFileWriter=I2cFileWriter( application.tempDirectory )
+		return application
+
+	def streamer( self ) :
+		"""
+		Returns the streamer as a GlibStreamerApplication, writing to a file in the temporary directory.
+		"""
+		application=self.streamerApplication
+		application.__class__=GlibStreamerApplication
+		application.__init__()
+		application.setOutputFilename( os.path.join(self.directory,"run.dat") )
+		return application
+
+	def stop( self ) :
+		# The simulator closes a killed process's server in the background. Closing it here as well
+		# waits for it, so that nothing is still shutting down when the tests finish.
+		server=None
+		if self.process!=None : server=self.process.server
+		self.simulator.stop()
+		if server!=None : server.close()
+		XDAQTools.connectionPool.close( "127.0.0.1", self.port )
+		XDAQTools.connectionPool.close( "127.0.0.1", self.jobControlPort )
+		shutil.rmtree( self.directory, True )
+
+class SimulatedProgram(object) :
+	"""
+	Starts a simulator and a SimpleGlibProgram for it with numberOfBoards GlibSupervisors, each in its
+	own context, and one GlibStreamer. The processes are started and the program is in "program". Any
+	keyword arguments are passed on to XDAQSimulator. Call stop() when finished.
+	
+	XDAQTools.jobControlPort is changed to the simulator's until stop().
+	"""
+	def __init__( self, numberOfBoards=1, **simulatorOptions ) :
+		self.directory=tempfile.mkdtemp()
+		self.jobControlPort=freePort()
+		self.ports=[freePort() for board in range(0,numberOfBoards)]
+		self.simulator=XDAQSimulator( jobControlPort=self.jobControlPort, **simulatorOptions )
+		self._previousJobControlPort=XDAQTools.jobControlPort
+		XDAQTools.jobControlPort=self.jobControlPort
+		self.simulator.start()
+		try :
+			configFilename=os.path.join( self.directory, "config.xml" )
+			configFile=open( configFilename, "w" )
+			try :
+				configFile.write( _PROGRAM_CONFIG_START )
+				for board in range(0,numberOfBoards) :
+					streamer=""
+					if board==0 : streamer=_PROGRAM_STREAMER%STREAMER_ID
+					configFile.write( _PROGRAM_CONTEXT%(self.ports[board],SUPERVISOR_ID,board,streamer) )
+				configFile.write( _PROGRAM_CONFIG_END )
+			finally :
+				configFile.close()
+			self.program=SimpleGlibProgram( configFilename )
+			self.program.setEnvironmentVariables( getEnvironmentVariables() )
+			for supervisor in self.program.supervisors :
+				supervisor.tempDirectory=os.path.join( self.directory, "supervisor"+str(supervisor.boardNumber) )
+				os.makedirs( supervisor.tempDirectory )
+				supervisor._i2cFileWriter=I2cFileWriter( supervisor.tempDirectory )
+			self.program.setOutputFilename( os.path.join(self.directory,"run.dat") )
+			self.program.startAllProcesses()
+			self.program.waitUntilAllProcessesStarted()
+		except :
+			self.stop()
+			raise
+
+	def simulatedSupervisors( self ) :
+		"""
+		The simulated GlibSupervisor of every board that has been started, in board order.
+		"""
+		supervisors={}
+		for process in self.simulator.jobControl.jobs.values() :
+			if process.isActive() :
+				supervisor=process.applications[str(SUPERVISOR_ID)]
+				supervisors[int(supervisor.instance)]=supervisor
+		return [supervisors[board] for board in sorted(supervisors.keys())]
+
+	def simulatedStreamer( self ) :
+		for process in self.simulator.jobControl.jobs.values() :
+			if process.isActive() and str(STREAMER_ID) in process.applications : return process.applications[str(STREAMER_ID)]
+
+	def stop( self ) :
+		# See SimulatedBoard.stop
+		servers=[process.server for process in self.simulator.jobControl.jobs.values() if process.server!=None]
+		self.simulator.stop()
+		for server in servers : server.close()
+		for port in self.ports : XDAQTools.connectionPool.close( "127.0.0.1", port )
+		XDAQTools.connectionPool.close( "127.0.0.1", self.jobControlPort )
+		XDAQTools.forgetActiveJobIDs()
+		XDAQTools.jobControlPort=self._previousJobControlPort
+		shutil.rmtree( self.directory, True )
@@ -0,0 +1,81 @@
+import unittest, re, time
+from pythonlib import XDAQTools
+from tests.simulatedBoard import SimulatedBoard
+
+class TestActiveJobIDs( unittest.TestCase ) :
+	def setUp( self ) :
+		XDAQTools.forgetActiveJobIDs()
+		self.board=SimulatedBoard()
+		self.jobControl=self.board.simulator.jobControl
+		# Record every fetch of the job table and every job status asked for
+		self.pagesFetched=0
+		self.statusesAsked=[]
+		page=self.jobControl.page
+		getJobStatus=self.jobControl.getJobStatus
+		def recordingPage() :
+			self.pagesFetched+=1
+			return page()
+		def recordingGetJobStatus( jobID ) :
+			self.statusesAsked.append( jobID )
+			return getJobStatus( jobID )
+		self.jobControl.page=recordingPage
+		self.jobControl.getJobStatus=recordingGetJobStatus
+
+	def tearDown( self ) :
+		self.board.stop()
+		XDAQTools.forgetActiveJobIDs()
+
+	def _getActiveJobIDs( self, maximumAge=None ) :
+		return XDAQTools.getActiveJobIDs( "127.0.0.1", self.board.jobControlPort, maximumAge )
+
+	def test_onlyNumbersAreAskedAbout( self ) :
+		jobIDs=self._getActiveJobIDs()
+		self.assertEqual( jobIDs, [{"jid":self.board.process.jobID,"pid":self.board.process.pid}] )
+		# The table has the user and status as well, only the cells that are numbers are asked about,
+		# and only once each
+		cells=re.findall( '(?<=\<td bgcolor="#F0F0D0"\>)\w+', self.jobControl.page() )
+		self.assertTrue( "xtaldaq" in cells )
+		expected=[]
+		for cell in cells :
+			if cell.isdigit() and cell not in expected : expected.append( cell )
+		self.assertEqual( sorted(self.statusesAsked), sorted(expected) )
+
+	def test_resultIsReusedUntilItExpires( self ) :
+		jobIDs=self._getActiveJobIDs( maximumAge=0.2 )
+		# Changing what's returned doesn't change what's kept
+		jobIDs.append( "junk" )
+		self.assertEqual( len(self._getActiveJobIDs(maximumAge=0.2)), 1 )
+		self.assertEqual( self.pagesFetched, 1 )
+		# Killed behind the module's back, so it isn't noticed until the result expires
+		self.board.process.kill()
+		self.assertEqual( len(self._getActiveJobIDs(maximumAge=0.2)), 1 )
+		time.sleep( 0.25 )
+		self.assertEqual( self._getActiveJobIDs(maximumAge=0.2), [] )
+		self.assertEqual( self.pagesFetched, 2 )
+		self._getActiveJobIDs( maximumAge=0 )
+		self.assertEqual( self.pagesFetched, 3 )
+
+	def test_defaultExpiry( self ) :
+		previousCacheTime=XDAQTools.activeJobIDsCacheTime
+		XDAQTools.activeJobIDsCacheTime=0.1
+		try :
+			self._getActiveJobIDs()
+			self._getActiveJobIDs()
+			self.assertEqual( self.pagesFetched, 1 )
+			time.sleep( 0.15 )
+			self._getActiveJobIDs()
+			self.assertEqual( self.pagesFetched, 2 )
+		finally :
+			XDAQTools.activeJobIDsCacheTime=previousCacheTime
+
+	def test_forgetting( self ) :
+		self._getActiveJobIDs()
+		XDAQTools.forgetActiveJobIDs( "some.other.host" )
+		self._getActiveJobIDs()
+		self.assertEqual( self.pagesFetched, 1 )
+		XDAQTools.forgetActiveJobIDs( "127.0.0.1" )
+		self._getActiveJobIDs()
+		self.assertEqual( self.pagesFetched, 2 )
+
+if __name__ == '__main__':
+	unittest.main()
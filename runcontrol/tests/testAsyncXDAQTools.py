@@ -0,0 +1,128 @@
+import unittest, socket, time
+from pythonlib import XDAQTools, AsyncXDAQTools
+from pythonlib.AsyncXDAQTools import EventLoop, Sleep, Return, gather
+from pythonlib.XDAQSimulator import XDAQSimulator
+from pythonlib.SimpleGlibProgram import AsyncSimpleGlibProgram
+from tests.simulatedBoard import SimulatedProgram, freePort
+
+JOB_CONTROL_PAGE="/urn:xdaq-application:lid=10"
+
+class TestEventLoop( unittest.TestCase ) :
+	def setUp( self ) :
+		self.loop=EventLoop()
+		self.finished=[]
+
+	def _after( self, seconds, name, error=None ) :
+		yield Sleep( seconds )
+		self.finished.append( name )
+		if error!=None : raise error
+		raise Return( name )
+
+	def test_gatherKeepsTheOrderGiven( self ) :
+		startTime=time.time()
+		results=self.loop.run( gather( self._after(0.2,"slow"), self._after(0.0,"immediate"), self._after(0.1,"medium") ) )
+		self.assertEqual( results, ["slow","immediate","medium"] )
+		self.assertEqual( self.finished, ["immediate","medium","slow"] )
+		# They were all waiting at the same time
+		self.assertTrue( time.time()-startTime<0.3 )
+
+	def test_nestedCoroutinesReturnValues( self ) :
+		def outer() :
+			first=yield self._after( 0.0, "first" )
+			both=yield gather( self._after(0.0,"second"), self._after(0.0,"third") )
+			raise Return( [first]+both )
+		self.assertEqual( self.loop.run( outer() ), ["first","second","third"] )
+
+	def test_gatherRaisesTheFirstErrorOnceAllHaveFinished( self ) :
+		coroutine=gather( self._after(0.1,"fine"), self._after(0.0,"broken",ValueError("broken")), self._after(0.05,"alsoBroken",KeyError("alsoBroken")) )
+		self.assertRaises( ValueError, self.loop.run, coroutine )
+		self.assertEqual( sorted(self.finished), ["alsoBroken","broken","fine"] )
+
+	def test_errorsCanBeCaughtInTheCoroutine( self ) :
+		def catcher() :
+			try :
+				yield self._after( 0.0, "broken", ValueError("broken") )
+			except ValueError as error :
+				raise Return( "caught "+str(error) )
+		self.assertEqual( self.loop.run( catcher() ), "caught broken" )
+
+class TestHTTPRequest( unittest.TestCase ) :
+	def setUp( self ) :
+		self.loop=EventLoop()
+		self.simulator=None
+
+	def tearDown( self ) :
+		if self.simulator!=None : self.simulator.stop()
+
+	def _startSimulator( self, **options ) :
+		self.simulator=XDAQSimulator( jobControlPort=freePort(), **options )
+		self.simulator.start()
+		return self.simulator.jobControlPort
+
+	def test_request( self ) :
+		port=self._startSimulator()
+		response=self.loop.run( AsyncXDAQTools.httpRequest( "127.0.0.1", port, "GET", JOB_CONTROL_PAGE ) )
+		self.assertEqual( response.status, 200 )
+		self.assertTrue( "<html>" in response.fullMessage )
+		# Anything the simulator doesn't know comes back as an error status rather than an exception
+		response=self.loop.run( AsyncXDAQTools.httpRequest( "127.0.0.1", port, "GET", "/urn:xdaq-application:lid=12345" ) )
+		self.assertNotEqual( response.status, 200 )
+
+	def test_severalAtOnce( self ) :
+		port=self._startSimulator( latency=0.2 )
+		startTime=time.time()
+		responses=self.loop.run( gather( *[AsyncXDAQTools.httpRequest("127.0.0.1",port,"GET",JOB_CONTROL_PAGE) for index in range(0,5)] ) )
+		self.assertEqual( [response.status for response in responses], [200]*5 )
+		self.assertTrue( time.time()-startTime<0.2*5 )
+
+	def test_connectionRefused( self ) :
+		self.assertRaises( socket.error, self.loop.run, AsyncXDAQTools.httpRequest( "127.0.0.1", freePort(), "GET", "/" ) )
+
+	def test_timeout( self ) :
+		port=self._startSimulator( latency=1.0 )
+		startTime=time.time()
+		self.assertRaises( socket.timeout, self.loop.run, AsyncXDAQTools.httpRequest( "127.0.0.1", port, "GET", JOB_CONTROL_PAGE, timeout=0.2 ) )
+		self.assertTrue( time.time()-startTime>=0.2 )
+		self.assertTrue( time.time()-startTime<1.0 )
+
+	def test_soapErrorStatusIsRaised( self ) :
+		port=self._startSimulator()
+		# Not a SOAP message, so the daemon doesn't answer with 200
+		self.assertRaises( Exception, self.loop.run, AsyncXDAQTools.sendSoapEnvelope( "127.0.0.1", port, "not soap" ) )
+		response=self.loop.run( AsyncXDAQTools.sendSoapEnvelope( "127.0.0.1", port, XDAQTools.soapCommandMessage("killExec",user="xtaldaq",jid="1") ) )
+		self.assertTrue( "no job killed." in response )
+
+class TestAsyncSimpleGlibProgram( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulated=SimulatedProgram( numberOfBoards=2, transitionDelay=0.05 )
+		self.program=AsyncSimpleGlibProgram( self.simulated.program )
+		self.loop=EventLoop()
+
+	def tearDown( self ) :
+		self.simulated.stop()
+
+	def test_initialiseAndConfigure( self ) :
+		self.loop.run( self.program.initialise( triggerRate=256, numberOfEvents=40 ) )
+		boards=self.simulated.simulatedSupervisors()
+		streamer=self.simulated.simulatedStreamer()
+		for board in boards :
+			self.assertEqual( board.state, "Halted" )
+			self.assertEqual( int(board.savedParameters["user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ"]), 8 )
+			self.assertEqual( board.i2cFiles, {} )
+		self.assertEqual( streamer.savedParameters["nbAcq"], "40" )
+		self.loop.run( self.program.configure() )
+		for board in boards :
+			self.assertEqual( board.state, "Configured" )
+			self.assertEqual( sorted(board.i2cFiles.keys()), ["FE0CBC0","FE0CBC1","FE1CBC0","FE1CBC1"] )
+		self.assertEqual( streamer.state, "Configured" )
+		# Nothing changed, so configuring again doesn't post the parameters again
+		self.loop.run( self.program.configure() )
+		self.assertEqual( streamer.parameterPosts, 1 )
+		for board in boards : self.assertEqual( board.parameterPosts, 1 )
+		self.loop.run( self.program.enable() )
+		for board in boards : self.assertEqual( board.state, "Enabled" )
+		self.loop.run( self.program.halt() )
+		for board in boards : self.assertEqual( board.state, "Halted" )
+
+if __name__ == '__main__':
+	unittest.main()
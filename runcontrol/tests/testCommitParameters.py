@@ -0,0 +1,88 @@
+import unittest
+from tests.simulatedBoard import SimulatedBoard, SimulatedProgram
+
+class TestCommitParameters( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard()
+		self.streamer=self.board.streamer()
+		self.supervisor=self.board.supervisor()
+		self.simulatedStreamer=self.board.simulatedStreamer
+		self.simulatedSupervisor=self.board.simulatedSupervisor
+		self.supervisor.commitParameters()
+		self.simulatedStreamer.parameterPosts=0
+		self.simulatedSupervisor.parameterPosts=0
+
+	def tearDown( self ) :
+		self.board.stop()
+
+	def test_stagedChangesGoInOnePost( self ) :
+		self.streamer.stageOutputFilename( "/tmp/staged.dat" )
+		self.streamer.stageNumberOfEvents( 250 )
+		self.streamer.stageConfigureParameters( 300 )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 0 )
+		self.assertTrue( self.streamer.commitParameters() )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 1 )
+		self.assertEqual( self.simulatedStreamer.savedParameters["destination"], "/tmp/staged.dat" )
+		self.assertEqual( self.simulatedStreamer.savedParameters["nbAcq"], "300" )
+
+	def test_nothingDirtyPostsNothing( self ) :
+		self.assertFalse( self.streamer.commitParameters() )
+		self.assertFalse( self.supervisor.commitParameters() )
+		# Setting what's already there doesn't make them dirty
+		self.streamer.stageNumberOfEvents( self.streamer.parameters["nbAcq"] )
+		self.supervisor.stageConfigureParameters( 2**self.supervisor.parameters["user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ"] )
+		self.assertFalse( self.streamer.commitParameters() )
+		self.assertFalse( self.supervisor.commitParameters() )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 0 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 0 )
+		# Unless they're forced, e.g. because the process is new
+		self.streamer.markParametersUnsent()
+		self.assertTrue( self.streamer.commitParameters() )
+		self.assertTrue( self.supervisor.commitParameters(force=True) )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 1 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 1 )
+
+	def test_setMethodsPostStraightAway( self ) :
+		self.streamer.setOutputFilename( "/tmp/immediate.dat" )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 1 )
+		self.assertEqual( self.simulatedStreamer.savedParameters["destination"], "/tmp/immediate.dat" )
+		self.streamer.setNumberOfEvents( 20 )
+		self.streamer.setConfigureParameters( 30 )
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 3 )
+		self.assertFalse( self.streamer.commitParameters() )
+		self.supervisor.setConfigureParameters( 128 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 1 )
+		self.assertEqual( int(self.simulatedSupervisor.savedParameters["user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ"]), 7 )
+		self.assertFalse( self.supervisor.commitParameters() )
+
+class TestProgramCommitParameters( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulated=SimulatedProgram()
+		self.program=self.simulated.program
+		self.program.initialise( triggerRate=64, numberOfEvents=50 )
+		self.simulatedStreamer=self.simulated.simulatedStreamer()
+		self.simulatedSupervisor=self.simulated.simulatedSupervisors()[0]
+
+	def tearDown( self ) :
+		self.simulated.stop()
+
+	def test_oneCommitIsOnePost( self ) :
+		# initialise sends everything, including the output filename set before the processes started
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 1 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 1 )
+		self.assertEqual( self.simulatedStreamer.savedParameters["nbAcq"], "50" )
+		self.assertEqual( self.simulatedStreamer.savedParameters["destination"], self.program.streamer.parameters["destination"] )
+		# Nothing has changed since, so configure doesn't post anything
+		self.program.configure()
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 1 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 1 )
+		self.program.setOutputFilename( "/tmp/secondRun.dat" )
+		self.program.setConfigureParameters( numberOfEvents=60 )
+		self.program.configure()
+		self.assertEqual( self.simulatedStreamer.parameterPosts, 2 )
+		self.assertEqual( self.simulatedSupervisor.parameterPosts, 1 )
+		self.assertEqual( self.simulatedStreamer.savedParameters["destination"], "/tmp/secondRun.dat" )
+		self.assertEqual( self.simulatedStreamer.savedParameters["nbAcq"], "60" )
+
+if __name__ == '__main__':
+	unittest.main()
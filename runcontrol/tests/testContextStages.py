@@ -0,0 +1,74 @@
+import unittest, os, shutil, tempfile
+from pythonlib.XDAQTools import Program
+
+CONFIG_START="""<xc:Partition xmlns:xc="http://xdaq.web.cern.ch/xdaq/xsd/2004/XMLConfiguration-30" xmlns:rc="urn:runcontrol">
+"""
+CONFIG_END="""</xc:Partition>
+"""
+
+class TestContextStages( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+
+	def tearDown( self ) :
+		shutil.rmtree( self.directory )
+
+	def _program( self, startAfters ) :
+		"""
+		Creates a Program from a config with a context on each port in startAfters, mapped to the ports
+		it has to start after. Nothing is contacted, so unlike the constructor this doesn't reattach.
+		"""
+		configFilename=os.path.join( self.directory, "config.xml" )
+		configFile=open( configFilename, "w" )
+		try :
+			configFile.write( CONFIG_START )
+			for port in sorted(startAfters.keys()) :
+				urls=" ".join( ["http://127.0.0.1:"+str(otherPort) for otherPort in startAfters[port]] )
+				if len(urls)==0 : configFile.write( '<xc:Context url="http://127.0.0.1:'+str(port)+'">\n' )
+				else : configFile.write( '<xc:Context url="http://127.0.0.1:'+str(port)+'" rc:startAfter="'+urls+'">\n' )
+				configFile.write( '<xc:Application class="GlibSupervisor" id="1" instance="0" network="local"/>\n' )
+				configFile.write( '</xc:Context>\n' )
+			configFile.write( CONFIG_END )
+		finally :
+			configFile.close()
+		program=Program.__new__( Program )
+		program.xdaqConfigFilename=configFilename
+		program._loadXDAQConfig()
+		return program
+
+	def _stagePorts( self, program ) :
+		return [sorted([int(context.port) for context in stage]) for stage in program.contextStages()]
+
+	def test_noDependenciesIsOneStage( self ) :
+		program=self._program( {13000:[],13001:[],13002:[]} )
+		self.assertEqual( self._stagePorts(program), [[13000,13001,13002]] )
+		self.assertEqual( program.contexts[0].startAfter, [] )
+
+	def test_ordering( self ) :
+		program=self._program( {13000:[13003],13001:[],13002:[13000,13001],13003:[],13004:[13001]} )
+		self.assertEqual( program.contexts[2].startAfter, ["http://127.0.0.1:13000","http://127.0.0.1:13001"] )
+		self.assertEqual( self._stagePorts(program), [[13001,13003],[13000,13004],[13002]] )
+		# Every context turns up exactly once
+		allContexts=[]
+		for stage in program.contextStages() : allContexts.extend( stage )
+		self.assertEqual( sorted(allContexts), sorted(program.contexts) )
+
+	def test_chain( self ) :
+		program=self._program( {13000:[13001],13001:[13002],13002:[]} )
+		self.assertEqual( self._stagePorts(program), [[13002],[13001],[13000]] )
+
+	def test_loop( self ) :
+		self.assertRaises( Exception, self._program( {13000:[13001],13001:[13000]} ).contextStages )
+		self.assertRaises( Exception, self._program( {13000:[],13001:[13002],13002:[13003],13003:[13001]} ).contextStages )
+		self.assertRaises( Exception, self._program( {13000:[13000]} ).contextStages )
+
+	def test_missingContext( self ) :
+		program=self._program( {13000:[],13001:[13005]} )
+		try :
+			program.contextStages()
+			self.fail( "No exception for a context that isn't in the config" )
+		except Exception as error :
+			self.assertTrue( "http://127.0.0.1:13005" in str(error) )
+
+if __name__ == '__main__':
+	unittest.main()
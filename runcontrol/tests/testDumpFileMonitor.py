@@ -0,0 +1,116 @@
+import unittest, os, time, shutil, tempfile
+from pythonlib.DumpFileMonitor import DumpFileMonitor, EVENT_SIZE
+from tests.simulatedBoard import SimulatedBoard
+
+class TestDumpFileMonitorWithStreamer( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard( triggerRate=2000 )
+		self.streamer=self.board.streamer()
+		self.monitor=None
+
+	def tearDown( self ) :
+		if self.monitor!=None : self.monitor.close()
+		self.board.stop()
+
+	def _startAcquisition( self, numberOfEvents ) :
+		"""
+		Starts the streamer taking numberOfEvents, and returns a monitor created just before.
+		"""
+		if self.monitor!=None : self.monitor.close()
+		self.streamer.stageNumberOfEvents( numberOfEvents )
+		self.streamer.commitParameters()
+		self.streamer.sendCommand( "configure" )
+		self.monitor=self.streamer.progressMonitor()
+		self.streamer.sendCommand( "start" )
+		return self.monitor
+
+	def test_followsAcquisition( self ) :
+		monitor=self._startAcquisition( 200 )
+		startTime=time.time()
+		self.assertTrue( self.streamer.waitForAcquisition(monitor,5.0) )
+		# Well before the streamer would have been asked
+		self.assertTrue( time.time()-startTime<1.0 )
+		progress=monitor.progress()
+		self.assertEqual( progress['eventsWritten'], 200 )
+		self.assertEqual( progress['fractionComplete'], 1.0 )
+
+	def test_shorterRewrite( self ) :
+		self.assertTrue( self._startAcquisition(300).waitForEvents(timeout=5.0) )
+		monitor=self._startAcquisition( 100 )
+		startTime=time.time()
+		self.assertTrue( monitor.waitForEvents(timeout=3.0) )
+		self.assertTrue( time.time()-startTime<1.0 )
+		self.assertEqual( monitor.progress()['eventsWritten'], 100 )
+
+	def test_rewritePastTheOldSize( self ) :
+		self.assertTrue( self._startAcquisition(20).waitForEvents(timeout=5.0) )
+		monitor=self._startAcquisition( 400 )
+		self.assertTrue( monitor.waitForEvents(timeout=3.0) )
+		self.assertEqual( monitor.progress()['eventsWritten'], 400 )
+
+class TestDumpFileMonitor( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+		self.filename=os.path.join( self.directory, "run.dat" )
+
+	def tearDown( self ) :
+		shutil.rmtree( self.directory )
+
+	def _write( self, filename, numberOfEvents ) :
+		outputFile=open( filename, "wb" )
+		try :
+			outputFile.write( "\0"*(numberOfEvents*EVENT_SIZE) )
+		finally :
+			outputFile.close()
+
+	def test_existingEventsAreIgnored( self ) :
+		self._write( self.filename, 10 )
+		monitor=DumpFileMonitor( self.filename, 5 )
+		try :
+			self.assertEqual( monitor.progress()['eventsWritten'], 0 )
+			outputFile=open( self.filename, "ab" )
+			outputFile.write( "\0"*(3*EVENT_SIZE+1) )
+			outputFile.close()
+			self.assertEqual( monitor.progress()['eventsWritten'], 3 )
+		finally :
+			monitor.close()
+
+	def test_replacedFile( self ) :
+		self._write( self.filename, 10 )
+		for useInotify in [True,False] :
+			monitor=DumpFileMonitor( self.filename, 12, useInotify=useInotify )
+			try :
+				# Bigger than before, so only the new inode shows it's a different file
+				self._write( self.filename+".new", 12 )
+				os.rename( self.filename+".new", self.filename )
+				self.assertTrue( monitor.waitForEvents(timeout=1.0) )
+				self.assertEqual( monitor.progress()['eventsWritten'], 12 )
+			finally :
+				monitor.close()
+
+	def test_truncatedWithoutInotify( self ) :
+		self._write( self.filename, 10 )
+		monitor=DumpFileMonitor( self.filename, 4, useInotify=False )
+		self._write( self.filename, 4 )
+		self.assertTrue( monitor.waitForEvents(timeout=1.0) )
+		self.assertEqual( monitor.progress()['eventsWritten'], 4 )
+
+	def test_timeout( self ) :
+		monitor=DumpFileMonitor( self.filename, 1 )
+		try :
+			startTime=time.time()
+			self.assertFalse( monitor.waitForEvents(timeout=0.1) )
+			self.assertTrue( time.time()-startTime>=0.1 )
+			self.assertFalse( monitor.waitForEvents(timeout=0) )
+			self.assertEqual( monitor.progress()['eventsWritten'], 0 )
+		finally :
+			monitor.close()
+		monitor=DumpFileMonitor( self.filename )
+		try :
+			self.assertEqual( monitor.progress()['fractionComplete'], None )
+			self.assertRaises( Exception, monitor.waitForEvents, timeout=0 )
+		finally :
+			monitor.close()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,125 @@
+import unittest, socket, threading, httplib
+from pythonlib.XDAQTools import HTTPConnectionPool, soapCommandMessage, soapHeaders
+from pythonlib.XDAQSimulator import XDAQSimulator
+from tests.simulatedBoard import freePort
+
+JOB_CONTROL_PAGE="/urn:xdaq-application:lid=10"
+
+class DroppingServer(object) :
+	"""
+	Answers the first request on each connection, then reads the second one and closes the connection
+	without answering, like a server that dies after being sent a request. Records the path of every
+	request it reads in "received".
+	"""
+	def __init__( self ) :
+		self.received=[]
+		self._stopped=False
+		self._listener=socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+		self._listener.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+		self._listener.bind( ("127.0.0.1",0) )
+		self._listener.listen( 5 )
+		self._listener.settimeout( 0.05 )
+		self.port=self._listener.getsockname()[1]
+		self._thread=threading.Thread( target=self._accept )
+		self._thread.daemon=True
+		self._thread.start()
+
+	def stop( self ) :
+		self._stopped=True
+		self._thread.join()
+		self._listener.close()
+
+	def _accept( self ) :
+		while not self._stopped :
+			try :
+				connection, address = self._listener.accept()
+			except socket.timeout :
+				continue
+			connection.settimeout( 5.0 )
+			thread=threading.Thread( target=self._serve, args=(connection,) )
+			thread.daemon=True
+			thread.start()
+
+	def _serve( self, connection ) :
+		reader=connection.makefile( "rb" )
+		try :
+			for requestNumber in range(0,2) :
+				requestLine=reader.readline()
+				if requestLine=="" : return
+				length=0
+				while True :
+					line=reader.readline()
+					if line.strip()=="" : break
+					if line.lower().startswith("content-length:") : length=int( line.split(":")[1] )
+				reader.read( length )
+				self.received.append( requestLine.split()[1] )
+				if requestNumber==0 : connection.sendall( "HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOK" )
+		finally :
+			reader.close()
+			connection.close()
+
+class TestHTTPConnectionPool( unittest.TestCase ) :
+	def setUp( self ) :
+		self.pool=HTTPConnectionPool()
+
+	def tearDown( self ) :
+		self.pool.close()
+
+	def test_connectionsAreReused( self ) :
+		simulator=XDAQSimulator( jobControlPort=freePort() )
+		simulator.start()
+		try :
+			key=("127.0.0.1",simulator.jobControlPort)
+			self.assertEqual( self.pool.request( key[0], key[1], "GET", JOB_CONTROL_PAGE ).status, 200 )
+			connection=self.pool._idleConnections[key][0]
+			self.assertEqual( self.pool.request( key[0], key[1], "GET", JOB_CONTROL_PAGE ).status, 200 )
+			self.assertEqual( self.pool._idleConnections[key], [connection] )
+		finally :
+			simulator.stop()
+
+	def test_staleConnectionIsReplaced( self ) :
+		# Restarting the simulator drops the connection the pool is holding
+		port=freePort()
+		simulator=XDAQSimulator( jobControlPort=port )
+		simulator.start()
+		try :
+			self.assertEqual( self.pool.request( "127.0.0.1", port, "GET", JOB_CONTROL_PAGE ).status, 200 )
+		finally :
+			simulator.stop()
+		simulator=XDAQSimulator( jobControlPort=port )
+		simulator.start()
+		try :
+			# Not safe to send twice, so this only works if the dropped connection isn't used at all
+			message=soapCommandMessage( "killExec", user="xtaldaq", jid="1" )
+			response=self.pool.request( "127.0.0.1", port, "POST", "/cgi-bin/query", message, soapHeaders() )
+			self.assertEqual( response.status, 200 )
+			self.assertTrue( "no job killed." in response.fullMessage )
+		finally :
+			simulator.stop()
+
+	def test_sentPostIsNotResent( self ) :
+		server=DroppingServer()
+		try :
+			self.pool.request( "127.0.0.1", server.port, "POST", "/first", "a=1" )
+			self.assertRaises( (httplib.HTTPException,socket.error), self.pool.request, "127.0.0.1", server.port, "POST", "/second", "a=2" )
+			self.assertEqual( server.received, ["/first","/second"] )
+		finally :
+			server.stop()
+
+	def test_sentIdempotentRequestIsResent( self ) :
+		server=DroppingServer()
+		try :
+			self.pool.request( "127.0.0.1", server.port, "POST", "/first", "a=1" )
+			self.assertEqual( self.pool.request( "127.0.0.1", server.port, "POST", "/query", "a=2", idempotent=True ).fullMessage, "OK" )
+			# GET requests are idempotent unless told otherwise
+			self.assertEqual( self.pool.request( "127.0.0.1", server.port, "GET", "/page" ).fullMessage, "OK" )
+			self.assertEqual( server.received, ["/first","/query","/query","/page","/page"] )
+		finally :
+			server.stop()
+
+	def test_newConnectionIsNotRetried( self ) :
+		# Nothing listening, so the first attempt fails and there's no stale connection to blame
+		self.assertRaises( socket.error, self.pool.request, "127.0.0.1", freePort(), "GET", "/" )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,106 @@
+import unittest, os, shutil, tempfile, array, gc
+from pythonlib.I2cChip import I2cChip, I2cRegisterSchema, I2cRegisterFileCache, registerFileCache
+
+I2C_DIRECTORY=os.path.join( os.path.dirname(os.path.abspath(__file__)), os.pardir, "i2c" )
+
+class TestRegisterBank( unittest.TestCase ) :
+	def setUp( self ) :
+		self.chip=I2cChip( os.path.join(I2C_DIRECTORY,"FE0CBC0.txt") )
+
+	def test_channelTrims( self ) :
+		trims=self.chip.getChannelTrims()
+		self.assertEqual( len(trims), 254 )
+		newTrims=[channel%256 for channel in range(0,len(trims))]
+		self.chip.setChannelTrims( newTrims )
+		for channel in [0,1,127,253] :
+			self.assertEqual( self.chip.getChannelTrim(channel), newTrims[channel] )
+		self.assertEqual( list(self.chip.getChannelTrims()), newTrims )
+		# The register views are onto the same values
+		self.assertEqual( self.chip.getRegister("Channel002").value, newTrims[1] )
+		self.assertRaises( Exception, self.chip.setChannelTrims, newTrims[1:] )
+
+	def test_registerViews( self ) :
+		register=self.chip.getRegister("VCth")
+		register.value=0x42
+		self.assertEqual( self.chip.getValues(["VCth"]), {"VCth":0x42} )
+		self.chip.setValues( {"VCth":0x43} )
+		self.assertEqual( register.value, 0x43 )
+		self.assertRaises( OverflowError, self.chip.setValues, {"VCth":256} )
+		self.assertRaises( Exception, self.chip.setValues, {"NotARegister":1} )
+
+	def test_chipsShareTheSchema( self ) :
+		otherChip=I2cChip( os.path.join(I2C_DIRECTORY,"FE0CBC1.txt") )
+		self.assertTrue( otherChip.bank.schema is self.chip.bank.schema )
+		otherChip.setChannelTrim( 0, 0x11 )
+		self.assertNotEqual( self.chip.getChannelTrim(0), 0x11 )
+
+	def test_unusedSchemasAreDropped( self ) :
+		schema=I2cRegisterSchema.get( ["Unused"], [0], [0x7f], [0] )
+		self.assertTrue( I2cRegisterSchema.get( ["Unused"], [0], [0x7f], [0] ) is schema )
+		numberOfSchemas=len( I2cRegisterSchema._instances )
+		del schema
+		gc.collect()
+		self.assertEqual( len(I2cRegisterSchema._instances), numberOfSchemas-1 )
+		# Still in use by the chip
+		self.assertTrue( I2cChip( os.path.join(I2C_DIRECTORY,"FE0CBC1.txt") ).bank.schema is self.chip.bank.schema )
+
+class TestRegisterFileCache( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+		self.sidecarDirectory=os.path.join( self.directory, "sidecars" )
+		self.filename=os.path.join( self.directory, "FE0CBC0.txt" )
+		shutil.copy( os.path.join(I2C_DIRECTORY,"FE0CBC0.txt"), self.filename )
+
+	def tearDown( self ) :
+		registerFileCache.invalidate( self.filename )
+		shutil.rmtree( self.directory )
+
+	def _rewrite( self, values ) :
+		"""
+		Changes the values in the file, and leaves out a register so that the size changes too.
+		"""
+		chip=I2cChip( self.filename )
+		chip.setValues( values )
+		chip.writeToFilename( self.filename, [name for name in chip.bank.schema.names if name!="FrontEndControl"] )
+
+	def test_sidecarIsUsedByAFreshCache( self ) :
+		original=I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		self.assertEqual( len(os.listdir(self.sidecarDirectory)), 1 )
+		fromSidecar=I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		self.assertTrue( fromSidecar.schema is original.schema )
+		self.assertEqual( fromSidecar.values, original.values )
+
+	def test_changedFileInvalidatesTheSidecar( self ) :
+		I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		self._rewrite( {"VCth":0x55} )
+		registerFile=I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		self.assertEqual( dict(zip(registerFile.schema.names,registerFile.values))["VCth"], 0x55 )
+		self.assertTrue( "FrontEndControl" not in registerFile.schema.names )
+
+	def test_changedFileInvalidatesTheEntry( self ) :
+		cache=I2cRegisterFileCache( self.sidecarDirectory )
+		cache.load( self.filename )
+		self._rewrite( {"VCth":0x56} )
+		registerFile=cache.load( self.filename )
+		self.assertEqual( dict(zip(registerFile.schema.names,registerFile.values))["VCth"], 0x56 )
+
+	def test_corruptSidecarIsIgnored( self ) :
+		original=I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		for name in os.listdir(self.sidecarDirectory) :
+			open( os.path.join(self.sidecarDirectory,name), "wb" ).write( "not a sidecar" )
+		registerFile=I2cRegisterFileCache( self.sidecarDirectory ).load( self.filename )
+		self.assertEqual( registerFile.values, original.values )
+
+	def test_writingInvalidatesTheProcessCache( self ) :
+		# Writing from this process has to be noticed even if the size and modification time match
+		chip=I2cChip( self.filename )
+		chip.writeToFilename( self.filename )
+		self.assertEqual( I2cChip(self.filename).getValues(["VCth"]), chip.getValues(["VCth"]) )
+		status=os.stat( self.filename )
+		chip.setValues( {"VCth":0x57} )
+		chip.writeToFilename( self.filename )
+		os.utime( self.filename, (status.st_atime,status.st_mtime) )
+		self.assertEqual( I2cChip(self.filename).getValues(["VCth"]), {"VCth":0x57} )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+import unittest, os, shutil, tempfile
+from pythonlib.I2cSnapshotStore import I2cSnapshotStore
+from tests.simulatedBoard import SimulatedBoard
+
+class TestI2cSnapshotStore( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard()
+		self.supervisor=self.board.supervisor()
+		self.storeDirectory=tempfile.mkdtemp()
+		self.store=I2cSnapshotStore( self.storeDirectory )
+
+	def tearDown( self ) :
+		self.board.stop()
+		shutil.rmtree( self.storeDirectory )
+
+	def _objects( self ) :
+		return os.listdir( os.path.join(self.storeDirectory,"objects") )
+
+	def test_roundTrip( self ) :
+		self.supervisor.setI2c( {"VCth":0x60} )
+		self.supervisor.setChannelTrim( 7, 0x31, ["FE1CBC0"] )
+		saved=self.supervisor.I2CRegisterValues()
+		self.supervisor.saveI2cSnapshot( self.store, "loop0" )
+		self.supervisor.setI2c( {"VCth":0x61} )
+		self.supervisor.setAllChannelTrims( 0x32 )
+		self.supervisor.restoreI2cSnapshot( self.store, "loop0" )
+		self.assertEqual( self.supervisor.I2CRegisterValues(), saved )
+		# A new store on the same directory reads it back from disk
+		snapshot=I2cSnapshotStore( self.storeDirectory ).load( "loop0" )
+		for chipName in saved :
+			self.assertEqual( dict(zip(snapshot[chipName].schema.names,snapshot[chipName].values)), saved[chipName] )
+
+	def test_restoredValuesAreSent( self ) :
+		self.supervisor.sendI2c()
+		self.supervisor.saveI2cSnapshot( self.store, "before" )
+		self.supervisor.setI2c( {"VCth":0x62}, ["FE0CBC1"] )
+		self.supervisor.sendI2c()
+		sent=self.board.simulatedSupervisor.i2cFiles
+		sent.clear()
+		self.supervisor.restoreI2cSnapshot( self.store, "before" )
+		self.supervisor.sendI2c()
+		self.assertEqual( sent.keys(), ["FE0CBC1"] )
+		self.assertEqual( sent["FE0CBC1"].split()[0], "VCth" )
+
+	def test_identicalContentIsStoredOnce( self ) :
+		self.supervisor.saveI2cSnapshot( self.store, "first" )
+		numberOfObjects=len( self._objects() )
+		self.supervisor.saveI2cSnapshot( self.store, "second" )
+		self.assertEqual( len(self._objects()), numberOfObjects )
+		self.supervisor.setI2c( {"VCth":0x63}, ["FE0CBC0"] )
+		self.supervisor.saveI2cSnapshot( self.store, "third" )
+		self.assertEqual( len(self._objects()), numberOfObjects+1 )
+		self.assertEqual( self.store.names(), ["first","second","third"] )
+		differences=self.store.diff( "second", "third" )
+		self.assertEqual( differences.keys(), ["FE0CBC0"] )
+		self.assertEqual( [difference[0] for difference in differences["FE0CBC0"]], ["VCth"] )
+
+	def test_failedWriteIsWrittenNextTime( self ) :
+		writeFile=self.store._writeFile
+		def failingWrite( filename, string ) :
+			raise IOError( "Disk full" )
+		self.store._writeFile=failingWrite
+		self.assertRaises( IOError, self.supervisor.saveI2cSnapshot, self.store, "failed" )
+		self.assertEqual( self._objects(), [] )
+		self.store._writeFile=writeFile
+		self.supervisor.saveI2cSnapshot( self.store, "retried" )
+		self.assertEqual( sorted(I2cSnapshotStore(self.storeDirectory).load("retried").keys()), sorted(self.supervisor.connectedCBCNames()) )
+
+	def test_badNames( self ) :
+		for name in ["", "../escape", ".hidden"] :
+			self.assertRaises( Exception, self.store.save, name, {} )
+		self.assertRaises( Exception, self.store.load, "missing" )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,96 @@
+import unittest, threading, time
+from tests.simulatedBoard import SimulatedBoard
+from tests.testSendI2c import registerNamesInFile
+
+class TestI2cVerification( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard()
+		self.supervisor=self.board.supervisor()
+		self.simulatedSupervisor=self.board.simulatedSupervisor
+		# Every write to a chip, as (chip name, register names)
+		self.writes=[]
+		writeChip=self.simulatedSupervisor._writeChip
+		def recordingWriteChip( chipName, fileContents ) :
+			self.writes.append( (chipName,registerNamesInFile(fileContents)) )
+			writeChip( chipName, fileContents )
+		self.simulatedSupervisor._writeChip=recordingWriteChip
+		self.supervisor.sendI2c()
+		del self.writes[:]
+
+	def tearDown( self ) :
+		self.supervisor.disableI2cVerification()
+		self.board.stop()
+
+	def readback( self, supervisor, chipName ) :
+		return dict( self.simulatedSupervisor.chipValues[chipName] )
+
+	def test_matchingChipsAreNotResent( self ) :
+		self.supervisor.enableI2cVerification( self.readback )
+		self.supervisor.setI2c( {"VCth":0x50} )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.supervisor.waitForI2cVerification(), {} )
+		self.assertEqual( len(self.writes), len(self.supervisor.connectedCBCNames()) )
+
+	def test_onlyMismatchesAreResent( self ) :
+		self.supervisor.enableI2cVerification( self.readback )
+		self.simulatedSupervisor.ignoredWrites["FE0CBC0"]={"VCth":1}
+		self.supervisor.setI2c( {"VCth":0x51,"TriggerLatency":0x11}, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.supervisor.waitForI2cVerification(), {} )
+		self.assertEqual( self.writes, [("FE0CBC0",["TriggerLatency","VCth"]),("FE0CBC0",["VCth"])] )
+		self.assertEqual( self.simulatedSupervisor.chipValues["FE0CBC0"]["VCth"], 0x51 )
+
+	def test_persistentFailureIsReported( self ) :
+		self.supervisor.enableI2cVerification( self.readback, retries=2 )
+		self.simulatedSupervisor.ignoredWrites["FE0CBC1"]={"VCth":100}
+		self.supervisor.setI2c( {"VCth":0x52}, ["FE0CBC1"] )
+		self.supervisor.sendI2c()
+		try :
+			self.supervisor.waitForI2cVerification()
+			self.fail( "No exception raised" )
+		except Exception as error :
+			self.assertTrue( "FE0CBC1" in str(error) )
+		# The first send and two retries
+		self.assertEqual( self.writes, [("FE0CBC1",["VCth"])]*3 )
+		# Reported once, then cleared
+		self.assertEqual( self.supervisor.waitForI2cVerification(), {} )
+
+	def test_readbackOverlapsTheNextSend( self ) :
+		started=threading.Event()
+		carryOn=threading.Event()
+		def slowReadback( supervisor, chipName ) :
+			started.set()
+			carryOn.wait( 5.0 )
+			return self.readback( supervisor, chipName )
+		self.supervisor.enableI2cVerification( slowReadback )
+		self.supervisor.setI2c( {"VCth":0x53}, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertTrue( started.wait(5.0) )
+		# The read back is still going, but sending isn't held up by it
+		startTime=time.time()
+		self.supervisor.setI2c( {"VCth":0x54}, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertTrue( time.time()-startTime<1.0 )
+		carryOn.set()
+		self.assertEqual( self.supervisor.waitForI2cVerification(), {} )
+		self.assertEqual( self.writes, [("FE0CBC0",["VCth"])]*2 )
+
+	def test_readbackErrorsAreRaised( self ) :
+		def failingReadback( supervisor, chipName ) :
+			raise IOError( "No reply" )
+		self.supervisor.enableI2cVerification( failingReadback )
+		self.supervisor.setI2c( {"VCth":0x55}, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertRaises( Exception, self.supervisor.waitForI2cVerification )
+
+	def test_disabled( self ) :
+		self.supervisor.enableI2cVerification( self.readback )
+		self.supervisor.disableI2cVerification()
+		self.simulatedSupervisor.ignoredWrites["FE0CBC0"]={"VCth":1}
+		self.supervisor.setI2c( {"VCth":0x56}, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.supervisor.waitForI2cVerification(), {} )
+		self.assertEqual( len(self.writes), 1 )
+
+if __name__ == '__main__':
+	unittest.main()
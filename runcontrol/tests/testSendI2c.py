@@ -0,0 +1,91 @@
+import unittest
+from tests.simulatedBoard import SimulatedBoard
+
+def registerNamesInFile( contents ) :
+	return [line.split()[0] for line in contents.splitlines() if line.strip()!=""]
+
+class TestSendI2c( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard()
+		self.supervisor=self.board.supervisor()
+		self.sent=self.board.simulatedSupervisor.i2cFiles
+		self.chipNames=sorted( self.supervisor.connectedCBCNames() )
+		self.supervisor.sendI2c()
+
+	def tearDown( self ) :
+		self.board.stop()
+
+	def test_firstSendIsComplete( self ) :
+		self.assertEqual( sorted(self.sent.keys()), self.chipNames )
+		for chipName in self.chipNames :
+			self.assertEqual( len(registerNamesInFile(self.sent[chipName])), len(self.supervisor.i2cChips[chipName].bank) )
+
+	def test_onlyChangesAreSent( self ) :
+		self.sent.clear()
+		self.supervisor.setI2c( {"VCth":0x50}, ["FE0CBC0"] )
+		self.supervisor.setChannelTrim( 3, 0x21, ["FE0CBC0"] )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.sent.keys(), ["FE0CBC0"] )
+		self.assertEqual( registerNamesInFile(self.sent["FE0CBC0"]), ["VCth","Channel004"] )
+
+	def test_nothingChangedSendsNothing( self ) :
+		self.sent.clear()
+		for chipName in self.chipNames :
+			self.supervisor.setI2c( self.supervisor.I2CRegisterValues([chipName],["VCth"])[chipName], [chipName] )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.sent, {} )
+
+	def test_registerNamesLimitTheSend( self ) :
+		self.sent.clear()
+		self.supervisor.setI2c( {"VCth":0x51,"TriggerLatency":0x10} )
+		self.supervisor.sendI2c( registerNames=["VCth"] )
+		self.assertEqual( sorted(self.sent.keys()), self.chipNames )
+		for chipName in self.chipNames :
+			self.assertEqual( registerNamesInFile(self.sent[chipName]), ["VCth"] )
+		# The other change is still waiting to be sent
+		self.sent.clear()
+		self.supervisor.sendI2c()
+		for chipName in self.chipNames :
+			self.assertEqual( registerNamesInFile(self.sent[chipName]), ["TriggerLatency"] )
+
+	def test_forceSendsEverything( self ) :
+		self.sent.clear()
+		self.supervisor.sendI2c( force=True )
+		self.assertEqual( sorted(self.sent.keys()), self.chipNames )
+		for chipName in self.chipNames :
+			self.assertEqual( len(registerNamesInFile(self.sent[chipName])), len(self.supervisor.i2cChips[chipName].bank) )
+
+	def test_transactionSendsOnceAtTheEnd( self ) :
+		self.sent.clear()
+		with self.supervisor.i2cTransaction() :
+			self.supervisor.setI2c( {"VCth":0x52}, ["FE0CBC0"] )
+			self.supervisor.sendI2c()
+			self.supervisor.setChannelTrim( 0, 0x22, ["FE1CBC1"] )
+			self.supervisor.sendI2c( chipNames=["FE1CBC1"] )
+			self.assertEqual( self.sent, {} )
+		self.assertEqual( sorted(self.sent.keys()), ["FE0CBC0","FE1CBC1"] )
+		self.assertEqual( registerNamesInFile(self.sent["FE0CBC0"]), ["VCth"] )
+		self.assertEqual( registerNamesInFile(self.sent["FE1CBC1"]), ["Channel001"] )
+
+	def test_transactionRollsBack( self ) :
+		before=self.supervisor.I2CRegisterValues()
+		self.sent.clear()
+		def failingTransaction() :
+			with self.supervisor.i2cTransaction() :
+				self.supervisor.setI2c( {"VCth":0x53} )
+				with self.supervisor.i2cTransaction() :
+					self.supervisor.setAllChannelTrims( 0x23 )
+					self.supervisor.sendI2c()
+				raise RuntimeError( "Something went wrong" )
+		self.assertRaises( RuntimeError, failingTransaction )
+		self.assertEqual( self.sent, {} )
+		self.assertEqual( self.supervisor.I2CRegisterValues(), before )
+		# Nothing is left to send, and sends aren't held back any more
+		self.supervisor.sendI2c()
+		self.assertEqual( self.sent, {} )
+		self.supervisor.setI2c( {"VCth":0x54}, ["FE0CBC1"] )
+		self.supervisor.sendI2c()
+		self.assertEqual( self.sent.keys(), ["FE0CBC1"] )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,95 @@
+import unittest, os
+from tests.simulatedBoard import SimulatedProgram
+
+class TestSession( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulated=SimulatedProgram( numberOfBoards=2 )
+		self.program=self.simulated.program
+		self.jobControl=self.simulated.simulator.jobControl
+
+	def tearDown( self ) :
+		self.simulated.stop()
+
+	def _activeJobIDs( self ) :
+		return sorted( [jobID for jobID in self.jobControl.jobs.keys() if self.jobControl.jobs[jobID].isActive()] )
+
+	def _run( self, runNumber ) :
+		"""
+		Does what a calibration run does between startRun and finishRun.
+		"""
+		self.program.setOutputFilename( os.path.join(self.simulated.directory,"run"+str(runNumber)+".dat") )
+		self.program.configure()
+		self.program.enable()
+		for board in self.simulated.simulatedSupervisors() : self.assertEqual( board.state, "Enabled" )
+
+	def _assertReadyForARun( self, numberOfEvents ) :
+		for board in self.simulated.simulatedSupervisors() : self.assertEqual( board.state, "Halted" )
+		streamer=self.simulated.simulatedStreamer()
+		self.assertEqual( streamer.state, "Halted" )
+		self.assertEqual( streamer.savedParameters["nbAcq"], str(numberOfEvents) )
+
+	def test_processesAreReused( self ) :
+		with self.program.session() :
+			self.program.startRun( numberOfEvents=10 )
+			jobIDs=self._activeJobIDs()
+			self.assertEqual( len(jobIDs), 2 )
+			self._assertReadyForARun( 10 )
+			self._run( 1 )
+			self.program.finishRun()
+			self.assertEqual( self._activeJobIDs(), jobIDs )
+			# Left enabled by the last run, so have to be halted before the next
+			self.program.startRun( numberOfEvents=20 )
+			self.assertEqual( self._activeJobIDs(), jobIDs )
+			self._assertReadyForARun( 20 )
+			self._run( 2 )
+			self.program.finishRun()
+		self.assertEqual( self._activeJobIDs(), [] )
+
+	def test_outsideASession( self ) :
+		jobIDs=self._activeJobIDs()
+		self.program.startRun()
+		# Always restarted
+		self.assertEqual( len(self._activeJobIDs()), 2 )
+		self.assertEqual( set(self._activeJobIDs()) & set(jobIDs), set() )
+		self._assertReadyForARun( 100 )
+		self._run( 1 )
+		self.program.finishRun()
+		self.assertEqual( self._activeJobIDs(), [] )
+
+	def test_abortedRunRestarts( self ) :
+		with self.program.session() :
+			self.program.startRun()
+			jobIDs=self._activeJobIDs()
+			self._run( 1 )
+			self.program.abortRun()
+			self.assertEqual( self._activeJobIDs(), [] )
+			self.program.startRun()
+			self.assertEqual( len(self._activeJobIDs()), 2 )
+			self.assertEqual( set(self._activeJobIDs()) & set(jobIDs), set() )
+			self._assertReadyForARun( 100 )
+
+	def test_deadProcessRestarts( self ) :
+		with self.program.session() :
+			self.program.startRun()
+			jobIDs=self._activeJobIDs()
+			self._run( 1 )
+			self.program.finishRun()
+			# One of the processes dies between runs
+			self.jobControl.jobs[jobIDs[-1]].kill()
+			self.program.startRun()
+			self.assertEqual( len(self._activeJobIDs()), 2 )
+			self.assertEqual( set(self._activeJobIDs()) & set(jobIDs), set() )
+			self._assertReadyForARun( 100 )
+
+	def test_nestedSessions( self ) :
+		with self.program.session() :
+			with self.program.session() :
+				self.program.startRun()
+				jobIDs=self._activeJobIDs()
+				self.program.finishRun()
+			# Only the outer session kills them
+			self.assertEqual( self._activeJobIDs(), jobIDs )
+		self.assertEqual( self._activeJobIDs(), [] )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,76 @@
+import unittest, os, shutil, tempfile
+from tests.simulatedBoard import SimulatedProgram
+
+CHIP_NAMES=["FE0CBC0","FE0CBC1","FE1CBC0","FE1CBC1"]
+
+class TestSimpleGlibProgramWithTwoBoards( unittest.TestCase ) :
+	def setUp( self ) :
+		self.simulated=SimulatedProgram( numberOfBoards=2 )
+		self.program=self.simulated.program
+		self.program.initialise( triggerRate=64 )
+		self.boards=self.simulated.simulatedSupervisors()
+
+	def tearDown( self ) :
+		self.simulated.stop()
+
+	def test_everyBoardIsInitialised( self ) :
+		self.assertEqual( len(self.boards), 2 )
+		for board in self.boards :
+			self.assertEqual( board.state, "Halted" )
+			self.assertEqual( int(board.savedParameters["user_wb_ttc_fmc_regs_pc_commands_INT_TRIGGER_FREQ"]), 6 )
+		self.assertEqual( self.program.connectedCBCNames(), CHIP_NAMES+["GLIB1_"+name for name in CHIP_NAMES] )
+
+	def test_configureSendsI2cToEveryBoard( self ) :
+		self.program.configure()
+		for board in self.boards :
+			self.assertEqual( board.state, "Configured" )
+			self.assertEqual( sorted(board.i2cFiles.keys()), CHIP_NAMES )
+
+	def test_chipsAreSentToTheirOwnBoard( self ) :
+		self.program.configure()
+		for board in self.boards : board.i2cFiles.clear()
+		self.program.setAndSendI2c( {"VCth":0x40}, ["FE0CBC1","GLIB1_FE1CBC0"] )
+		self.assertEqual( self.boards[0].i2cFiles.keys(), ["FE0CBC1"] )
+		self.assertEqual( self.boards[1].i2cFiles.keys(), ["FE1CBC0"] )
+		self.assertEqual( self.boards[1].chipValues["FE1CBC0"]["VCth"], 0x40 )
+		# No chip names means every chip on every board
+		self.program.setAndSendI2c( {"VCth":0x41} )
+		for board in self.boards :
+			self.assertEqual( sorted(board.i2cFiles.keys()), CHIP_NAMES )
+			for chipName in CHIP_NAMES : self.assertEqual( board.chipValues[chipName]["VCth"], 0x41 )
+
+	def test_transactionCoversEveryBoard( self ) :
+		self.program.configure()
+		for board in self.boards : board.i2cFiles.clear()
+		with self.program.i2cTransaction() :
+			self.program.setAndSendI2c( {"VCth":0x42}, ["FE0CBC0"] )
+			self.program.setAndSendI2c( {"VCth":0x43}, ["GLIB1_FE0CBC0"] )
+			for board in self.boards : self.assertEqual( board.i2cFiles, {} )
+		self.assertEqual( self.boards[0].chipValues["FE0CBC0"]["VCth"], 0x42 )
+		self.assertEqual( self.boards[1].chipValues["FE0CBC0"]["VCth"], 0x43 )
+
+	def test_saveAndLoadI2c( self ) :
+		directory=tempfile.mkdtemp()
+		try :
+			self.program.setAndSendI2c( {"VCth":0x44}, ["GLIB1_FE1CBC1"] )
+			self.program.saveI2c( directory )
+			self.assertTrue( os.path.isfile(os.path.join(directory,"FE1CBC1.txt")) )
+			self.assertTrue( os.path.isfile(os.path.join(directory,"GLIB1","FE1CBC1.txt")) )
+			self.program.setAndSendI2c( {"VCth":0x45} )
+			self.program.loadI2c( directory )
+			self.assertEqual( self.program.supervisors[1].I2CRegisterValues(["FE1CBC1"],["VCth"])["FE1CBC1"]["VCth"], 0x44 )
+			self.assertNotEqual( self.program.supervisors[0].I2CRegisterValues(["FE1CBC1"],["VCth"])["FE1CBC1"]["VCth"], 0x44 )
+		finally :
+			shutil.rmtree( directory )
+
+	def test_runStateTransitions( self ) :
+		self.program.configure()
+		self.program.enable()
+		for board in self.boards : self.assertEqual( board.state, "Enabled" )
+		self.program.stop()
+		for board in self.boards : self.assertEqual( board.state, "Configured" )
+		self.program.halt()
+		for board in self.boards : self.assertEqual( board.state, "Halted" )
+
+if __name__ == '__main__':
+	unittest.main()
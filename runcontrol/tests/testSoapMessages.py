@@ -0,0 +1,137 @@
+import unittest, os, shutil, tempfile
+import xml.etree.ElementTree as ElementTree
+from pythonlib import XDAQTools
+from pythonlib.XDAQTools import SoapTemplate
+
+ENVIRONMENT={ 'USER':"xtaldaq", 'XDAQ_ROOT':"/opt/xdaq", 'XDAQ_OS':"linux", 'XDAQ_PLATFORM':"x86_64_slc6",
+	'XDAQ_DOCUMENT_ROOT':"/opt/xdaq/htdocs", 'ROOTSYS':"/opt/root", 'LD_LIBRARY_PATH':"/opt/xdaq/lib",
+	'SCRATCH':"/tmp", 'CMSSW_BASE':"/opt/cmssw", 'CMSSW_RELEASE_BASE':"/opt/cmssw" }
+
+# Like the real reply, with the properties in a different namespace to the envelope and a default
+# namespace as well
+PARAMETER_QUERY_RESPONSE="""<?xml version="1.0" encoding="UTF-8"?>
+<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soap-env:Header/>
+<soap-env:Body>
+<xdaq:ParameterQueryResponse xmlns:xdaq="urn:xdaq-soap:3.0">
+<p:properties xmlns:p="urn:xdaq-application:GlibSupervisor" xsi:type="soapenc:Struct">
+<p:stateName xsi:type="xsd:string">Halted</p:stateName>
+<p:nested><p:stateName>Nested</p:stateName></p:nested>
+<p:stateName>Second</p:stateName>
+<p:empty/>
+<p:mixed>before<p:child>child</p:child>after</p:mixed>
+<value xmlns="urn:other">default namespace</value>
+</p:properties>
+</xdaq:ParameterQueryResponse>
+</soap-env:Body>
+</soap-env:Envelope>"""
+
+def commandElement( message ) :
+	"""
+	Returns the element for the XDAQ command in a complete SOAP message.
+	"""
+	body=ElementTree.fromstring( message ).find( "{http://schemas.xmlsoap.org/soap/envelope/}Body" )
+	return body.getchildren()[0]
+
+class TestSoapTemplate( unittest.TestCase ) :
+	def test_attributesAreFilledIn( self ) :
+		template=SoapTemplate( "killExec", ["user","jid"] )
+		command=commandElement( template.render( {"user":"xtaldaq","jid":12} ) )
+		self.assertEqual( command.tag, "{urn:xdaq-soap:3.0}killExec" )
+		self.assertEqual( command.attrib, {"user":"xtaldaq","jid":"12"} )
+		command=commandElement( template.render( {"user":"someoneElse","jid":"13"} ) )
+		self.assertEqual( command.attrib, {"user":"someoneElse","jid":"13"} )
+
+	def test_valuesAreEscaped( self ) :
+		template=SoapTemplate( "getJobStatus", ["jid"] )
+		for value in ['"quoted"', "a<b>&c", "100%", "%(jid)s"] :
+			self.assertEqual( commandElement( template.render( {"jid":value} ) ).get("jid"), value )
+
+	def test_noAttributes( self ) :
+		message=SoapTemplate( "ParameterQuery" ).render()
+		self.assertEqual( message, XDAQTools.soapEnvelope( '<xdaq:ParameterQuery xmlns:xdaq="urn:xdaq-soap:3.0"/>' ) )
+		self.assertEqual( commandElement( message ).attrib, {} )
+
+	def test_missingAttribute( self ) :
+		self.assertRaises( KeyError, SoapTemplate( "killExec", ["user","jid"] ).render, {"user":"xtaldaq"} )
+
+	def test_soapCommandMessage( self ) :
+		message=XDAQTools.soapCommandMessage( "killExec", jid="7", user="xtaldaq" )
+		self.assertEqual( message, SoapTemplate( "killExec", ["jid","user"] ).render( {"jid":"7","user":"xtaldaq"} ) )
+		self.assertEqual( commandElement( XDAQTools.soapCommandMessage("Configure") ).tag, "{urn:xdaq-soap:3.0}Configure" )
+		# Each combination of command and attribute names gets one template
+		self.assertTrue( ("killExec",("jid","user")) in XDAQTools._soapTemplates )
+
+class TestExtract( unittest.TestCase ) :
+	def test_namespacesAreIgnored( self ) :
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/ParameterQueryResponse/properties/stateName" ), "Halted" )
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/ParameterQueryResponse/properties/value" ), "default namespace" )
+		# Leading and trailing slashes don't matter
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "/Body/ParameterQueryResponse/properties/stateName/" ), "Halted" )
+
+	def test_onlyTheExactPathMatches( self ) :
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/ParameterQueryResponse/properties/nested/stateName" ), "Nested" )
+		# The root isn't part of the path, and elements further down don't match higher up paths
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Envelope/Body" ), None )
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/stateName" ), None )
+		self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/ParameterQueryResponse/properties/missing" ), None )
+		self.assertRaises( Exception, XDAQTools.extract, PARAMETER_QUERY_RESPONSE, "/" )
+
+	def test_sameAsElementTree( self ) :
+		properties=ElementTree.fromstring( PARAMETER_QUERY_RESPONSE ).getchildren()[1].getchildren()[0].getchildren()[0]
+		for name in ["stateName","empty","mixed"] :
+			element=properties.find( "{urn:xdaq-application:GlibSupervisor}"+name )
+			self.assertEqual( XDAQTools.extract( PARAMETER_QUERY_RESPONSE, "Body/ParameterQueryResponse/properties/"+name ), element.text )
+
+	def test_extractAll( self ) :
+		paths=["Body/ParameterQueryResponse/properties/mixed/child", "Body/ParameterQueryResponse/properties/missing", "Body/ParameterQueryResponse/properties/stateName"]
+		self.assertEqual( XDAQTools.extractAll( PARAMETER_QUERY_RESPONSE, paths ), ["child",None,"Halted"] )
+
+	def test_laterSiblingMatches( self ) :
+		response="<root><a><c>wrong branch</c></a><a><b>found</b></a></root>"
+		self.assertEqual( XDAQTools.extract( response, "a/b" ), "found" )
+		self.assertEqual( XDAQTools.extract( response, "a/c" ), "wrong branch" )
+
+class TestStartCommandMessage( unittest.TestCase ) :
+	def setUp( self ) :
+		self.directory=tempfile.mkdtemp()
+		self.configFilename=os.path.join( self.directory, "config.xml" )
+		self._writeConfig( "<first/>", 1000000000 )
+
+	def tearDown( self ) :
+		shutil.rmtree( self.directory )
+
+	def _writeConfig( self, contents, modificationTime ) :
+		configFile=open( self.configFilename, "w" )
+		try :
+			configFile.write( contents )
+		finally :
+			configFile.close()
+		os.utime( self.configFilename, (modificationTime,modificationTime) )
+
+	def test_messageIsReused( self ) :
+		message=XDAQTools.soapStartCommandMessage( 40000, self.configFilename, ENVIRONMENT )
+		self.assertTrue( "<first/>" in message )
+		self.assertTrue( "-p 40000" in message )
+		self.assertTrue( XDAQTools.soapStartCommandMessage( 40000, self.configFilename, dict(ENVIRONMENT) ) is message )
+		self.assertEqual( message, XDAQTools.soapEnvelope( XDAQTools.soapStartCommandBody(40000,self.configFilename,ENVIRONMENT) ) )
+
+	def test_changedConfigFileIsReadAgain( self ) :
+		XDAQTools.soapStartCommandMessage( 40000, self.configFilename, ENVIRONMENT )
+		self._writeConfig( "<second/>", 1000000001 )
+		message=XDAQTools.soapStartCommandMessage( 40000, self.configFilename, ENVIRONMENT )
+		self.assertTrue( "<second/>" in message )
+		self.assertFalse( "<first/>" in message )
+
+	def test_changedEnvironmentMakesANewMessage( self ) :
+		message=XDAQTools.soapStartCommandMessage( 40000, self.configFilename, ENVIRONMENT )
+		environment=dict( ENVIRONMENT )
+		environment['SCRATCH']="/scratch"
+		changedMessage=XDAQTools.soapStartCommandMessage( 40000, self.configFilename, environment )
+		self.assertTrue( 'SCRATCH="/scratch"' in changedMessage )
+		self.assertTrue( 'SCRATCH="/tmp"' in message )
+		# Each port gets its own message
+		self.assertTrue( "-p 40001" in XDAQTools.soapStartCommandMessage( 40001, self.configFilename, ENVIRONMENT ) )
+
+if __name__ == '__main__':
+	unittest.main()
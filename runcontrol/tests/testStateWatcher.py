@@ -0,0 +1,90 @@
+import unittest, threading, time
+from pythonlib.XDAQTools import StateWatcher
+from tests.simulatedBoard import SimulatedBoard
+
+class TestStateWatcher( unittest.TestCase ) :
+	def setUp( self ) :
+		# State transitions take a while, like the real thing
+		self.board=SimulatedBoard( transitionDelay=0.2 )
+		self.supervisor=self.board.supervisorApplication
+		# The streamer only reports its state on its status page
+		self.streamer=self.board.streamer()
+		self.watcher=StateWatcher()
+
+	def tearDown( self ) :
+		self.board.stop()
+
+	def test_zeroTimeoutWhenAlreadyInState( self ) :
+		states=self.watcher.wait( [self.supervisor], lambda state : state=="Initial", 0 )
+		self.assertEqual( states, {self.supervisor:"Initial"} )
+		self.supervisor.waitForState( "Initial", 0 )
+
+	def test_zeroTimeoutWhenNotInState( self ) :
+		startTime=time.time()
+		self.assertRaises( Exception, self.watcher.wait, [self.supervisor], lambda state : state=="Halted", 0 )
+		self.assertRaises( Exception, self.supervisor.waitForState, "Halted", 0 )
+		self.assertTrue( time.time()-startTime<0.5 )
+
+	def test_waitsForTransition( self ) :
+		startTime=time.time()
+		self.supervisor.sendCommand( "Initialise" )
+		states=self.watcher.wait( [self.supervisor], lambda state : state=="Halted", 5.0 )
+		self.assertEqual( states, {self.supervisor:"Halted"} )
+		self.assertTrue( time.time()-startTime>=0.2 )
+		self.assertTrue( time.time()-startTime<1.0 )
+
+	def test_timeout( self ) :
+		startTime=time.time()
+		try :
+			self.watcher.wait( [self.supervisor], lambda state : state=="Enabled", 0.3, "Never enabled" )
+			self.fail( "No exception raised" )
+		except Exception as error :
+			self.assertEqual( str(error), "Never enabled" )
+		self.assertTrue( time.time()-startTime>=0.3 )
+		self.assertTrue( time.time()-startTime<1.0 )
+		# Giving up leaves nothing behind for the poller
+		self.assertEqual( self.watcher._waiters, [] )
+
+	def test_severalWaiters( self ) :
+		results={}
+		def waitFor( name, applications, state ) :
+			try :
+				results[name]=self.watcher.wait( applications, lambda applicationState : applicationState==state, 5.0 )
+			except Exception as error :
+				results[name]=error
+		self.supervisor.sendCommand( "Initialise" )
+		self.streamer.sendCommand( "configure" )
+		threads=[ threading.Thread( target=waitFor, args=("supervisor",[self.supervisor],"Halted") ),
+			threading.Thread( target=waitFor, args=("streamer",[self.streamer],"Configured") ),
+			threading.Thread( target=waitFor, args=("never",[self.supervisor],"Enabled") ) ]
+		for thread in threads : thread.start()
+		threads[0].join()
+		threads[1].join()
+		self.assertEqual( results["supervisor"], {self.supervisor:"Halted"} )
+		self.assertEqual( results["streamer"], {self.streamer:"Configured"} )
+		self.supervisor.sendCommand( "Configure" )
+		self.watcher.wait( [self.supervisor], lambda state : state=="Configured", 5.0 )
+		self.supervisor.sendCommand( "Enable" )
+		threads[2].join()
+		self.assertEqual( results["never"], {self.supervisor:"Enabled"} )
+
+	def test_probeErrorsAreRaised( self ) :
+		calls=[]
+		def probe( application ) :
+			calls.append( application )
+			# The first call is the check before waiting; fail in the poller
+			if len(calls)>1 : raise ValueError( "Probe failed" )
+			return application.getState()
+		self.watcher.probe=probe
+		self.assertRaises( ValueError, self.watcher.wait, [self.supervisor], lambda state : state=="Halted", 5.0 )
+		# The poller stops when nobody is waiting, and a new one starts for the next wait
+		self.watcher.probe=lambda application : application.getState()
+		self.supervisor.sendCommand( "Initialise" )
+		self.assertEqual( self.watcher.wait( [self.supervisor], lambda state : state=="Halted", 5.0 ), {self.supervisor:"Halted"} )
+
+	def test_uncontactable( self ) :
+		self.board.simulator.stop()
+		self.watcher.wait( [self.supervisor,self.streamer], lambda state : state=="<uncontactable>", 5.0 )
+
+if __name__ == '__main__':
+	unittest.main()
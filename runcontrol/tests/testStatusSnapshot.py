@@ -0,0 +1,66 @@
+import unittest, time
+from pythonlib.GlibStreamerApplication import GlibStreamerApplication
+from tests.simulatedBoard import SimulatedBoard
+
+class TestStatusSnapshot( unittest.TestCase ) :
+	def setUp( self ) :
+		self.board=SimulatedBoard( triggerRate=200 )
+		self.streamer=self.board.streamer()
+		# Count how many times the status page is fetched
+		self.pagesFetched=0
+		statusPage=self.board.simulatedStreamer.statusPage
+		def countingStatusPage() :
+			self.pagesFetched+=1
+			return statusPage()
+		self.board.simulatedStreamer.statusPage=countingStatusPage
+
+	def tearDown( self ) :
+		self.board.stop()
+
+	def test_defaultCacheTime( self ) :
+		self.assertEqual( GlibStreamerApplication.snapshotCacheTime, 0.05 )
+		snapshot=self.streamer.statusSnapshot()
+		self.assertEqual( (snapshot['state'],snapshot['acquisitionState'],snapshot['eventNumber'],snapshot['rate']), ("Halted","Stopped",None,None) )
+		time.sleep( 0.06 )
+		self.streamer.statusSnapshot()
+		self.assertEqual( self.pagesFetched, 2 )
+
+	def test_pollingOnlyFetchesOnce( self ) :
+		# Longer than the default so that a slow machine doesn't make this fail
+		self.streamer.snapshotCacheTime=1.0
+		self.assertEqual( self.streamer.getState(), "Halted" )
+		self.assertEqual( self.streamer.acquisitionState(), "Stopped" )
+		self.assertEqual( self.streamer.acquisitionStateAndEvent(), ["Stopped",None] )
+		self.assertEqual( self.pagesFetched, 1 )
+		# Asking for something newer fetches it again
+		self.streamer.statusSnapshot( maximumAge=0 )
+		self.assertEqual( self.pagesFetched, 2 )
+
+	def test_commandsInvalidate( self ) :
+		self.streamer.snapshotCacheTime=10.0
+		self.assertEqual( self.streamer.getState(), "Halted" )
+		self.streamer.sendCommand( "configure" )
+		self.assertEqual( self.streamer.getState(), "Configured" )
+		self.assertEqual( self.pagesFetched, 2 )
+		self.streamer.forgetStatusSnapshot()
+		self.assertEqual( self.streamer.getState(), "Configured" )
+		self.assertEqual( self.pagesFetched, 3 )
+
+	def test_rateWhileTakingData( self ) :
+		self.streamer.stageNumberOfEvents( 100000 )
+		self.streamer.commitParameters()
+		self.streamer.sendCommand( "configure" )
+		self.streamer.sendCommand( "start" )
+		first=self.streamer.statusSnapshot()
+		self.assertEqual( first['acquisitionState'], "Running" )
+		self.assertEqual( first['rate'], None ) # Nothing to compare with yet
+		time.sleep( 0.2 )
+		second=self.streamer.statusSnapshot()
+		self.assertTrue( second['eventNumber']>first['eventNumber'] )
+		self.assertTrue( second['rate']>0 )
+		self.assertEqual( self.streamer.acquisitionStateAndEvent(), ["Running",str(second['eventNumber'])] )
+		self.streamer.sendCommand( "stop" )
+		self.assertEqual( self.streamer.statusSnapshot()['rate'], None )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,122 @@
+import unittest, os, shutil, tempfile, json
+from pythonlib import XDAQTools
+from pythonlib.XDAQTools import TransportStatistics, HTTPConnectionPool
+from tests.testHTTPConnectionPool import DroppingServer
+
+class TestTransportStatistics( unittest.TestCase ) :
+	def setUp( self ) :
+		self.statistics=TransportStatistics()
+
+	def _result( self, target, command ) :
+		for result in self.statistics.results() :
+			if result["target"]==target and result["command"]==command : return result
+		return None
+
+	def test_countsAddUp( self ) :
+		self.statistics.record( "GlibSupervisor:0", "ParameterQuery", 0.002, bytesSent=100, bytesReceived=1000 )
+		self.statistics.record( "GlibSupervisor:0", "ParameterQuery", 0.004, bytesSent=110, bytesReceived=900, retries=1 )
+		self.statistics.record( "GlibSupervisor:0", "ParameterQuery", 0.003, bytesSent=120, retries=2, failed=True )
+		self.statistics.record( "GlibStreamer:0", "ParameterQuery", 0.5 )
+		result=self._result( "GlibSupervisor:0", "ParameterQuery" )
+		self.assertEqual( result["calls"], 3 )
+		self.assertEqual( result["failures"], 1 )
+		self.assertEqual( result["retries"], 3 )
+		self.assertEqual( result["bytesSent"], 330 )
+		self.assertEqual( result["bytesReceived"], 1900 )
+		self.assertAlmostEqual( result["totalTime"], 0.009 )
+		self.assertAlmostEqual( result["meanTime"], 0.003 )
+		self.assertEqual( (result["minimumTime"],result["maximumTime"]), (0.002,0.004) )
+		self.assertEqual( sum(result["histogram"]), 3 )
+		# Slowest in total first
+		self.assertEqual( [result["target"] for result in self.statistics.results()], ["GlibStreamer:0","GlibSupervisor:0"] )
+
+	def test_histogram( self ) :
+		self.statistics.record( "target", "command", 0.0 )
+		self.statistics.record( "target", "command", TransportStatistics.binEdges[3] )
+		self.statistics.record( "target", "command", 1000.0 )
+		histogram=self._result( "target", "command" )["histogram"]
+		self.assertEqual( len(histogram), len(TransportStatistics.binEdges)+1 )
+		self.assertEqual( (histogram[0],histogram[3],histogram[-1]), (1,1,1) )
+
+	def test_timer( self ) :
+		with self.statistics.timer( "target", "fine" ) : pass
+		try :
+			with self.statistics.timer( "target", "broken" ) : raise ValueError( "broken" )
+		except ValueError :
+			pass
+		self.assertEqual( self._result( "target", "fine" )["failures"], 0 )
+		self.assertEqual( self._result( "target", "broken" )["failures"], 1 )
+
+	def test_disabledAndReset( self ) :
+		self.statistics.enabled=False
+		self.statistics.record( "target", "command", 0.1 )
+		self.assertEqual( self.statistics.results(), [] )
+		self.statistics.enabled=True
+		self.statistics.record( "target", "command", 0.1 )
+		self.assertEqual( len(self.statistics.results()), 1 )
+		self.statistics.reset()
+		self.assertEqual( self.statistics.results(), [] )
+
+	def test_resultsAreCopies( self ) :
+		self.statistics.record( "target", "command", 0.1 )
+		self.statistics.results()[0]["histogram"][0]+=100
+		self.assertEqual( sum(self._result( "target", "command" )["histogram"]), 1 )
+
+	def test_summaryAndDump( self ) :
+		self.statistics.record( "GlibStreamer:0", "POST validParam", 0.01, bytesSent=2048, retries=2 )
+		lines=self.statistics.summary().split( "\n" )
+		self.assertEqual( len(lines), 2 )
+		self.assertTrue( lines[1].startswith( "GlibStreamer:0" ) )
+		self.assertTrue( "POST validParam" in lines[1] )
+		directory=tempfile.mkdtemp()
+		try :
+			filename=os.path.join( directory, "statistics.json" )
+			self.statistics.dump( filename )
+			dumped=json.load( open(filename) )
+			self.assertEqual( dumped["binEdges"], TransportStatistics.binEdges )
+			self.assertEqual( dumped["results"][0]["retries"], 2 )
+			self.assertEqual( dumped["results"][0]["bytesSent"], 2048 )
+		finally :
+			shutil.rmtree( directory )
+
+class TestConnectionPoolStatistics( unittest.TestCase ) :
+	def setUp( self ) :
+		self._previousStatistics=XDAQTools.statistics
+		XDAQTools.statistics=TransportStatistics()
+		self.pool=HTTPConnectionPool()
+		self.server=DroppingServer()
+
+	def tearDown( self ) :
+		self.pool.close()
+		self.server.stop()
+		XDAQTools.statistics=self._previousStatistics
+
+	def _result( self, command ) :
+		for result in XDAQTools.statistics.results() :
+			if result["command"]==command : return result
+		return None
+
+	def test_retriesAndBytesAreCounted( self ) :
+		self.pool.request( "127.0.0.1", self.server.port, "POST", "/first", "a=1", label=("server","first") )
+		# The reused connection is dropped after sending, so this is sent again on a new one
+		self.pool.request( "127.0.0.1", self.server.port, "POST", "/query", "abc=2", idempotent=True, label=("server","query") )
+		first=self._result( "first" )
+		self.assertEqual( (first["calls"],first["retries"],first["failures"]), (1,0,0) )
+		self.assertEqual( (first["bytesSent"],first["bytesReceived"]), (3,2) )
+		query=self._result( "query" )
+		self.assertEqual( (query["calls"],query["retries"],query["failures"]), (1,1,0) )
+		self.assertEqual( (query["bytesSent"],query["bytesReceived"]), (5,2) )
+
+	def test_failuresAreCounted( self ) :
+		self.pool.request( "127.0.0.1", self.server.port, "POST", "/first", "a=1", label=("server","first") )
+		self.assertRaises( Exception, self.pool.request, "127.0.0.1", self.server.port, "POST", "/second", "ab=2", label=("server","second") )
+		second=self._result( "second" )
+		self.assertEqual( (second["calls"],second["retries"],second["failures"]), (1,0,1) )
+		self.assertEqual( (second["bytesSent"],second["bytesReceived"]), (4,0) )
+
+	def test_unlabelledRequestsAreNotRecorded( self ) :
+		self.pool.request( "127.0.0.1", self.server.port, "GET", "/page" )
+		self.assertEqual( XDAQTools.statistics.results(), [] )
+
+if __name__ == '__main__':
+	unittest.main()